@@ -0,0 +1,136 @@
+import os
+import threading
+
+import versions
+
+# numpy is about a sixth of main.py's import time and only these reports use it, so the first load() (or the
+# warm-up) imports it
+np = None
+
+ANALYTICS_TOP_MAX = int(os.getenv("ANALYTICS_TOP_MAX", "100"))
+# writes made through the app bump these; the ProductRevenueTotals fingerprint catches order lines
+# written behind its back, since the revenue triggers keep that table current
+TAGS = ("categories", "orders", "products")
+DIMENSIONS = ("category", "supplier", "country", "month")
+METRICS = ("revenue", "quantity", "orders")
+
+# same line revenue as /products/{id}/orders, rounded only once it has been summed
+LINES = '''SELECT od.OrderID, od.ProductID, od.Quantity, od.UnitPrice * od.Quantity * (1 - od.Discount),
+                  IFNULL(p.CategoryID, 0), IFNULL(p.SupplierID, 0), o.CustomerID,
+                  IFNULL(c.Country, ''), IFNULL(substr(o.OrderDate, 1, 7), '')
+           FROM "Order Details" od
+                  JOIN Orders o ON o.OrderID = od.OrderID
+                  JOIN Products p ON p.ProductID = od.ProductID
+                  JOIN Customers c ON c.CustomerID = o.CustomerID'''
+NAMES = {
+    "product": "SELECT ProductID, ProductName FROM Products",
+    "category": "SELECT CategoryID, CategoryName FROM Categories",
+    "supplier": "SELECT SupplierID, CompanyName FROM Suppliers",
+    "customer": "SELECT CustomerID, CompanyName FROM Customers",
+}
+FINGERPRINT = "SELECT COUNT(*), TOTAL(orders), TOTAL(quantity), TOTAL(revenue) FROM ProductRevenueTotals"
+
+
+class OrderLines:
+    # one array per column, element i of every array belongs to the same order line;
+    # each key column is factorized once into (distinct keys, code per line) so group-bys are a bincount
+    def __init__(self, rows, names):
+        order, product, quantity, revenue, category, supplier, customer, country, month = list(zip(*rows)) or [()] * 9
+        self.names = names
+        self.quantity = np.array(quantity, dtype=np.int64)
+        self.revenue = np.array(revenue, dtype=np.float64)
+        self.keys = {
+            "order": np.unique(np.array(order, dtype=np.int64), return_inverse=True),
+            "product": np.unique(np.array(product, dtype=np.int64), return_inverse=True),
+            "category": np.unique(np.array(category, dtype=np.int64), return_inverse=True),
+            "supplier": np.unique(np.array(supplier, dtype=np.int64), return_inverse=True),
+            "customer": np.unique(np.array(customer, dtype=str), return_inverse=True),
+            "country": np.unique(np.array(country, dtype=str), return_inverse=True),
+            "month": np.unique(np.array(month, dtype=str), return_inverse=True),
+        }
+
+    def aggregate(self, by):
+        keys, codes = self.keys[by]
+        groups = len(keys)
+        order_count = max(len(self.keys["order"][0]), 1)
+        # an order counts once per group however many of its lines fall into it
+        pairs = np.unique(codes * order_count + self.keys["order"][1])
+        return keys, {
+            "orders": np.bincount(pairs // order_count, minlength=groups),
+            "quantity": np.bincount(codes, weights=self.quantity, minlength=groups),
+            "revenue": np.bincount(codes, weights=self.revenue, minlength=groups),
+        }
+
+    def rows(self, by, keys, totals, indices):
+        names = self.names.get(by)
+        result = []
+        for i in indices:
+            key = keys[i].item()
+            row = {"id": key, "name": names.get(key)} if names is not None else {by: key}
+            row.update(orders=int(totals["orders"][i]), quantity=int(totals["quantity"][i]),
+                       revenue=round(float(totals["revenue"][i]), 2))
+            result.append(row)
+        return result
+
+
+def import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+def load(connection):
+    import_numpy()
+    names = {by: dict(connection.execute(query).fetchall()) for by, query in NAMES.items()}
+    return OrderLines(connection.execute(LINES).fetchall(), names)
+
+
+class OrderLinesCache:
+    def __init__(self):
+        self._state = None
+        self._lines = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def check(self, connection):
+        # runs on a pool reader before the ETag and response cache checks: order lines written behind the app's
+        # back bump "orders" like a write through the app, which moves the ETag and drops the cached reports
+        fingerprint = tuple(connection.execute(FINGERPRINT).fetchone())
+        with self._lock:
+            changed = self._fingerprint is not None and fingerprint != self._fingerprint
+            self._fingerprint = fingerprint
+        if changed:
+            versions.table_versions.bump("orders")
+
+    def current(self, connection):
+        # runs on a pool reader; reloads the columns only when a write happened since the last load
+        state = (tuple(versions.table_versions.version(tag) for tag in TAGS),
+                 tuple(connection.execute(FINGERPRINT).fetchone()))
+        with self._lock:
+            if state != self._state:
+                self._lines = load(connection)
+                self._state = state
+            return self._lines
+
+
+order_lines = OrderLinesCache()
+
+
+def revenue_by(lines, by):
+    keys, totals = lines.aggregate(by)
+    indices = np.arange(len(keys)) if by == "month" else np.argsort(-totals["revenue"], kind="stable")
+    return lines.rows(by, keys, totals, indices)
+
+
+def top_products(lines, limit, metric="revenue"):
+    keys, totals = lines.aggregate("product")
+    return lines.rows("product", keys, totals, np.argsort(-totals[metric], kind="stable")[:limit])
+
+
+def customer_lifetime_value(lines, limit):
+    keys, totals = lines.aggregate("customer")
+    result = lines.rows("customer", keys, totals, np.argsort(-totals["revenue"], kind="stable")[:limit])
+    for row in result:
+        row["average_order"] = round(row["revenue"] / row["orders"], 2)
+    return result
@@ -0,0 +1,336 @@
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha512
+
+from sqlalchemy.engine import make_url
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Boots the app with uvicorn on private copies of northwind.db and of the SQLAlchemy database (when that is a
+# sqlite file), drives every route at a fixed concurrency for a fixed time and writes throughput, latency
+# percentiles and server memory as JSON. With --compare the run fails when a route got slower than the baseline.
+#
+#   SQLALCHEMY_DATABASE_URL=postgresql://... python benchmarks/load_test.py --output results.json
+#   python benchmarks/load_test.py --database-url sqlite:////tmp/pg.db --compare results.json --threshold 0.15
+#   python benchmarks/load_test.py --database-url sqlite:////tmp/pg.db --replica-url sqlite:////tmp/pg.db
+#
+# The clients are threads in this process; keep --concurrency moderate or run the server on another core.
+
+Route = namedtuple("Route", ["name", "method", "path", "body", "headers", "expect"])
+
+BASIC_AUTH = {"Authorization": "Basic " + base64.b64encode(b"4dm1n:NotSoSecurePa$$").decode()}
+JSON = {"Content-Type": "application/json"}
+WRONG_HASH = sha512(b"not the password").hexdigest()
+
+
+def route(name, path, method="GET", body=None, headers=None, expect=(200,)):
+    if body is not None and not isinstance(body, str):
+        body, headers = json.dumps(body), {**JSON, **(headers or {})}
+    return Route(name, method, path, body, headers or {}, expect)
+
+
+# {token}, {session_token}, {category_id}, {supplier_id} and {slow_query_thresholds} are filled in by setup().
+# Every route is driven except POST /admin/profile: it samples the whole process for ?seconds=, so it would time
+# its own sleep and slow down the routes measured while it runs.
+ROUTES = [
+    # main.py
+    route("root", "/"),
+    route("hello_name", "/hello/benchmark"),
+    route("counter", "/counter"),
+    route("method_get", "/method"),
+    route("method_post", "/method", method="POST", expect=(201,)),
+    route("method_put", "/method", method="PUT"),
+    route("method_delete", "/method", method="DELETE"),
+    route("method_options", "/method", method="OPTIONS"),
+    # a matching hash answers 204 with a body, which uvicorn refuses to send; time the rejected path
+    route("auth", f"/auth?password=benchmark&password_hash={WRONG_HASH}", expect=(401,)),
+    route("register", "/register", method="POST", body={"name": "Jan", "surname": "Kowalski"}, expect=(201,)),
+    route("register_batch", "/register/batch", method="POST",
+          body=[{"name": "Jan", "surname": "Kowalski"}] * 10, expect=(201,)),
+    route("patient", "/patient/1"),
+    route("hello", "/hello"),
+    route("welcome_session", "/welcome_session?format=json", headers={"Cookie": "session_token={session_token}"}),
+    route("welcome_token", "/welcome_token?token={token}&format=json"),
+    # after the welcome routes: logging in again evicts the setup tokens once the store is full
+    route("login_session", "/login_session", method="POST", headers=BASIC_AUTH, expect=(201,)),
+    route("login_token", "/login_token", method="POST", headers=BASIC_AUTH, expect=(201,)),
+    route("logged_out", "/logged_out?format=json"),
+    route("ready", "/ready"),
+    route("stats_startup", "/stats/startup"),
+    route("stats_db_pool", "/stats/db_pool"),
+    route("stats_replicas", "/stats/replicas"),
+    route("stats_cache", "/stats/cache"),
+    route("stats_single_flight", "/stats/single_flight"),
+    route("metrics", "/metrics"),
+    route("admin_slow_queries", "/admin/slow_queries", headers=BASIC_AUTH),
+    # the thresholds it sets are the defaults, the routes after it log as before
+    route("admin_slow_queries_set", "/admin/slow_queries?{slow_query_thresholds}", method="PUT", headers=BASIC_AUTH),
+    # no profile is running, this times the 404
+    route("admin_profile_stop", "/admin/profile", method="DELETE", headers=BASIC_AUTH, expect=(404,)),
+    route("categories", "/categories"),
+    route("customers", "/customers"),
+    route("customers_ndjson", "/customers?stream=ndjson"),
+    route("customers_sparse", "/customers?fields=id,name&country=UK"),
+    route("product", "/products/1"),
+    route("employees", "/employees"),
+    route("employees_city", "/employees?order=city&limit=3"),
+    route("employees_sparse", "/employees?fields=first_name&country=UK"),
+    route("products_extended", "/products_extended"),
+    route("products_extended_ndjson", "/products_extended?stream=ndjson"),
+    route("products_extended_sparse", "/products_extended?fields=id,name&category_id=1&max_price=20"),
+    route("product_orders", "/products/59/orders"),
+    route("product_orders_summary", "/products/59/orders?summary=true"),
+    route("analytics_revenue_category", "/analytics/revenue?by=category"),
+    route("analytics_revenue_month", "/analytics/revenue?by=month"),
+    route("analytics_top_products", "/analytics/top_products?limit=10"),
+    route("analytics_customers", "/analytics/customers?limit=10"),
+    route("search", "/search?q=co"),
+    route("search_products", "/search?q=sir+rod&kind=products"),
+    route("category_create", "/categories", method="POST", body={"name": "Benchmark"}, expect=(201,)),
+    route("category_update", "/categories/{category_id}", method="PUT", body={"name": "Benchmarked"}),
+    # views.py
+    route("shippers", "/shippers"),
+    route("shipper", "/shippers/1"),
+    route("suppliers", "/suppliers"),
+    route("suppliers_page", "/suppliers?limit=5"),
+    route("suppliers_sparse", "/suppliers?fields=CompanyName,Phone&country=USA"),
+    route("supplier", "/suppliers/1"),
+    route("supplier_products", "/suppliers/12/products"),
+    route("supplier_create", "/suppliers", method="POST", body={"CompanyName": "Benchmark"}, expect=(201,)),
+    route("supplier_update", "/suppliers/{supplier_id}", method="PUT", body={"City": "Warsaw"}),
+    route("suppliers_bulk_create", "/suppliers/bulk", method="POST",
+          body=[{"CompanyName": "Benchmark"}] * 10, expect=(201,)),
+    route("suppliers_bulk_update", "/suppliers/bulk", method="PATCH",
+          body=[{"SupplierID": 1, "City": "Berlin"}, {"SupplierID": 2, "City": "Paris"}]),
+    # deletes only succeed once, afterwards they measure the 404 path
+    route("category_delete", "/categories/{category_id}", method="DELETE", expect=(200, 404)),
+    route("supplier_delete", "/suppliers/{supplier_id}", method="DELETE", expect=(204, 404)),
+    route("suppliers_bulk_delete", "/suppliers/bulk?ids={supplier_id}&ids=100000", method="DELETE"),
+    route("logout_token", "/logout_token?token={token}", expect=(303, 401), method="DELETE"),
+    route("logout_session", "/logout_session", method="DELETE", headers={"Cookie": "session_token={session_token}"},
+          expect=(303, 401)),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def private_database_url(url, workdir, name="sqlalchemy.db"):
+    # a sqlite stand-in is copied like northwind.db, so the write routes never touch the original
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database:
+        return url
+    copy = os.path.join(workdir, name)
+    shutil.copyfile(parsed.database, copy)
+    return str(parsed.set(database=copy))
+
+
+def start_server(args, workdir, port):
+    northwind = os.path.join(workdir, "northwind.db")
+    shutil.copyfile(args.northwind, northwind)
+    env = {**os.environ, "NORTHWIND_DB_PATH": northwind,
+           "SQLALCHEMY_DATABASE_URL": private_database_url(args.database_url, workdir),
+           "SQLALCHEMY_REPLICA_URLS": ",".join(private_database_url(url, workdir, f"replica_{index}.db")
+                                               for index, url in enumerate(args.replica_url))}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                               "--port", str(port), "--log-level", "warning"], cwd=REPO, env=env)
+    deadline = time.monotonic() + args.boot_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"server exited with {server.returncode} while booting")
+        try:
+            # 503 until the warm-up is through, so no route is measured against cold caches
+            status, _, _ = request("127.0.0.1", port, "GET", "/ready")
+            if status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.1)
+    server.kill()
+    raise SystemExit("server was not ready within --boot-timeout")
+
+
+def request(host, port, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.getheaders(), response.read()
+    finally:
+        connection.close()
+
+
+def setup(port):
+    # creates what the parameterized routes act on
+    context = {}
+    _, _, body = request("127.0.0.1", port, "POST", "/login_token", headers=BASIC_AUTH)
+    context["token"] = json.loads(body)["token"]
+    _, headers, _ = request("127.0.0.1", port, "POST", "/login_session", headers=BASIC_AUTH)
+    cookie = next(value for name, value in headers if name.lower() == "set-cookie")
+    context["session_token"] = cookie.split(";")[0].split("=", 1)[1]
+    _, _, body = request("127.0.0.1", port, "POST", "/categories", json.dumps({"name": "Benchmark"}), JSON)
+    context["category_id"] = json.loads(body)["id"]
+    _, _, body = request("127.0.0.1", port, "POST", "/suppliers", json.dumps({"CompanyName": "Benchmark"}), JSON)
+    context["supplier_id"] = json.loads(body)["SupplierID"]
+    _, _, body = request("127.0.0.1", port, "GET", "/admin/slow_queries", headers=BASIC_AUTH)
+    context["slow_query_thresholds"] = "&".join(f"{source}_ms={threshold}" for source, threshold
+                                                in json.loads(body)["thresholds_ms"].items() if threshold is not None)
+    return context
+
+
+def resolve(route, context):
+    return route._replace(path=route.path.format(**context),
+                          headers={name: value.format(**context) for name, value in route.headers.items()})
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def drive(port, route, concurrency, duration):
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        # one keep-alive connection per client, reopened after a failure
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        latencies, failures = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request(route.method, route.path, body=route.body, headers=route.headers)
+                response = connection.getresponse()
+                response.read()
+                failures += response.status not in route.expect
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+        connection.close()
+        return latencies, failures
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = [future.result() for future in [executor.submit(worker) for _ in range(concurrency)]]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(failures for _, failures in results),
+        "throughput": round(len(latencies) / elapsed, 1),
+        **{f"{name}_ms": round(1000 * percentile(latencies, fraction), 3) if latencies else None
+           for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        "max_ms": round(1000 * latencies[-1], 3) if latencies else None,
+    }
+
+
+def regressions(baseline, current, threshold):
+    found = []
+    for name, result in current["routes"].items():
+        base = baseline.get("routes", {}).get(name)
+        if not base or not base["requests"] or not result["requests"]:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            found.append(f"{name}: throughput {base['throughput']} -> {result['throughput']} req/s")
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            found.append(f"{name}: p95 {base['p95_ms']} -> {result['p95_ms']} ms")
+        if result["errors"] > base["errors"]:
+            found.append(f"{name}: errors {base['errors']} -> {result['errors']}")
+    return found
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="load test every route of the app and record latency percentiles")
+    parser.add_argument("--northwind", default=os.path.join(REPO, "northwind.db"), help="sqlite file for main.py")
+    parser.add_argument("--database-url", default=os.getenv("SQLALCHEMY_DATABASE_URL"),
+                        help="database for views.py, defaults to SQLALCHEMY_DATABASE_URL")
+    parser.add_argument("--replica-url", action="append", default=[],
+                        help="read replica for views.py, repeatable; a copy of --database-url works as a stand-in")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds spent on each route")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per route before its run")
+    parser.add_argument("--routes", nargs="*", help="only run routes whose name contains one of these")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed relative drop in throughput / rise in p95 against --compare")
+    parser.add_argument("--boot-timeout", type=float, default=30.0)
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("set SQLALCHEMY_DATABASE_URL or pass --database-url")
+
+    routes = [route for route in ROUTES if not args.routes or any(part in route.name for part in args.routes)]
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(args, workdir, port)
+        try:
+            context = setup(port)
+            results = {"meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                                "python": platform.python_version(), "concurrency": args.concurrency,
+                                "duration": args.duration, "rss_kb_start": rss_kb(server.pid)},
+                       "routes": {}}
+            for route in routes:
+                route = resolve(route, context)
+                for _ in range(args.warmup):
+                    request("127.0.0.1", port, route.method, route.path, route.body, route.headers)
+                result = drive(port, route, args.concurrency, args.duration)
+                result["rss_kb"] = rss_kb(server.pid)
+                results["routes"][route.name] = result
+                print(f"{route.name:<28}{result['throughput']:>10} req/s  p50 {result['p50_ms']} ms  "
+                      f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  errors {result['errors']}",
+                      file=sys.stderr)
+            results["meta"]["rss_kb_end"] = rss_kb(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as file:
+            found = regressions(json.load(file), results, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import queries  # noqa: E402
+import revenue  # noqa: E402
+import sqlite_pool  # noqa: E402
+
+# rows/s per endpoint for the handler code as it was before queries.py (a fresh lambda row_factory or
+# sqlite3.Row per call, xstr concatenation, SQL formatted per request) against the named queries,
+# both measured up to the rendered JSON body. /employees runs the original handler's query: the keyset
+# pagination commits changed its SQL along the way, and neither of their versions is a "before".
+
+
+def xstr(s):
+    if s is None:
+        return ''
+    return str(s)
+
+
+def legacy_categories(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = lambda cursor, col: {"id": col[0], "name": col[1]}
+    return cursor.execute("SELECT CategoryID, CategoryName FROM Categories").fetchall()
+
+
+def legacy_customers(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = lambda cursor, col: {"id": col[0],
+                                              "name": col[1],
+                                              "full_address": xstr(col[2]) + " "
+                                                              + xstr(col[3]) + " "
+                                                              + xstr(col[4]) + " "
+                                                              + xstr(col[5])}
+    return cursor.execute('''SELECT CustomerID, CompanyName, Address, PostalCode, City, Country
+                             FROM Customers''').fetchall()
+
+
+def legacy_employees(connection):
+    # the original handler's query for ?order=city: the sort column formatted in per request, no tie-break
+    order = "city"
+    cursor = connection.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(f"""SELECT EmployeeID id, LastName last_name, FirstName first_name, City city
+                          FROM Employees e
+                          ORDER BY {order}
+                          LIMIT :limit
+                          OFFSET :offset""", {"limit": 101, "offset": 0}).fetchall()
+
+
+def legacy_products_extended(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(
+        '''SELECT p.ProductID id, p.ProductName name, c.CategoryName category, s.CompanyName supplier
+           FROM Products p
+           JOIN Categories c ON p.CategoryID = c.CategoryID
+           JOIN Suppliers s ON p.SupplierID = s.SupplierID''').fetchall()
+
+
+def legacy_product_orders(connection):
+    cursor = connection.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(
+        '''SELECT OrderID id, customer, quantity, total_price
+           FROM ProductOrderRevenue
+           WHERE ProductID = :id
+           ORDER BY OrderID
+        ''', {"id": 59}).fetchall()
+
+
+ENDPOINTS = {
+    "/categories": (legacy_categories, lambda connection: queries.fetchall(connection, queries.CATEGORIES)),
+    "/customers": (legacy_customers, lambda connection: queries.fetchall(connection, queries.CUSTOMERS)),
+    "/employees?order=city": (legacy_employees,
+                              lambda connection: queries.fetchall(connection, queries.EMPLOYEES["city", False],
+                                                                  {"limit": 101, "offset": 0})),
+    "/products_extended": (legacy_products_extended,
+                           lambda connection: queries.fetchall(connection, queries.PRODUCTS_EXTENDED)),
+    "/products/59/orders": (legacy_product_orders,
+                            lambda connection: queries.fetchall(connection, queries.PRODUCT_ORDERS, {"id": 59})),
+}
+
+
+def rows_per_second(fn, connection, seconds):
+    rows = 0
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        result = fn(connection)
+        cache.render({"rows": result})
+        rows += len(result)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return rows / elapsed, calls / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rows/s of the sqlite handlers before and after queries.py")
+    parser.add_argument("--database", default=sqlite_pool.NORTHWIND_DB_PATH)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each endpoint and variant")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    # the revenue tables live in the database file, build them in a private in-memory copy
+    connection = sqlite3.connect(":memory:", cached_statements=sqlite_pool.SQLITE_CACHED_STATEMENTS)
+    sqlite3.connect(args.database).backup(connection)
+    connection.text_factory = sqlite_pool.decode_text
+    revenue.materialize(connection)
+
+    results = {}
+    for endpoint, (legacy, named) in ENDPOINTS.items():
+        assert cache.render(legacy(connection)) == cache.render(named(connection)), endpoint
+        before, _ = rows_per_second(legacy, connection, args.seconds)
+        after, _ = rows_per_second(named, connection, args.seconds)
+        results[endpoint] = {"before_rows_per_s": round(before), "after_rows_per_s": round(after),
+                             "speedup": round(after / before, 2)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'endpoint':<24}{'before rows/s':>16}{'after rows/s':>16}{'speedup':>10}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<24}{result['before_rows_per_s']:>16}{result['after_rows_per_s']:>16}"
+              f"{result['speedup']:>9}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import crud  # noqa: E402
+import database  # noqa: E402
+import schemas  # noqa: E402
+import serializers  # noqa: E402
+
+# objects/s for the supplier and product lists: from_orm validation + jsonable_encoder + json (what the
+# response_model path does) against the compiled serializers with the json fallback and with orjson.
+# Needs SQLALCHEMY_DATABASE_URL, like the app.
+
+
+def pydantic_render(model, objects):
+    return cache.render([model.from_orm(obj) for obj in objects])
+
+
+def compiled_render(dumps):
+    def render(model, objects):
+        serializer = serializers.compile_serializer(model)
+        return dumps([serializer(obj) for obj in objects])
+    return render
+
+
+def json_dumps(content):
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def objects_per_second(render, model, objects, seconds):
+    count = 0
+    start = time.perf_counter()
+    while True:
+        render(model, objects)
+        count += len(objects)
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return count / elapsed
+
+
+def load(repeat):
+    db = database.SessionLocal()
+    try:
+        suppliers = crud.get_suppliers(db)
+        products = []
+        for strategy in ("columns", "joined"):
+            products.extend((strategy, product) for supplier in suppliers
+                            for product in crud.get_products_from_supplier(db, supplier.SupplierID, strategy=strategy))
+        return {
+            "suppliers": (schemas.Supplier, suppliers * repeat),
+            "suppliers_simplified": (schemas.SupplierSimplified, suppliers * repeat),
+            "products_columns": (schemas.ProductFromSupplier,
+                                 [product for strategy, product in products if strategy == "columns"] * repeat),
+            "products_orm": (schemas.ProductFromSupplier,
+                             [product for strategy, product in products if strategy == "joined"] * repeat),
+        }
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="compare response_model serialization with serializers.py")
+    parser.add_argument("--repeat", type=int, default=100, help="how many copies of each list to serialize at once")
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    renderers = {"pydantic": pydantic_render, "compiled_json": compiled_render(json_dumps)}
+    if serializers.orjson is not None:
+        renderers["compiled_orjson"] = compiled_render(serializers.orjson.dumps)
+    results = {}
+    for name, (model, objects) in load(args.repeat).items():
+        expected = pydantic_render(model, objects)
+        for renderer, render in renderers.items():
+            assert render(model, objects) == expected, (name, renderer)
+        results[name] = {renderer: round(objects_per_second(render, model, objects, args.seconds))
+                         for renderer, render in renderers.items()}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'objects/s':<22}" + "".join(f"{renderer:>18}" for renderer in renderers))
+    for name, result in results.items():
+        print(f"{name:<22}" + "".join(f"{result[renderer]:>18}" for renderer in renderers))
+
+
+if __name__ == "__main__":
+    main()
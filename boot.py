@@ -0,0 +1,142 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# main.py imports this module first. With STARTUP_PROFILE=1 it times the import of every module loaded after it,
+# which /stats/startup reports next to the duration of each boot phase.
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "30"))
+
+BOOTING, WARM = "booting", "warm"
+
+logger = logging.getLogger(__name__)
+
+
+class TimedLoader:
+    # stands in for a module's loader while its body runs, then hands the real one back
+    def __init__(self, loader, profile):
+        self.loader = loader
+        self.profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        with self.profile.timing(module.__name__):
+            try:
+                self.loader.exec_module(module)
+            finally:
+                module.__loader__ = self.loader
+                if module.__spec__ is not None:
+                    module.__spec__.loader = self.loader
+
+
+class ImportProfile:
+    # a sys.meta_path finder that lets the real finders locate each module and wraps the loader they return;
+    # self time excludes the imports a module's body triggers, cumulative time includes them
+    def __init__(self):
+        self.modules = []
+        self._stacks = threading.local()
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    @contextmanager
+    def timing(self, name):
+        stack = self._stacks.__dict__.setdefault("stack", [])
+        # [children's cumulative time]; the parent's entry collects this module's total when it is done
+        stack.append([0.0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - start
+            children = stack.pop()[0]
+            if stack:
+                stack[-1][0] += total
+            self.modules.append((name, total - children, total))
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def report(self, top=STARTUP_PROFILE_TOP):
+        slowest = sorted(self.modules, key=lambda module: module[1], reverse=True)[:top]
+        return {
+            "modules_imported": len(self.modules),
+            "import_ms": round(1000 * sum(module[1] for module in self.modules), 3),
+            "slowest": [{"module": name, "self_ms": round(1000 * own, 3), "cumulative_ms": round(1000 * total, 3)}
+                        for name, own, total in slowest],
+        }
+
+
+class LazyModule:
+    # bound under a module's name by modules that only use it inside functions: the import happens on first
+    # attribute access, under the import system's per-module lock, so concurrent first uses still run it once
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        return getattr(importlib.import_module(self._name), name)
+
+
+class Readiness:
+    # booting until the startup event and the warm-up are through; each phase's duration is kept for the report
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = BOOTING
+        self.error = None
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(1000 * (time.perf_counter() - start), 3)
+
+    def imported(self):
+        # called by the startup event: everything since this module was imported, main.py's imports above all
+        self.phases["import"] = round(1000 * (time.perf_counter() - self.started), 3)
+
+    def warm(self, error=None):
+        # the profile stays installed until here, so it also times what the warm-up imports lazily. error is what
+        # cut the warm-up short, if anything; /ready is public, the traceback is in the log
+        profile.uninstall()
+        self.status = WARM
+        self.error = None if error is None else type(error).__name__
+        self.phases["total"] = round(1000 * (time.perf_counter() - self.started), 3)
+        logger.info("warm %.0f ms after boot: %s", self.phases["total"], self.phases)
+
+    def state(self):
+        return {"status": self.status, "error": self.error}
+
+    def report(self):
+        return {**self.state(), "phases_ms": self.phases,
+                "imports": profile.report() if STARTUP_PROFILE else None}
+
+
+profile = ImportProfile()
+if STARTUP_PROFILE:
+    profile.install()
+
+readiness = Readiness()
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+import metrics
+import versions
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+
+CacheEntry = namedtuple("CacheEntry", ["expires", "body", "headers", "tags"])
+
+
+def cache_key(request):
+    return versions.request_key(request)
+
+
+def render(content):
+    # same encoding as JSONResponse.render, done once when the entry is stored
+    with metrics.Stopwatch("serialization"):
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for tag in entry.tags:
+            self._tags[tag].discard(key)
+            if not self._tags[tag]:
+                del self._tags[tag]
+
+    def get(self, request):
+        key = cache_key(request)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                # remember which generation the miss saw, so a write that lands while the
+                # query runs keeps the now stale result out of the cache
+                request.state.cache_generation = self._generation
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return Response(entry.body, media_type="application/json", headers=entry.headers)
+
+    def store(self, request, content, tags=(), headers=None):
+        # content may arrive already rendered to JSON bytes (see serializers.render)
+        body = content if isinstance(content, bytes) else render(content)
+        key = cache_key(request)
+        with self._lock:
+            if getattr(request.state, "cache_generation", None) == self._generation:
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = CacheEntry(time.monotonic() + self.ttl, body, headers, frozenset(tags))
+                for tag in tags:
+                    self._tags[tag].add(key)
+                while len(self._entries) > self.maxsize:
+                    self._remove(next(iter(self._entries)))
+                    self.evictions += 1
+        return Response(body, media_type="application/json", headers=headers)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+response_cache = ResponseCache()
+versions.table_versions.subscribe(response_cache.invalidate)
@@ -0,0 +1,105 @@
+import asyncio
+import bisect
+import os
+
+import cache
+import metrics
+import versions
+
+# the routes, by the names they pass to flights.run(), whose identical concurrent reads are coalesced: a comma
+# separated list, "*" for every route that can be, empty (the default) for none
+SINGLE_FLIGHT_ROUTES = frozenset(name.strip() for name in os.getenv("SINGLE_FLIGHT_ROUTES", "").split(",")
+                                 if name.strip())
+SINGLE_FLIGHT_BUCKETS = tuple(int(bound) for bound in
+                              os.getenv("SINGLE_FLIGHT_BUCKETS", "1,2,5,10,25,50,100,250").split(","))
+
+
+def key(request, tags=(), source=None):
+    # same path and query as far as the response cache is concerned, read from the same database (source is the
+    # session factory for ORM reads), and no write to the response's version tags or invalidation of the cache since
+    # the flight took off: a request arriving after a write never gets the result of a query that started before it
+    return (cache.cache_key(request), tuple(versions.table_versions.version(tag) for tag in tags),
+            getattr(request.state, "cache_generation", None), source)
+
+
+class Flight:
+    __slots__ = ("task", "requests")
+
+    def __init__(self, task):
+        self.task = task
+        self.requests = 0
+
+
+class RouteFlights:
+    __slots__ = ("flights", "requests", "largest", "buckets")
+
+    def __init__(self, size):
+        self.flights = 0
+        self.requests = 0
+        self.largest = 0
+        self.buckets = [0] * size
+
+
+class SingleFlight:
+    # identical reads that arrive while one is running wait for it instead of running their own: the first
+    # request's compute() runs as a task every request with the same key awaits. Everything happens on the event
+    # loop, so no locks; a cancelled request leaves the task running for the others.
+    def __init__(self, routes=SINGLE_FLIGHT_ROUTES, buckets=SINGLE_FLIGHT_BUCKETS):
+        self.routes = routes
+        self.buckets = buckets
+        self._flights = {}
+        self._routes = {}
+
+    def enabled(self, route):
+        return "*" in self.routes or route in self.routes
+
+    async def run(self, route, key, compute):
+        # compute() is the coroutine function doing the reads and the serialization, all requests get its result
+        # (or its exception)
+        if not self.enabled(route):
+            return await compute()
+        flight = self._flights.get((route, key))
+        if flight is None:
+            flight = self._flights[route, key] = Flight(asyncio.ensure_future(compute()))
+            flight.task.add_done_callback(lambda task: self._landed(route, key, flight))
+        flight.requests += 1
+        return await asyncio.shield(flight.task)
+
+    def _landed(self, route, key, flight):
+        if self._flights.get((route, key)) is flight:
+            del self._flights[route, key]
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = RouteFlights(len(self.buckets))
+        stats.flights += 1
+        stats.requests += flight.requests
+        stats.largest = max(stats.largest, flight.requests)
+        index = bisect.bisect_left(self.buckets, flight.requests)
+        if index < len(self.buckets):
+            stats.buckets[index] += 1
+
+    def stats(self):
+        return {
+            "routes": sorted(self.routes),
+            "in_flight": len(self._flights),
+            "flights": {route: {"flights": stats.flights, "requests": stats.requests,
+                                "shared": stats.requests - stats.flights, "largest": stats.largest}
+                        for route, stats in self._routes.items()},
+        }
+
+    def render(self):
+        lines = ["# HELP single_flight_requests Requests served by one coalesced execution.",
+                 "# TYPE single_flight_requests histogram"]
+        for route, stats in list(self._routes.items()):
+            labels = f'route="{metrics.label_value(route)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, stats.buckets):
+                cumulative += count
+                lines.append(f'single_flight_requests_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'single_flight_requests_bucket{{{labels},le="+Inf"}} {stats.flights}')
+            lines.append(f"single_flight_requests_sum{{{labels}}} {stats.requests}")
+            lines.append(f"single_flight_requests_count{{{labels}}} {stats.flights}")
+        return "\n".join(lines) + "\n"
+
+
+flights = SingleFlight()
@@ -0,0 +1,163 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+
+import database
+
+# memory:// counts per process, mmap:///path/counter.bin shares a file between the workers of one host,
+# a SQLAlchemy URL or "database" shares a table between hosts
+COUNTER_URL = os.getenv("COUNTER_URL", "memory://")
+# exact: every request does one atomic increment and gets a unique number back;
+# otherwise increments are batched locally and flushed to this process' stripe every COUNTER_FLUSH_INTERVAL
+COUNTER_EXACT = os.getenv("COUNTER_EXACT", "1") == "1"
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "0.5"))
+COUNTER_STRIPES = int(os.getenv("COUNTER_STRIPES", "16"))
+
+
+class SharedCounter(ABC):
+    def __init__(self, exact=COUNTER_EXACT, flush_interval=COUNTER_FLUSH_INTERVAL, stripes=COUNTER_STRIPES):
+        self.exact = exact
+        self.flush_interval = flush_interval
+        self.stripes = stripes
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._total = 0
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def stripe(self):
+        # exact counts all go to stripe 0 so the value returned by the add is the total
+        return 0 if self.exact else os.getpid() % self.stripes
+
+    @abstractmethod
+    def _add(self, amount, stripe):
+        # -> the total after adding amount to the stripe
+        pass
+
+    def _flush(self):
+        amount, self._pending = self._pending, 0
+        self._total = self._add(amount, self.stripe)
+        self._last_flush = time.monotonic()
+
+    def increment(self):
+        with self._lock:
+            if self.exact:
+                return self._add(1, self.stripe)
+            self._pending += 1
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+            elif self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="counter-flush", daemon=True)
+                self._thread.start()
+            return self._total + self._pending
+
+    def _run(self):
+        # increments only flush on the next one otherwise: a process gone idle would keep its batch from the
+        # other workers for good
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush()
+
+    def close(self):
+        # the shutdown handler calls this, whatever is still batched reaches the shared stripe
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._pending:
+                self._flush()
+
+
+class MemoryCounter(SharedCounter):
+    def __init__(self):
+        super().__init__(exact=True)
+        self._value = 0
+
+    def _add(self, amount, stripe):
+        self._value += amount
+        return self._value
+
+
+class MmapCounter(SharedCounter):
+    SLOT_SIZE = 64  # one cache line per stripe, so workers on different stripes do not share a line
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        size = self.SLOT_SIZE * self.stripes
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _add(self, amount, stripe):
+        offset = stripe * self.SLOT_SIZE
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 8, offset)
+        try:
+            value = struct.unpack_from("q", self._map, offset)[0] + amount
+            struct.pack_into("q", self._map, offset, value)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 8, offset)
+        others = sum(struct.unpack_from("q", self._map, slot * self.SLOT_SIZE)[0]
+                     for slot in range(self.stripes) if slot != stripe)
+        return value + others
+
+    def close(self):
+        super().close()
+        self._map.close()
+        os.close(self._fd)
+
+
+class SQLCounter(SharedCounter):
+    def __init__(self, engine, name="counter", **kwargs):
+        super().__init__(**kwargs)
+        self.engine = engine
+        self.name = name
+        self._created = False
+
+    def _ensure_table(self):
+        if self._created:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE IF NOT EXISTS app_counters ("
+                                    "name VARCHAR(64) NOT NULL, shard INTEGER NOT NULL, "
+                                    "value BIGINT NOT NULL DEFAULT 0, PRIMARY KEY (name, shard))"))
+            for shard in range(self.stripes):
+                connection.execute(text("INSERT INTO app_counters (name, shard, value) VALUES (:name, :shard, 0) "
+                                        "ON CONFLICT DO NOTHING"), {"name": self.name, "shard": shard})
+        self._created = True
+
+    def _add(self, amount, stripe):
+        self._ensure_table()
+        parameters = {"name": self.name, "shard": stripe, "amount": amount}
+        with self.engine.begin() as connection:
+            if self.exact:
+                return connection.execute(text("UPDATE app_counters SET value = value + :amount "
+                                               "WHERE name = :name AND shard = :shard RETURNING value"),
+                                          parameters).scalar()
+            connection.execute(text("UPDATE app_counters SET value = value + :amount "
+                                    "WHERE name = :name AND shard = :shard"), parameters)
+            return connection.execute(text("SELECT sum(value) FROM app_counters WHERE name = :name"),
+                                      parameters).scalar()
+
+
+def create_counter(url=COUNTER_URL):
+    if url == "memory://":
+        return MemoryCounter()
+    if url.startswith("mmap://"):
+        return MmapCounter(urlparse(url).path)
+    return SQLCounter(database.shared_engine(url))
@@ -1,10 +1,21 @@
-from sqlalchemy.orm import Session
+import os
+from typing import List
+
+from sqlalchemy import Sequence, bindparam, insert, literal_column, select
+from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.sql.expression import func, update
 from fastapi import HTTPException
 
 # from . import models
-import models
+import boot
 import schemas
+import versions
+
+# models.py is among the slowest modules main.py imports and is only needed once a query runs
+models = boot.LazyModule("models")
+
+# "joined" / "selectin" eager-load Product.category, "columns" selects only what ProductFromSupplier needs
+PRODUCTS_LOADING_STRATEGY = os.getenv("PRODUCTS_LOADING_STRATEGY", "columns")
 
 
 def get_shippers(db: Session):
@@ -17,10 +28,23 @@ def get_shipper(db: Session, shipper_id: int):
     )
 
 
-def get_suppliers(db: Session):
-    return db.query(models.Supplier)\
-             .order_by(models.Supplier.SupplierID.asc())\
-             .all()
+# filter name -> the column it compares with, the only columns a /suppliers filter can reach
+SUPPLIER_FILTERS = {"country": "Country", "city": "City"}
+
+
+def get_suppliers(db: Session, limit: int = None, after_id: int = None, fields: tuple = None, filters: dict = None):
+    # fields: Supplier columns to load instead of whole objects, names already checked against schemas.Supplier
+    if fields:
+        query = db.query(*(models.Supplier.__table__.c[name] for name in fields))
+    else:
+        query = db.query(models.Supplier)
+    for name, value in (filters or {}).items():
+        query = query.filter(models.Supplier.__table__.c[SUPPLIER_FILTERS[name]] == value)
+    if after_id is not None:
+        query = query.filter(models.Supplier.SupplierID > after_id)
+    return query.order_by(models.Supplier.SupplierID.asc())\
+                .limit(limit)\
+                .all()
 
 
 def get_supplier(db: Session, id: int):
@@ -31,21 +55,89 @@ def get_supplier(db: Session, id: int):
     )
 
 
-def get_products_from_supplier(db: Session, id: int):
-    return (
-        db.query(models.Product)
-            .filter(models.Product.SupplierID == id)
-            .order_by(models.Product.ProductID.desc())
-            .all()
+def get_products_from_supplier(db: Session, id: int, limit: int = None, before_id: int = None,
+                               strategy: str = PRODUCTS_LOADING_STRATEGY):
+    if strategy == "columns":
+        query = db.query(models.Product.ProductID, models.Product.ProductName, models.Product.Discontinued,
+                         models.Category.CategoryID, models.Category.CategoryName)\
+                  .outerjoin(models.Product.category)
+    else:
+        loader = joinedload if strategy == "joined" else selectinload
+        query = db.query(models.Product).options(loader(models.Product.category))
+    query = query.filter(models.Product.SupplierID == id)
+    if before_id is not None:
+        query = query.filter(models.Product.ProductID < before_id)
+    products = (
+        query.order_by(models.Product.ProductID.desc())
+             .limit(limit)
+             .all()
     )
+    if strategy != "columns":
+        return products
+    return [
+        schemas.ProductFromSupplier(
+            ProductID=product.ProductID,
+            ProductName=product.ProductName,
+            Category=None if product.CategoryID is None else schemas.Category(CategoryID=product.CategoryID,
+                                                                             CategoryName=product.CategoryName),
+            Discontinued=product.Discontinued,
+        )
+        for product in products
+    ]
+
+
+SUPPLIER_ID_SEQUENCE = Sequence("suppliers_supplierid_seq")
+_supplier_sequence_synced = False
+
+
+def sync_supplier_sequence(db: Session):
+    # rows loaded from the Northwind dump carry explicit ids, so the sequence may still be behind max(SupplierID)
+    global _supplier_sequence_synced
+    if not _supplier_sequence_synced:
+        highest_id = db.query(func.max(models.Supplier.SupplierID)).scalar_subquery()
+        last_value = literal_column("(SELECT last_value FROM suppliers_supplierid_seq)")
+        db.execute(select(func.setval(SUPPLIER_ID_SEQUENCE.name, highest_id)).where(highest_id > last_value))
+        _supplier_sequence_synced = True
+
+
+def allocate_supplier_ids(db: Session, count: int):
+    sync_supplier_sequence(db)
+    return db.execute(
+        select(SUPPLIER_ID_SEQUENCE.next_value()).select_from(func.generate_series(1, count))
+    ).scalars().all()
+
+
+def insert_suppliers(db: Session, new_suppliers: List[schemas.NewSupplier]):
+    # -> the SupplierIDs given to new_suppliers, in order; the SupplierID they carry is ignored
+    rows = [new_supplier.dict(exclude={"SupplierID"}) for new_supplier in new_suppliers]
+    if db.get_bind().dialect.name == "postgresql":
+        ids = allocate_supplier_ids(db, len(rows))
+        db.execute(insert(models.Supplier), [{**row, "SupplierID": id} for row, id in zip(rows, ids)])
+        return ids
+    # the sqlite stand-in has no sequence, AUTOINCREMENT numbers the rows: the insert holds the database's write
+    # lock until commit, so the batch got the highest ids, one after the other
+    db.execute(insert(models.Supplier), rows)
+    highest_id = db.query(func.max(models.Supplier.SupplierID)).scalar()
+    return list(range(highest_id - len(rows) + 1, highest_id + 1))
 
 
 def create_supplier(db: Session, new_supplier: schemas.NewSupplier):
-    highest_id = db.query(func.max(models.Supplier.SupplierID)).scalar()
-    new_supplier.SupplierID = highest_id + 1
-    db.add(models.Supplier(**new_supplier.dict()))
+    id = insert_suppliers(db, [new_supplier])[0]
+    db.commit()
+    versions.table_versions.bump("suppliers")
+    return get_supplier(db, id)
+
+
+def create_suppliers(db: Session, new_suppliers: List[schemas.NewSupplier]):
+    ids = insert_suppliers(db, new_suppliers)
     db.commit()
-    return get_supplier(db, highest_id + 1)
+    versions.table_versions.bump("suppliers")
+    return (
+        db.query(models.Supplier)
+          .filter(models.Supplier.SupplierID.in_(ids))
+          .order_by(models.Supplier.SupplierID.asc())
+          .all()
+    )
 
 
 def update_supplier(db: Session, id: int, supplier_update: schemas.SupplierUpdate):
@@ -55,6 +147,7 @@ def update_supplier(db: Session, id: int, supplier_update: schemas.SupplierUpdat
                        .values(**properties_to_update)
     db.execute(update_statement)
     db.commit()
+    versions.table_versions.bump("suppliers", f"suppliers:{id}")
     return get_supplier(db, id)
 
 
@@ -66,3 +159,44 @@ def delete_supplier(db: Session, id: int):
       .filter(models.Supplier.SupplierID == id)\
       .delete()
     db.commit()
+    versions.table_versions.bump("suppliers", f"suppliers:{id}")
+
+
+def existing_supplier_ids(db: Session, ids: List[int]):
+    return set(db.execute(select(models.Supplier.SupplierID).where(models.Supplier.SupplierID.in_(ids))).scalars())
+
+
+def update_suppliers(db: Session, supplier_updates: List[schemas.SupplierBulkUpdate]):
+    existing_ids = existing_supplier_ids(db, [supplier_update.SupplierID for supplier_update in supplier_updates])
+    # one executemany UPDATE for the whole batch whatever columns each item sets: a column left out (None) is
+    # bound as NULL and COALESCE keeps the stored value, the same as leaving it out of the SET clause
+    columns = [column for column in schemas.SupplierBulkUpdate.__fields__ if column != "SupplierID"]
+    rows = []
+    results = []
+    for supplier_update in supplier_updates:
+        if supplier_update.SupplierID not in existing_ids:
+            results.append(schemas.BulkResult(SupplierID=supplier_update.SupplierID, status="not_found"))
+            continue
+        # bound under their own names: parameters named after a column would replace its SET expression
+        rows.append({"_id": supplier_update.SupplierID,
+                     **{f"_{column}": value for column, value in supplier_update.dict(include=set(columns)).items()}})
+        results.append(schemas.BulkResult(SupplierID=supplier_update.SupplierID, status="updated"))
+    if rows:
+        update_statement = update(models.Supplier) \
+                           .where(models.Supplier.SupplierID == bindparam("_id")) \
+                           .values({column: func.coalesce(bindparam(f"_{column}"), getattr(models.Supplier, column))
+                                    for column in columns})
+        db.execute(update_statement.execution_options(synchronize_session=False), rows)
+    db.commit()
+    versions.table_versions.bump("suppliers", *(f"suppliers:{id}" for id in existing_ids))
+    return results
+
+
+def delete_suppliers(db: Session, ids: List[int]):
+    existing_ids = existing_supplier_ids(db, ids)
+    db.query(models.Supplier)\
+      .filter(models.Supplier.SupplierID.in_(existing_ids))\
+      .delete(synchronize_session=False)
+    db.commit()
+    versions.table_versions.bump("suppliers", *(f"suppliers:{id}" for id in existing_ids))
+    return [schemas.BulkResult(SupplierID=id, status="deleted" if id in existing_ids else "not_found") for id in ids]
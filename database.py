@@ -1,18 +1,326 @@
+import itertools
+import logging
+import math
 import os
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+import versions
 
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# comma separated read replicas of SQLALCHEMY_DATABASE_URL for the routes that take read_db(); none keeps every
+# session on the primary. A replica is skipped while its health check fails or it lags more than REPLICA_MAX_LAG
+# seconds, REPLICA_LAG_QUERY replaces the per-dialect lag query (e.g. to fake lag on a sqlite stand-in).
+SQLALCHEMY_REPLICA_URLS = [url.strip() for url in os.getenv("SQLALCHEMY_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "2"))
+REPLICA_LAG_QUERY = os.getenv("REPLICA_LAG_QUERY")
+# reads stay on the primary this long after a write, both for the tables written through this process and for
+# the client that wrote (through any worker, by a cookie); by default the most a usable replica can be behind,
+# its lag plus the time since it was last measured
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", str(REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL)))
+PRIMARY_COOKIE = "db_primary_until"
+
+# seconds the replica is behind, 0 when it has replayed everything it received
+LAG_QUERIES = {
+    "postgresql": """SELECT CASE WHEN NOT pg_is_in_recovery()
+                                   OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                                 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END""",
+}
+
+# URLs such as postgresql+asyncpg://... get a native AsyncSession, everything else
+# keeps the blocking Session and is pushed to the threadpool by run()
+ASYNC_DRIVERS = ("asyncpg", "aiosqlite")
+
+
+def engine_options(url):
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    elif make_url(url).get_driver_name() not in ASYNC_DRIVERS:
+        # a session opened by a dependency is used from the threadpool, so the connection changes threads
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+ASYNC_ENGINE = make_url(SQLALCHEMY_DATABASE_URL).get_driver_name() in ASYNC_DRIVERS
+
+# engine, sync_engine and SessionLocal are built on first use rather than on import, so importing main does not
+# load the database driver; module attribute access goes through __getattr__ below until they exist
+ENGINE_ATTRIBUTES = ("engine", "sync_engine", "SessionLocal")
+_engine_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def create_engines(url):
+    # -> (engine, blocking engine on the same database, session factory)
+    if make_url(url).get_driver_name() in ASYNC_DRIVERS:
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+        engine = create_async_engine(url, **engine_options(url))
+        # blocking engine on the default driver of the same database, for helpers that are not async
+        sync_engine = create_engine(make_url(url).set(drivername=make_url(url).get_backend_name()),
+                                    **engine_options(url))
+        return engine, sync_engine, sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+    engine = create_engine(url, **engine_options(url))
+    return engine, engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def lazy(name):
+    if name not in globals():
+        with _engine_lock:
+            if name not in globals():
+                globals().update(zip(ENGINE_ATTRIBUTES, create_engines(SQLALCHEMY_DATABASE_URL)))
+    return globals()[name]
+
+
+def __getattr__(name):
+    if name in ENGINE_ATTRIBUTES:
+        return lazy(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# set by ReadYourWritesMiddleware for requests that can write; get_db marks it when the request opens a session
+_primary_sessions = ContextVar("primary_sessions", default=None)
+
+
+def opened_primary():
+    opened = _primary_sessions.get()
+    if opened is not None:
+        opened.append(True)
+
+
+if ASYNC_ENGINE:
+    # Dependency
+    async def get_db():
+        opened_primary()
+        async with lazy("SessionLocal")() as db:
+            yield db
+else:
+    # Dependency
+    def get_db():
+        opened_primary()
+        try:
+            db = lazy("SessionLocal")()
+            yield db
+        finally:
+            db.close()
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = make_url(url)
+        if (self.url.get_driver_name() in ASYNC_DRIVERS) != ASYNC_ENGINE:
+            raise ValueError(f"replica {self.url!r} has to be {'async' if ASYNC_ENGINE else 'blocking'} like the "
+                             "primary, the routes get the same kind of session from either")
+        self.engine, self.sync_engine, self.sessions = create_engines(url)
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked = None
+
+    @property
+    def usable(self):
+        return self.healthy and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    def check(self):
+        query = REPLICA_LAG_QUERY or LAG_QUERIES.get(self.sync_engine.dialect.name, "SELECT 0")
+        was_usable = self.usable
+        try:
+            with self.sync_engine.connect() as connection:
+                lag = connection.execute(text(query)).scalar()
+        except Exception as e:
+            self.healthy, self.lag, self.error = False, None, type(e).__name__
+            if was_usable:
+                logger.warning("replica %r failed its health check, reading from the primary", self.url, exc_info=True)
+        else:
+            # no lag figure (e.g. nothing replayed yet) counts as too far behind
+            self.healthy, self.lag, self.error = True, None if lag is None else float(lag), None
+            if was_usable and not self.usable:
+                logger.warning("replica %r is %s seconds behind, reading from the primary", self.url, self.lag)
+            elif self.usable and not was_usable and self.checked is not None:
+                logger.info("replica %r is usable again", self.url)
+        self.checked = time.time()
+
+    def stats(self):
+        return {"url": repr(self.url), "healthy": self.healthy, "lag": self.lag, "usable": self.usable,
+                "error": self.error, "checked": self.checked}
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+class ReplicaSet:
+    # the replicas and a daemon thread re-checking them every REPLICA_CHECK_INTERVAL; reads go round robin over
+    # the usable ones
+    def __init__(self, urls=SQLALCHEMY_REPLICA_URLS, interval=REPLICA_CHECK_INTERVAL):
+        self.urls = urls
+        self.interval = interval
+        self.replicas = []
+        self.routed = Counter()
+        self._routed_lock = threading.Lock()
+        self._turn = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
 
-# Dependency
-def get_db():
+    def start(self):
+        # blocking, the first round of checks runs before any read is routed
+        if not self.urls or self._thread is not None:
+            return
+        self.replicas = [Replica(url) for url in self.urls]
+        self.check()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        for replica in self.replicas:
+            replica.sync_engine.dispose()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self):
+        for replica in self.replicas:
+            replica.check()
+
+    def route(self, request, tags):
+        # -> (where the read goes, the replica or None for the primary)
+        now = time.time()
+        try:
+            wrote = float(request.cookies.get(PRIMARY_COOKIE, 0)) > now
+        except ValueError:
+            wrote = False
+        if wrote or now - versions.table_versions.modified(tags) < READ_YOUR_WRITES_SECONDS:
+            return "primary_after_write", None
+        usable = [replica for replica in self.replicas if replica.usable]
+        if not usable:
+            return "primary_fallback", None
+        return "replica", usable[next(self._turn) % len(usable)]
+
+    def sessions(self, request, tags):
+        # -> session factory for a read: the primary's right after a write, or when no replica is usable
+        if not self.replicas:
+            return lazy("SessionLocal")
+        routed, replica = self.route(request, tags)
+        with self._routed_lock:
+            self.routed[routed] += 1
+        return lazy("SessionLocal") if replica is None else replica.sessions
+
+    def stats(self):
+        with self._routed_lock:
+            routed = dict(self.routed)
+        return {"replicas": [replica.stats() for replica in self.replicas], "max_lag": REPLICA_MAX_LAG,
+                "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS, "routed": routed}
+
+
+replicas = ReplicaSet()
+
+
+def read_db(*tags):
+    # dependency for routes that only read: a replica session, unless one of tags (the version tags the route's
+    # response depends on) was written within READ_YOUR_WRITES_SECONDS. That also keeps rows a replica has not
+    # caught up on out of the response cache, whose entries the same tags invalidate.
+    if ASYNC_ENGINE:
+        async def dependency(request: Request):
+            async with replicas.sessions(request, tags)() as db:
+                yield db
+    else:
+        def dependency(request: Request):
+            db = replicas.sessions(request, tags)()
+            try:
+                yield db
+            finally:
+                db.close()
+    return dependency
+
+
+def read_sessions(*tags):
+    # dependency for routes that open their read sessions themselves (see read()): the session factory read_db
+    # would have opened the request's session from
+    async def dependency(request: Request):
+        return replicas.sessions(request, tags)
+    return dependency
+
+
+class ReadYourWritesMiddleware:
+    # pure ASGI: a successful request that could write and opened a primary session gets a cookie sending the
+    # client's reads to the primary for READ_YOUR_WRITES_SECONDS, whichever worker serves them
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in self.SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+        opened = []
+        _primary_sessions.set(opened)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and opened and message["status"] < 400:
+                until = time.time() + READ_YOUR_WRITES_SECONDS
+                cookie = (f"{PRIMARY_COOKIE}={until:.3f}; Max-Age={math.ceil(READ_YOUR_WRITES_SECONDS)}; Path=/; "
+                          "HttpOnly; SameSite=Lax")
+                message = {**message, "headers": [*message.get("headers", ()), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def sqlite_wal(dbapi_connection, connection_record):
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+def shared_engine(url):
+    # engine for side stores (tokens, patients, ...): "database" reuses the app database,
+    # a sqlite file is switched to WAL so several workers on one box can share it
+    if url == "database":
+        return lazy("sync_engine")
+    engine = create_engine(url)
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(engine, "connect", sqlite_wal)
+    return engine
+
+
+async def run(db, fn, *args):
+    # crud functions take a plain Session; AsyncSession.run_sync hands them one bound to the async connection
+    if isinstance(db, Session):
+        return await run_in_threadpool(fn, db, *args)
+    return await db.run_sync(fn, *args)
+
+
+def close_after(sessions, fn, *args):
+    db = sessions()
     try:
-        db = SessionLocal()
-        yield db
+        return fn(db, *args)
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def read(sessions, fn, *args):
+    # runs fn on a session of its own, opened from sessions and closed once fn returns; for reads that outlive
+    # the request that started them, such as a coalesced read other requests wait for
+    if ASYNC_ENGINE:
+        async with sessions() as db:
+            return await db.run_sync(fn, *args)
+    return await run_in_threadpool(close_after, sessions, fn, *args)
@@ -0,0 +1,23 @@
+from fastapi import HTTPException
+
+
+def selected(fields, allowed, default, required=()):
+    # fields is the comma separated `fields=` parameter; -> the requested names in the order of allowed, so
+    # "name,id" and "id,name" share one SQL variant and one serializer. required (what a cursor is built from)
+    # is always selected.
+    if fields is None:
+        names = set(default)
+    else:
+        names = {name.strip() for name in fields.split(",")} - {""}
+        unknown = names.difference(allowed)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        if not names:
+            raise HTTPException(status_code=400, detail="No fields requested")
+    names.update(required)
+    return tuple(name for name in allowed if name in names)
+
+
+def filters(**values):
+    # the filter parameters a request actually set; their names, not their values, pick the SQL variant
+    return {name: value for name, value in values.items() if value is not None}
@@ -0,0 +1,340 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+from sqlalchemy import Index, event, inspect
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import analytics
+import boot
+import crud
+import pagination
+import queries
+import revenue
+import sqlite_pool
+
+models = boot.LazyModule("models")
+
+# off: nothing happens at startup, report: log the plans that scan or sort, create: also create the
+# candidate indexes that remove those scans; `python index_advisor.py` does the same and exits 1 for CI
+INDEX_ADVISOR = os.getenv("INDEX_ADVISOR", "off")
+
+logger = logging.getLogger(__name__)
+
+# allow names the tables (by alias, as the plan shows them) a query is meant to read in full,
+# "*" any table, "sort" a temporary b-tree for ORDER BY
+Query = namedtuple("Query", ["name", "sql", "parameters", "allow"])
+
+EMPLOYEES_PAGE = {"limit": pagination.MAX_PAGE_SIZE + 1, "offset": 0, "after_value": "", "after_id": 0}
+
+PRODUCT_FILTER_VALUES = {"category_id": 1, "supplier_id": 1, "discontinued": "1", "min_price": 10, "max_price": 20}
+
+SQLITE_QUERIES = [
+    Query("categories", queries.CATEGORIES.sql, {}, {"Categories"}),
+    Query("customers", queries.CUSTOMERS.sql, {}, {"Customers"}),
+    Query("customers_filtered", queries.customers(queries.CUSTOMER_DEFAULT_FIELDS, tuple(queries.CUSTOMER_FILTERS)).sql,
+          {"city": "London", "country": "UK"}, {"Customers"}),
+    Query("product", queries.PRODUCT.sql, {"id": 1}, set()),
+    *(Query(f"employees_{key}{f'_after_{after}' if after else ''}", query.sql, EMPLOYEES_PAGE, {"e"})
+      for (key, after), query in queries.EMPLOYEES.items()),
+    # the city filter picks the index, the few employees of one city are then sorted
+    *(Query(f"employees_{key}_filtered",
+            queries.employees(key, False, queries.EMPLOYEE_DEFAULT_FIELDS, tuple(queries.EMPLOYEE_FILTERS)).sql,
+            {**EMPLOYEES_PAGE, "city": "London", "country": "UK"}, {"e", "sort"})
+      for key in queries.EMPLOYEES_SORT_COLUMNS),
+    Query("products_extended", queries.PRODUCTS_EXTENDED.sql, {}, {"p"}),
+    *(Query(f"products_extended_{name}",
+            queries.products_extended(queries.PRODUCT_EXTENDED_DEFAULT_FIELDS, (name,)).sql, {name: value}, {"p"})
+      for name, value in PRODUCT_FILTER_VALUES.items()),
+    Query("product_revenue_totals", queries.PRODUCT_REVENUE_TOTALS.sql, {"id": 1}, set()),
+    Query("product_orders", queries.PRODUCT_ORDERS.sql, {"id": 1}, set()),
+    Query("insert_category", queries.INSERT_CATEGORY.sql, {"name": ""}, set()),
+    Query("update_category", queries.UPDATE_CATEGORY.sql, {"name": "", "id": 1}, set()),
+    Query("category", queries.CATEGORY.sql, {"id": 1}, set()),
+    Query("delete_category", queries.DELETE_CATEGORY.sql, {"id": 1}, set()),
+    Query("analytics_lines", analytics.LINES, {}, {"od"}),
+    *(Query(f"analytics_{by}_names", sql, {}, {"*"}) for by, sql in analytics.NAMES.items()),
+    Query("analytics_fingerprint", analytics.FINGERPRINT, {}, {"ProductRevenueTotals"}),
+    # lookups the revenue triggers run on every write to Order Details, Orders and Customers
+    Query("revenue_order_lines", f"{revenue.LINES} WHERE o.OrderID = :order", {"order": 10248}, set()),
+    Query("revenue_customer_lines", f"{revenue.LINES} WHERE o.CustomerID = :customer", {"customer": "VINET"}, set()),
+    Query("revenue_order_products", revenue.ORDER_PRODUCTS.format(order=":order"), {"order": 10248}, set()),
+    Query("revenue_customer_products", revenue.CUSTOMER_PRODUCTS.format(customer=":customer"),
+          {"customer": "VINET"}, set()),
+    Query("revenue_delete_order", "DELETE FROM ProductOrderRevenue WHERE OrderID = :order", {"order": 10248}, set()),
+]
+
+SQLITE_INDEXES = [
+    'CREATE INDEX ix_order_details_product ON "Order Details" (ProductID)',
+    "CREATE INDEX ix_orders_customer ON Orders (CustomerID)",
+    "CREATE INDEX ix_products_supplier ON Products (SupplierID)",
+    "CREATE INDEX ix_products_category ON Products (CategoryID)",
+    "CREATE INDEX ix_product_order_revenue_order ON ProductOrderRevenue (OrderID)",
+    *(f"CREATE INDEX ix_employees_{key} ON Employees ({column}, EmployeeID)"
+      for key, column in queries.EMPLOYEES_ORDER_BY.items()),
+]
+
+
+def orm_indexes():
+    return [
+        Index("ix_products_supplierid", models.Product.__table__.c.SupplierID),
+        Index("ix_products_categoryid", models.Product.__table__.c.CategoryID),
+    ]
+
+
+# the read paths of crud.py; writes address suppliers by primary key only
+ORM_WORKLOAD = [
+    ("shippers", crud.get_shippers, (), {"shippers"}),
+    ("shipper", crud.get_shipper, (1,), set()),
+    ("suppliers", crud.get_suppliers, (pagination.MAX_PAGE_SIZE + 1, None), {"suppliers"}),
+    ("suppliers_after", crud.get_suppliers, (pagination.MAX_PAGE_SIZE + 1, 1), set()),
+    ("suppliers_filtered", crud.get_suppliers,
+     (pagination.MAX_PAGE_SIZE + 1, None, ("SupplierID", "CompanyName"), {"country": "USA", "city": "Boston"}),
+     {"suppliers"}),
+    ("supplier", crud.get_supplier, (1,), set()),
+    *((f"supplier_products_{strategy}", crud.get_products_from_supplier,
+       (1, pagination.MAX_PAGE_SIZE + 1, None, strategy), set()) for strategy in ("columns", "joined", "selectin")),
+    ("supplier_products_before", crud.get_products_from_supplier, (1, pagination.MAX_PAGE_SIZE + 1, 10), set()),
+    ("existing_supplier_ids", crud.existing_supplier_ids, ([1, 2],), set()),
+]
+
+
+def findings(plan, allow):
+    result = []
+    for detail in plan:
+        words = detail.split()
+        if detail.startswith("SCAN ") and words[1] != "CONSTANT":
+            table = words[1]
+        elif detail.startswith("Seq Scan on "):
+            table = words[-1]
+        elif detail.startswith(("USE TEMP B-TREE", "Sort", "Incremental Sort")):
+            table = "sort"
+        else:
+            continue
+        if table not in allow and (table == "sort" or "*" not in allow):
+            result.append(detail)
+    return result
+
+
+def postgres_plan(plan):
+    nodes, lines = [plan[0]["Plan"]], []
+    while nodes:
+        node = nodes.pop(0)
+        relation = f" on {node['Relation Name']} {node['Alias']}" if "Relation Name" in node else ""
+        lines.append(node["Node Type"] + relation)
+        nodes.extend(node.get("Plans", ()))
+    return lines
+
+
+class Advisor(ABC):
+    def __init__(self, workload):
+        self.workload = workload
+
+    @abstractmethod
+    def existing(self, candidate):
+        pass
+
+    @abstractmethod
+    def explain(self, query):
+        pass
+
+    @abstractmethod
+    def what_if(self, candidate, workload):
+        pass
+
+    @abstractmethod
+    def create(self, candidate):
+        pass
+
+    @abstractmethod
+    def describe(self, candidate):
+        pass
+
+    def report(self, candidates, create=False):
+        plans = {query.name: self.explain(query) for query in self.workload}
+        flagged = {query.name: findings(plans[query.name], query.allow) for query in self.workload}
+        # an index is only recommended when creating it (inside a rolled back transaction) changes a plan
+        missing = []
+        for candidate in candidates:
+            affected = [query for query in self.workload if flagged[query.name]]
+            if not affected or self.existing(candidate):
+                continue
+            what_if = self.what_if(candidate, affected)
+            fixes = [query.name for query in affected
+                     if len(findings(what_if[query.name], query.allow)) < len(flagged[query.name])]
+            if fixes:
+                missing.append((candidate, fixes))
+        created = []
+        if create and missing:
+            for candidate, _ in missing:
+                self.create(candidate)
+                created.append(self.describe(candidate))
+            plans = {query.name: self.explain(query) for query in self.workload}
+            flagged = {query.name: findings(plans[query.name], query.allow) for query in self.workload}
+        return {
+            "queries": [{"name": query.name, "sql": " ".join(query.sql.split()), "parameters": query.parameters,
+                         "plan": plans[query.name], "findings": flagged[query.name]} for query in self.workload],
+            "missing_indexes": [{"index": self.describe(candidate), "fixes": fixes}
+                                for candidate, fixes in missing if self.describe(candidate) not in created],
+            "created": created,
+            "flagged": [name for name, found in flagged.items() if found],
+        }
+
+
+class SQLiteAdvisor(Advisor):
+    def __init__(self, connection, workload=SQLITE_QUERIES):
+        super().__init__(workload)
+        self.connection = connection
+
+    def existing(self, candidate):
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                       (candidate.split()[2],)).fetchone() is not None
+
+    def explain(self, query):
+        return [row[3] for row in self.connection.execute(f"EXPLAIN QUERY PLAN {query.sql}", query.parameters)]
+
+    def what_if(self, candidate, workload):
+        self.connection.execute("SAVEPOINT index_advisor")
+        try:
+            self.connection.execute(candidate)
+            return {query.name: self.explain(query) for query in workload}
+        finally:
+            self.connection.execute("ROLLBACK TO index_advisor")
+            self.connection.execute("RELEASE index_advisor")
+
+    def create(self, candidate):
+        self.connection.execute(candidate)
+
+    def describe(self, candidate):
+        return candidate
+
+    def report(self, candidates=SQLITE_INDEXES, create=False):
+        return super().report(candidates, create)
+
+
+def capture_orm_queries(engine, workload=ORM_WORKLOAD):
+    # runs the crud read paths once inside a rolled back transaction and keeps the SQL they emit
+    captured = []
+    result = []
+    with engine.connect() as connection:
+        event.listen(connection, "before_cursor_execute",
+                     lambda conn, cursor, statement, parameters, context, executemany:
+                     captured.append((statement, parameters)))
+        transaction = connection.begin()
+        try:
+            db = Session(bind=connection)
+            for name, fn, args, allow in workload:
+                del captured[:]
+                fn(db, *args)
+                for number, (statement, parameters) in enumerate(captured):
+                    result.append(Query(name if number == 0 else f"{name}_{number}", statement, parameters, allow))
+            db.close()
+        finally:
+            transaction.rollback()
+    return result
+
+
+class ORMAdvisor(Advisor):
+    def __init__(self, engine):
+        super().__init__(capture_orm_queries(engine))
+        self.engine = engine
+
+    def _explain(self, connection, query):
+        if connection.dialect.name == "postgresql":
+            return postgres_plan(connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query.sql}",
+                                                            query.parameters).scalar())
+        return [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {query.sql}", query.parameters)]
+
+    def existing(self, candidate):
+        columns = [column.name for column in candidate.columns]
+        with self.engine.connect() as connection:
+            indexes = inspect(connection).get_indexes(candidate.table.name)
+        return any(index["column_names"][:len(columns)] == columns for index in indexes)
+
+    def explain(self, query):
+        with self.engine.connect() as connection:
+            return self._explain(connection, query)
+
+    def what_if(self, candidate, workload):
+        with self.engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                if connection.dialect.name == "postgresql":
+                    # the stand-in tables are tiny, the planner would pick a sequential scan regardless
+                    connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+                candidate.create(connection)
+                plans = {query.name: self._explain(connection, query) for query in workload}
+                candidate.drop(connection)
+                return plans
+            finally:
+                transaction.rollback()
+
+    def create(self, candidate):
+        with self.engine.begin() as connection:
+            candidate.create(connection)
+
+    def describe(self, candidate):
+        columns = ", ".join(column.name for column in candidate.columns)
+        return f"CREATE INDEX {candidate.name} ON {candidate.table.name} ({columns})"
+
+    def report(self, candidates=None, create=False):
+        return super().report(orm_indexes() if candidates is None else candidates, create)
+
+
+def log_report(name, report):
+    for query in report["queries"]:
+        if query["findings"]:
+            logger.warning("%s query %s: %s", name, query["name"], "; ".join(query["findings"]))
+    for index in report["missing_indexes"]:
+        logger.warning("%s: %s would fix %s", name, index["index"], ", ".join(index["fixes"]))
+    for index in report["created"]:
+        logger.info("%s: created %s", name, index)
+
+
+async def startup_check(pool, engine):
+    create = INDEX_ADVISOR == "create"
+    log_report("northwind", await pool.write(lambda connection: SQLiteAdvisor(connection).report(create=create)))
+    log_report("sqlalchemy", await run_in_threadpool(lambda: ORMAdvisor(engine).report(create=create)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Explain the queries the app runs and flag full scans and sorts")
+    parser.add_argument("--database", default=sqlite_pool.NORTHWIND_DB_PATH, help="northwind sqlite file")
+    parser.add_argument("--create", action="store_true", help="create the indexes that fix flagged queries")
+    parser.add_argument("--skip-orm", action="store_true", help="leave out the SQLAlchemy (crud.py) queries")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    source = sqlite3.connect(args.database)
+    if args.create:
+        connection = source
+    else:
+        # report mode works on an in-memory copy, so the file is left exactly as it was
+        connection = sqlite3.connect(":memory:")
+        source.backup(connection)
+    # the materialized revenue tables are part of the workload, the app builds them at startup as well
+    revenue.materialize(connection)
+    report = {"northwind": SQLiteAdvisor(connection).report(create=args.create)}
+    connection.commit()
+    if not args.skip_orm:
+        import database
+        report["sqlalchemy"] = ORMAdvisor(database.sync_engine).report(create=args.create)
+    report["ok"] = not any(section["flagged"] for section in report.values())
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,61 @@
-import collections
+# first, so STARTUP_PROFILE=1 times every import below
+import boot
+
+import os
 import secrets
 import datetime
-import sqlite3
 from datetime import timedelta, date
 from typing import Optional, List
 
 from fastapi import FastAPI, Request, Response, Query, Cookie, Depends, HTTPException
 from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse
-from hashlib import sha512, sha256
+from hashlib import sha512
 
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from pydantic.main import BaseModel
-
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import analytics
+import cache
+import coalesce
+import counters
+import database
+import fieldsets
+import index_advisor
+import metrics
+import migrate
+import pagination
+import patients
+import profiler
+import queries
+import search
+import signed_tokens
+import slow_queries
+import sql_budget
+import sqlite_pool
+import streaming
+import token_store
+import versions
+import warmup
 from views import router as northwind_api_router
 
-app = FastAPI()
-app.counter = 0
-app.patient_id = 0
-app.patients_register = dict()
-app.secret_key = 0
-app.login_tokens = collections.deque(maxlen=3)
-app.session_tokens = collections.deque(maxlen=3)
-app.db_connection = None
+PATIENTS_BATCH_MAX = int(os.getenv("PATIENTS_BATCH_MAX", "10000"))
+
+app = FastAPI(default_response_class=metrics.TimedJSONResponse)
+app.counter = counters.create_counter()
+app.patient_registry = patients.create_registry()
+app.token_store = token_store.create_store()
+app.db_pool = None
+app.warmup_task = None
 
 app.include_router(northwind_api_router, tags=["northwind"])
+if sql_budget.SQL_BUDGET_MODE != "off":
+    app.middleware("http")(sql_budget.middleware)
+if metrics.METRICS:
+    app.add_middleware(metrics.MetricsMiddleware)
+if database.SQLALCHEMY_REPLICA_URLS:
+    app.add_middleware(database.ReadYourWritesMiddleware)
 
 
 # 1st lecture
@@ -41,8 +73,7 @@ def hello_name_view(name: str):
 
 @app.get("/counter")
 def counter():
-    app.counter += 1
-    return str(app.counter)
+    return str(app.counter.increment())
 
 
 @app.get("/method", status_code=200)
@@ -82,33 +113,45 @@ class RegistrationInfo(BaseModel):
     vaccination_date: str
 
 
-@app.post("/register", response_model=RegistrationInfo)
-def register_patient(response: Response, patient: Patient):
-    app.patient_id += 1
+def registration_for(patient: Patient):
     how_many_days = sum(character.isalpha() for character in patient.name) \
                     + sum(character.isalpha() for character in patient.surname)
     registration_date = date.today()
     vaccination_date = registration_date + timedelta(days=how_many_days)
-    response.status_code = 201
-    app.patients_register[app.patient_id] = RegistrationInfo(
-        id=app.patient_id,
+    return dict(
         name=patient.name,
         surname=patient.surname,
         register_date=registration_date.strftime("%Y-%m-%d"),
         vaccination_date=vaccination_date.strftime("%Y-%m-%d")
     )
-    return app.patients_register[app.patient_id]
+
+
+@app.post("/register", response_model=RegistrationInfo)
+def register_patient(response: Response, patient: Patient):
+    response.status_code = 201
+    return app.patient_registry.register([registration_for(patient)])[0]
+
+
+@app.post("/register/batch", response_model=List[RegistrationInfo], status_code=201)
+def register_patients(new_patients: List[Patient]):
+    if len(new_patients) > PATIENTS_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PATIENTS_BATCH_MAX} patients per request")
+    if not new_patients:
+        return []
+    return app.patient_registry.register([registration_for(patient) for patient in new_patients])
 
 
 @app.get("/patient/{id}", response_model=Optional[RegistrationInfo])
 def get_patient(response: Response, id: int):
     if id < 1:
         response.status_code = 400
-    elif id not in app.patients_register:
+        return
+    patient = app.patient_registry.get(id)
+    if patient is None:
         response.status_code = 404
     else:
         response.status_code = 200
-        return app.patients_register[id]
+        return patient
 
 
 # 3rd lecture
@@ -136,10 +179,8 @@ def create_session(response: Response, credentials: HTTPBasicCredentials = Depen
     correct_password = secrets.compare_digest(credentials.password, "NotSoSecurePa$$")
     if correct_username and correct_password:
         response.status_code = 201
-        session_token = sha256(f"4dm1nNotSoSecurePa$${app.secret_key}".encode()).hexdigest()
-        app.session_tokens.append(session_token)
+        session_token = issue_token("session")
         response.set_cookie(key="session_token", value=session_token)
-        app.secret_key += 1
 
 
 @app.post("/login_token")
@@ -149,23 +190,49 @@ def check_token(response: Response, credentials: HTTPBasicCredentials = Depends(
     correct_password = secrets.compare_digest(credentials.password, "NotSoSecurePa$$")
     if correct_username and correct_password:
         response.status_code = 201
-        token = sha256(f"4dm1nNotSoSecurePa$${app.secret_key}".encode()).hexdigest()
-        app.login_tokens.append(token)
-        app.secret_key += 1
+        token = issue_token("token")
         return {"token": token}
 
 
+def require_admin(credentials: HTTPBasicCredentials = Depends(security)):
+    correct_username = secrets.compare_digest(credentials.username, "4dm1n")
+    correct_password = secrets.compare_digest(credentials.password, "NotSoSecurePa$$")
+    if not (correct_username and correct_password):
+        raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Basic"})
+
+
+def issue_token(kind: str):
+    if signed_tokens.TOKEN_MODE == "signed":
+        return signed_tokens.issue(kind, "4dm1n")
+    # random, so a token cannot be derived from the credentials and two workers sharing a store never collide
+    token = secrets.token_urlsafe(32)
+    app.token_store.add(kind, token)
+    return token
+
+
+def token_valid(kind: str, token: Optional[str]):
+    if signed_tokens.TOKEN_MODE == "signed":
+        return signed_tokens.verify(kind, token) is not None
+    return app.token_store.contains(kind, token)
+
+
+def revoke_token(kind: str, token: Optional[str]):
+    if signed_tokens.TOKEN_MODE == "signed":
+        return signed_tokens.revoke(kind, token)
+    return app.token_store.remove(kind, token)
+
+
 @app.get("/welcome_session")
 def welcome_session(response: Response, format: Optional[str] = None, session_token: str = Cookie(None)):
     response.status_code = 401
-    if session_token in app.session_tokens:
+    if token_valid("session", session_token):
         return return_message(text="Welcome!", message_format=format)
 
 
 @app.get("/welcome_token")
 def welcome_token(response: Response, token: str, format: Optional[str] = None):
     response.status_code = 401
-    if token in app.login_tokens:
+    if token_valid("token", token):
         return return_message(text="Welcome!", message_format=format)
 
 
@@ -180,16 +247,14 @@ def return_message(text: str, message_format: Optional[str]):
 @app.delete("/logout_session")
 def logout_session(response: Response, format: Optional[str] = None, session_token: str = Cookie(None)):
     response.status_code = 401
-    if session_token in app.session_tokens:
-        app.session_tokens.remove(session_token)
+    if revoke_token("session", session_token):
         return RedirectResponse(url="/logged_out" + f"?format={format}", status_code=303)
 
 
 @app.delete("/logout_token")
 def logout_token(response: Response, token: str, format: Optional[str] = None):
     response.status_code = 401
-    if token in app.login_tokens:
-        app.login_tokens.remove(token)
+    if revoke_token("token", token):
         return RedirectResponse(url="/logged_out" + f"?format={format}", status_code=303)
 
 
@@ -202,50 +267,123 @@ def logged_out(format: Optional[str] = None):
 
 @app.on_event("startup")
 async def startup():
-    app.db_connection = sqlite3.connect("northwind.db")
-    app.db_connection.text_factory = lambda b: b.decode(errors="ignore")
+    boot.readiness.imported()
+    with boot.readiness.phase("startup"):
+        app.db_pool = sqlite_pool.SQLitePool()
+        app.db_pool.open()
+        await app.db_pool.write(migrate.migrate)
+        await run_in_threadpool(search.catalog.prepare_database, database.sync_engine)
+        await run_in_threadpool(database.replicas.start)
+        if index_advisor.INDEX_ADVISOR != "off":
+            await index_advisor.startup_check(app.db_pool, database.sync_engine)
+    app.warmup_task = await warmup.start(app.db_pool)
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    app.db_connection.close()
+    if app.warmup_task is not None:
+        app.warmup_task.cancel()
+    app.db_pool.close()
+    app.counter.close()
+    database.replicas.stop()
 
 
-@app.get("/categories", status_code=200)
-async def print_categories():
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = lambda cursor, col: {"id": col[0], "name": col[1]}
-    result = cursor.execute("SELECT CategoryID, CategoryName FROM Categories").fetchall()
-    return {"categories": result}
+@app.get("/ready")
+def ready(response: Response):
+    # 503 while booting, for load balancers to hold traffic back until warm; a failed warm-up still ends warm
+    state = boot.readiness.state()
+    if state["status"] != boot.WARM:
+        response.status_code = 503
+    return state
 
 
-def xstr(s):
-    if s is None:
-        return ''
-    return str(s)
+@app.get("/stats/startup")
+def startup_stats():
+    return boot.readiness.report()
+
+
+@app.get("/stats/db_pool")
+def db_pool_stats():
+    return app.db_pool.stats()
+
+
+@app.get("/stats/replicas")
+def replica_stats():
+    return database.replicas.stats()
+
+
+@app.get("/stats/cache")
+def cache_stats():
+    return cache.response_cache.stats()
+
+
+@app.get("/stats/single_flight")
+def single_flight_stats():
+    return coalesce.flights.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render() + coalesce.flights.render(),
+                             media_type=metrics.PROMETHEUS_MEDIA_TYPE)
+
+
+@app.get("/admin/slow_queries", dependencies=[Depends(require_admin)])
+def slow_query_log():
+    return slow_queries.slow_query_log.stats()
+
+
+@app.put("/admin/slow_queries", dependencies=[Depends(require_admin)])
+def set_slow_query_thresholds(sqlite_ms: Optional[float] = None, orm_ms: Optional[float] = None):
+    slow_queries.slow_query_log.set_thresholds(sqlite_ms, orm_ms)
+    return slow_queries.slow_query_log.stats()["thresholds_ms"]
+
+
+@app.post("/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def run_profiler(seconds: float = Query(..., gt=0, le=profiler.PROFILER_MAX_SECONDS)):
+    try:
+        return PlainTextResponse(await profiler.profiler.profile(seconds))
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    # async, so the event the running profile waits on is set from the event loop thread
+    if not profiler.profiler.cancel():
+        raise HTTPException(status_code=404, detail="No profile is running")
+    return Response(status_code=204)
+
+
+@app.get("/categories", status_code=200)
+async def print_categories(request: Request):
+    not_modified, validators = versions.table_versions.check(request, ("categories",))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+    result = await app.db_pool.read(queries.fetchall, queries.CATEGORIES)
+    return cache.response_cache.store(request, {"categories": result}, tags=("categories",), headers=validators)
 
 
 @app.get("/customers", status_code=200)
-async def print_customers():
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = lambda cursor, col: {"id": col[0],
-                                              "name": col[1],
-                                              "full_address": xstr(col[2]) + " "
-                                                              + xstr(col[3]) + " "
-                                                              + xstr(col[4]) + " "
-                                                              + xstr(col[5])}
-    result = cursor.execute('''SELECT CustomerID, CompanyName, Address, PostalCode, City, Country 
-                                FROM Customers''').fetchall()
+async def print_customers(request: Request, stream: Optional[str] = None, fields: Optional[str] = None,
+                          city: Optional[str] = None, country: Optional[str] = None):
+    fields = fieldsets.selected(fields, queries.CUSTOMER_FIELDS, queries.CUSTOMER_DEFAULT_FIELDS)
+    params = fieldsets.filters(city=city, country=country)
+    query = queries.customers(fields, tuple(params))
+    if streaming.wants_ndjson(request, stream):
+        return await streaming.ndjson_response(app.db_pool,
+                                               lambda connection: queries.execute(connection, query, params))
+    result = await app.db_pool.read(queries.fetchall, query, params)
     return {"customers": result}
 
 
 @app.get("/products/{id}")
 async def get_product(response: Response, id: int):
     response.status_code = 404
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = lambda cursor, col: {"id": col[0], "name": col[1]}
-    result = cursor.execute("SELECT ProductID, ProductName FROM Products WHERE ProductID = :id",
-                            {"id": id}).fetchone()
+    result = await app.db_pool.read(queries.fetchone, queries.PRODUCT, {"id": id})
     if result is not None:
         response.status_code = 200
         return result
@@ -253,55 +391,139 @@ async def get_product(response: Response, id: int):
 
 @app.get("/employees")
 async def get_employees(response: Response, limit: Optional[int] = -1, offset: Optional[int] = 0,
-                        order: Optional[str] = None):
+                        order: Optional[str] = None, cursor: Optional[str] = None, fields: Optional[str] = None,
+                        city: Optional[str] = None, country: Optional[str] = None):
     response.status_code = 200
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = sqlite3.Row
-    order_by = ['first_name', 'last_name', 'city']
-    if not any(order == possibility for possibility in order_by) and order is not None:
+    if order is not None and order not in queries.EMPLOYEES_ORDER_BY:
         response.status_code = 400
         return
-    if order is None:
-        order = 'EmployeeID'
-    result = cursor.execute(f"""SELECT EmployeeID id, LastName last_name, FirstName first_name, City city 
-                            FROM Employees e 
-                            ORDER BY {order} 
-                            LIMIT :limit 
-                            OFFSET :offset""",
-                            {'limit': limit, 'offset': offset}).fetchall()
-    return {"employees": result}
+    limit = pagination.page_size(limit)
+    sort_key = order or 'id'
+    # the next cursor is built from the sort key and id, so those are selected whatever fields= asks for
+    fields = fieldsets.selected(fields, queries.EMPLOYEE_FIELDS, queries.EMPLOYEE_DEFAULT_FIELDS,
+                                required=('id', sort_key))
+    filters = fieldsets.filters(city=city, country=country)
+    params = {'limit': limit + 1, 'offset': offset, **filters}
+    after = False
+    if cursor is not None:
+        params['after_value'], params['after_id'] = pagination.decode_cursor(cursor, sort_key, 2)
+        params['offset'] = 0
+        after = queries.AFTER_VALUE if params['after_value'] is not None else queries.AFTER_NULL
+    query = queries.employees(sort_key, after, fields, tuple(filters))
+    result, has_more = pagination.split_page(await app.db_pool.read(queries.fetchall, query, params), limit)
+    next_cursor = None
+    if has_more:
+        last = result[-1]
+        next_cursor = pagination.encode_cursor(sort_key, last[sort_key], last['id'])
+    return {"employees": result, "next_cursor": next_cursor}
 
 
 @app.get("/products_extended")
-async def products_extended(response: Response):
+async def products_extended(request: Request, response: Response, stream: Optional[str] = None,
+                            fields: Optional[str] = None, category_id: Optional[int] = None,
+                            supplier_id: Optional[int] = None, discontinued: Optional[bool] = None,
+                            min_price: Optional[float] = None, max_price: Optional[float] = None):
     response.status_code = 200
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = sqlite3.Row
-    result = cursor.execute(
-        '''SELECT p.ProductID id, p.ProductName name, c.CategoryName category, s.CompanyName supplier
-           FROM Products p 
-           JOIN Categories c ON p.CategoryID = c.CategoryID 
-           JOIN Suppliers s ON p.SupplierID = s.SupplierID''').fetchall()
-    return {"products_extended": result}
+    fields = fieldsets.selected(fields, queries.PRODUCT_EXTENDED_FIELDS, queries.PRODUCT_EXTENDED_DEFAULT_FIELDS)
+    params = fieldsets.filters(category_id=category_id, supplier_id=supplier_id,
+                               discontinued=None if discontinued is None else str(int(discontinued)),
+                               min_price=min_price, max_price=max_price)
+    query = queries.products_extended(fields, tuple(params))
+    if streaming.wants_ndjson(request, stream):
+        return await streaming.ndjson_response(
+            app.db_pool, lambda connection: queries.execute(connection, query, params))
+    not_modified, validators = versions.table_versions.check(request, ("categories", "products"))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    async def load():
+        return cache.render({"products_extended": await app.db_pool.read(queries.fetchall, query, params)})
+
+    body = await coalesce.flights.run("products_extended", coalesce.key(request, ("categories", "products")), load)
+    return cache.response_cache.store(request, body, tags=("categories", "products"), headers=validators)
 
 
 @app.get("/products/{id}/orders")
-async def order_details(response: Response, id: int):
+async def order_details(request: Request, response: Response, id: int, stream: Optional[str] = None,
+                        summary: bool = False):
     response.status_code = 200
-    cursor = app.db_connection.cursor()
-    cursor.row_factory = sqlite3.Row
-    result = cursor.execute(
-        '''SELECT o.OrderID id, c.CompanyName customer, 
-	              od.Quantity quantity,
-	              ROUND((od.UnitPrice * od.Quantity) - od.Discount * (od.UnitPrice * od.Quantity),2) total_price
-           FROM Orders o 
-	              JOIN Customers c ON o.CustomerID = c.CustomerID 
-	              JOIN "Order Details" od ON o.OrderID = od.OrderID	
-           WHERE od.ProductID = :id
-        ''', {"id": id}).fetchall()
-    if result:
-        return {"orders": result}
-    raise HTTPException(status_code=404)
+    if streaming.wants_ndjson(request, stream) and not summary:
+        return await streaming.ndjson_response(
+            app.db_pool, lambda connection: queries.execute(connection, queries.PRODUCT_ORDERS, {"id": id}),
+            not_found=True)
+
+    async def load():
+        # the 404 is raised once and reaches every request of the flight
+        if summary:
+            result = await app.db_pool.read(queries.fetchone, queries.PRODUCT_REVENUE_TOTALS, {"id": id})
+            content = {"summary": result}
+        else:
+            result = await app.db_pool.read(queries.fetchall, queries.PRODUCT_ORDERS, {"id": id})
+            content = {"orders": result}
+        if not result:
+            raise HTTPException(status_code=404)
+        return content
+
+    return await coalesce.flights.run("product_orders", coalesce.key(request, ("orders", "products")), load)
+
+
+async def analytics_response(request: Request, key: str, report):
+    await app.db_pool.read(analytics.order_lines.check)
+    not_modified, validators = versions.table_versions.check(request, analytics.TAGS)
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    async def load():
+        return cache.render({key: report(await app.db_pool.read(analytics.order_lines.current))})
+
+    body = await coalesce.flights.run(f"analytics_{key}", coalesce.key(request, analytics.TAGS), load)
+    return cache.response_cache.store(request, body, tags=analytics.TAGS, headers=validators)
+
+
+@app.get("/analytics/revenue")
+async def revenue_by(request: Request, by: str = "category"):
+    if by not in analytics.DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(analytics.DIMENSIONS)}")
+    return await analytics_response(request, "revenue", lambda lines: analytics.revenue_by(lines, by))
+
+
+@app.get("/analytics/top_products")
+async def top_products(request: Request, limit: int = Query(10, ge=1, le=analytics.ANALYTICS_TOP_MAX),
+                       metric: str = "revenue"):
+    if metric not in analytics.METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(analytics.METRICS)}")
+    return await analytics_response(request, "products",
+                                    lambda lines: analytics.top_products(lines, limit, metric))
+
+
+@app.get("/analytics/customers")
+async def customer_lifetime_value(request: Request,
+                                  limit: int = Query(10, ge=1, le=analytics.ANALYTICS_TOP_MAX)):
+    return await analytics_response(request, "customers",
+                                    lambda lines: analytics.customer_lifetime_value(lines, limit))
+
+
+@app.get("/search")
+async def search_catalog(q: str = Query(..., min_length=1, max_length=search.SEARCH_QUERY_MAX),
+                         kind: Optional[str] = None, limit: int = Query(10, ge=1, le=search.SEARCH_LIMIT_MAX),
+                         db: Session = Depends(database.get_db)):
+    if kind is not None and kind not in search.KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(search.KINDS)}")
+    results = {"query": q}
+    if not search.tokens(q):
+        return {**results, **{kind: [] for kind in ((kind,) if kind else search.KINDS)}}
+    for kind in (kind,) if kind else search.KINDS:
+        if kind == "suppliers":
+            results[kind] = await database.run(db, search.catalog.suppliers, q, limit)
+        else:
+            results[kind] = await app.db_pool.read(search.catalog.northwind, kind, q, limit)
+    return results
 
 
 class Category(BaseModel):
@@ -315,24 +537,21 @@ class CreatedCategory(BaseModel):
 
 @app.post("/categories", status_code=201, response_model=CreatedCategory)
 async def create_category(category: Category):
-    cursor = app.db_connection.execute(
-        "INSERT INTO Categories (CategoryName) VALUES (?)", (category.name, ))
-    app.db_connection.commit()
-    return {"id": cursor.lastrowid,
+    def query(connection):
+        return queries.execute(connection, queries.INSERT_CATEGORY, {"name": category.name}).lastrowid
+    category_id = await app.db_pool.write(query)
+    versions.table_versions.bump("categories")
+    return {"id": category_id,
             "name": category.name}
 
 
 @app.put("/categories/{id}", status_code=200, response_model=CreatedCategory)
 async def modify_category(category: Category, id: int):
-    cursor = app.db_connection.execute(
-        "UPDATE Categories SET CategoryName = ? WHERE CategoryID = ?", (category.name, id)
-    )
-    app.db_connection.commit()
-    cursor.row_factory = sqlite3.Row
-    created_category = cursor.execute(
-        '''SELECT c.CategoryID id, c.CategoryName name 
-            FROM Categories c 
-            WHERE c.CategoryID = :id''', {"id": id}).fetchone()
+    def query(connection):
+        queries.execute(connection, queries.UPDATE_CATEGORY, {"name": category.name, "id": id})
+        return queries.fetchone(connection, queries.CATEGORY, {"id": id})
+    created_category = await app.db_pool.write(query)
+    versions.table_versions.bump("categories")
     if created_category:
         return created_category
     raise HTTPException(status_code=404)
@@ -340,14 +559,12 @@ async def modify_category(category: Category, id: int):
 
 @app.delete("/categories/{id}", status_code=200)
 async def delete_category(id: int):
-    cursor = app.db_connection.execute(
-        '''SELECT c.CategoryID 
-            FROM Categories c 
-            WHERE c.CategoryID = :id''', {'id': id})
-    if not cursor.fetchone():
+    def query(connection):
+        if not queries.fetchone(connection, queries.CATEGORY, {'id': id}):
+            return False
+        queries.execute(connection, queries.DELETE_CATEGORY, {"id": id})
+        return True
+    if not await app.db_pool.write(query):
         raise HTTPException(status_code=404)
-    cursor.execute(
-        '''DELETE FROM Categories 
-            WHERE categoryID = :id''', {"id": id})
-    app.db_connection.commit()
+    versions.table_versions.bump("categories")
     return {"deleted": 1}
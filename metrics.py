@@ -0,0 +1,207 @@
+import bisect
+import contextvars
+import os
+import threading
+import time
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 1: time every request and split it into database, serialization and the rest of the handler, count its
+# queries and rows; totals per route are served on /metrics, the request's own numbers in Server-Timing
+METRICS = os.getenv("METRICS", "0") == "1"
+# upper bounds, in seconds, of the request duration histogram buckets
+METRICS_BUCKETS = tuple(float(bound) for bound in os.getenv(
+    "METRICS_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4"
+
+
+class RequestTiming:
+    __slots__ = ("db", "queries", "rows", "serialization")
+
+    def __init__(self):
+        self.db = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.serialization = 0.0
+
+
+# copied into the threadpool by run_in_threadpool, so the sqlite and ORM work done there lands on the request
+_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+class Stopwatch:
+    # adds the time spent in the with block to one field ("db" or "serialization") of the measured request
+    __slots__ = ("field", "timing", "start")
+
+    def __init__(self, field):
+        self.field = field
+
+    def __enter__(self):
+        self.timing = _timing.get()
+        if self.timing is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timing is not None:
+            setattr(self.timing, self.field, getattr(self.timing, self.field) + time.perf_counter() - self.start)
+
+
+def record_rows(count):
+    timing = _timing.get()
+    if timing is not None:
+        timing.rows += count
+
+
+def count_sqlite_statement(statement):
+    # sqlite3 trace callback, called once for every statement a pooled connection runs
+    timing = _timing.get()
+    if timing is not None:
+        timing.queries += 1
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if _timing.get() is not None:
+        conn.info["metrics_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    timing = _timing.get()
+    start = conn.info.pop("metrics_start", None)
+    if timing is not None and start is not None:
+        timing.db += time.perf_counter() - start
+        timing.queries += 1
+
+
+class TimedJSONResponse(JSONResponse):
+    # default response class, so the rendering of whatever a handler returns counts as serialization
+    def render(self, content):
+        with Stopwatch("serialization"):
+            return super().render(content)
+
+
+class RouteMetrics:
+    __slots__ = ("requests", "buckets", "duration", "db", "queries", "rows", "serialization")
+
+    def __init__(self, size):
+        self.requests = 0
+        self.buckets = [0] * size
+        self.duration = 0.0
+        self.db = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.serialization = 0.0
+
+    def copy(self):
+        copy = RouteMetrics(0)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.buckets = list(self.buckets)
+        return copy
+
+
+def label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, labels, duration, timing):
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            route = self._routes.get(labels)
+            if route is None:
+                route = self._routes[labels] = RouteMetrics(len(self.buckets))
+            route.requests += 1
+            if index < len(self.buckets):
+                route.buckets[index] += 1
+            route.duration += duration
+            route.db += timing.db
+            route.queries += timing.queries
+            route.rows += timing.rows
+            route.serialization += timing.serialization
+
+    def render(self):
+        with self._lock:
+            routes = [(labels, route.copy()) for labels, route in self._routes.items()]
+        lines = ["# HELP http_request_duration_seconds Time from the request to the last byte of the response.",
+                 "# TYPE http_request_duration_seconds histogram"]
+        for (method, path, status), route in routes:
+            labels = f'method="{method}",route="{label_value(path)}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, route.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {route.requests}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {route.duration}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {route.requests}")
+        for name, help_text, value in (
+                ("http_request_handler_seconds_total", "Request time spent outside the database and serialization.",
+                 lambda route: route.duration - route.db - route.serialization),
+                ("http_request_db_seconds_total", "Time spent running queries.", lambda route: route.db),
+                ("http_request_db_queries_total", "SQL statements executed.", lambda route: route.queries),
+                ("http_request_db_rows_total", "Rows fetched.",
+                 lambda route: route.rows),
+                ("http_request_serialization_seconds_total", "Time spent rendering response bodies.",
+                 lambda route: route.serialization)):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (method, path, status), route in routes:
+                labels = f'method="{method}",route="{label_value(path)}",status="{status}"'
+                lines.append(f"{name}{{{labels}}} {value(route)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def server_timing(total, timing):
+    handler = total - timing.db - timing.serialization
+    return f'handler;dur={1000 * handler:.3f}, db;dur={1000 * timing.db:.3f};desc="{timing.queries} queries, ' \
+           f'{timing.rows} rows", serialize;dur={1000 * timing.serialization:.3f}, total;dur={1000 * total:.3f}'
+
+
+class MetricsMiddleware:
+    # plain ASGI rather than @app.middleware("http"), which costs an extra task and body queue per request
+    def __init__(self, app, registry=registry):
+        self.app = app
+        self.registry = registry
+        self._paths = None
+
+    def route_path(self, scope):
+        # label with the route template, not the raw path, so ids do not turn into new series
+        if self._paths is None:
+            self._paths = {route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")}
+        return self._paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _timing.set(timing)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(time.perf_counter() - start, timing).encode("latin-1")
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timing.reset(token)
+            self.registry.record((scope["method"], self.route_path(scope), str(status)),
+                                 time.perf_counter() - start, timing)
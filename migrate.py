@@ -0,0 +1,37 @@
+import argparse
+import sqlite3
+import sys
+
+import revenue
+import search
+import sqlite_pool
+
+# What the app keeps inside northwind.db besides the Northwind data: WAL mode, the materialized revenue
+# tables and the FTS5 search tables, with the triggers that keep them current. Every step is idempotent and
+# only builds what is missing, so the startup event runs it too; the northwind.db in the repository ships
+# migrated, which leaves that run (and the file) a no-op.
+
+
+def migrate(connection, rebuild=False):
+    connection.execute("PRAGMA journal_mode=WAL")
+    revenue.materialize(connection, force=rebuild or revenue.REVENUE_REBUILD)
+    search.catalog.prepare_northwind(connection, force=rebuild or search.SEARCH_REBUILD)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the tables and triggers the app derives inside northwind.db")
+    parser.add_argument("--database", default=sqlite_pool.NORTHWIND_DB_PATH, help="northwind sqlite file")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the derived tables from the source tables")
+    args = parser.parse_args(argv)
+
+    connection = sqlite3.connect(args.database)
+    try:
+        migrate(connection, rebuild=args.rebuild)
+        connection.commit()
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
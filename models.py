@@ -2,7 +2,7 @@
 from sqlalchemy import CHAR, Column, Date, Float, Integer, LargeBinary, SmallInteger, String, Table, Text, text, \
     ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, synonym
 
 Base = declarative_base()
 metadata = Base.metadata
@@ -123,7 +123,8 @@ class Product(Base):
     Discontinued = Column(Integer, nullable=False)
 
     supplier = relationship('Supplier', back_populates='products')
-    category = relationship('Category', lazy='immediate', back_populates='products')
+    category = relationship('Category', back_populates='products')
+    Category = synonym('category')
 
 
 class Region(Base):
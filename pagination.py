@@ -0,0 +1,47 @@
+import base64
+import binascii
+import json
+import os
+
+from fastapi import HTTPException
+
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+
+def page_size(limit):
+    if limit is None or limit < 0 or limit > MAX_PAGE_SIZE:
+        return MAX_PAGE_SIZE
+    return limit
+
+
+# A cursor is the sort key name followed by the sort value(s) of the last row already sent, the row's id last,
+# so a token issued for one ordering is rejected when replayed against another
+def encode_cursor(key, *values):
+    payload = json.dumps([key, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor, key, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size + 1 or values[0] != key:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # the values are bound into the query: the id has to be an int, sort values scalars or null
+    *sort_values, id = values[1:]
+    if not is_int(id) or not all(value is None or is_int(value) or isinstance(value, (float, str))
+                                 for value in sort_values):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[1:]
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def split_page(rows, limit):
+    # callers fetch limit + 1 rows; the extra one only tells whether another page exists. An empty page (limit=0)
+    # has no last row to build the next cursor from, so it never has a next page.
+    page = rows[:limit]
+    return page, bool(page) and len(rows) > limit
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import Column, Integer, MetaData, Sequence, String, Table, func, select
+
+import database
+
+# memory:// keeps the old per-process dict; a SQLAlchemy URL or "database" makes the registry durable
+# and shared between workers
+PATIENT_REGISTRY_URL = os.getenv("PATIENT_REGISTRY_URL", "memory://")
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "1024"))
+
+
+class MemoryPatientRegistry:
+    def __init__(self):
+        self._patients = dict()
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def register(self, registrations):
+        with self._lock:
+            first_id = self._last_id + 1
+            self._last_id += len(registrations)
+            patients = [{"id": id, **registration} for id, registration in enumerate(registrations, first_id)]
+            self._patients.update((patient["id"], patient) for patient in patients)
+        return patients
+
+    def get(self, id):
+        return self._patients.get(id)
+
+
+class LRUCache:
+    def __init__(self, maxsize=PATIENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class SQLPatientRegistry:
+    def __init__(self, engine, cache_size=PATIENT_CACHE_SIZE):
+        self.engine = engine
+        self.cache = LRUCache(cache_size)
+        self.metadata = MetaData()
+        self.id_sequence = Sequence("patients_id_seq", metadata=self.metadata)
+        self.patients = Table(
+            "patients", self.metadata,
+            Column("id", Integer, self.id_sequence, primary_key=True),
+            Column("name", String, nullable=False),
+            Column("surname", String, nullable=False),
+            Column("register_date", String(10), nullable=False),
+            Column("vaccination_date", String(10), nullable=False),
+        )
+        self._created = False
+
+    def _ensure_table(self):
+        if not self._created:
+            self.metadata.create_all(self.engine)
+            self._created = True
+
+    def register(self, registrations):
+        self._ensure_table()
+        with self.engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                # one round-trip for all ids, then a single executemany insert
+                ids = connection.execute(
+                    select(self.id_sequence.next_value()).select_from(func.generate_series(1, len(registrations)))
+                ).scalars().all()
+                patients = [{"id": id, **registration} for id, registration in zip(ids, registrations)]
+                connection.execute(self.patients.insert(), patients)
+            else:
+                # sqlite hands out rowids under its write lock, one insert per row inside the same transaction
+                patients = [
+                    {"id": connection.execute(self.patients.insert(), registration).inserted_primary_key[0],
+                     **registration}
+                    for registration in registrations
+                ]
+        for patient in patients:
+            self.cache.put(patient["id"], patient)
+        return patients
+
+    def get(self, id):
+        patient = self.cache.get(id)
+        if patient is None:
+            self._ensure_table()
+            with self.engine.connect() as connection:
+                row = connection.execute(select(self.patients).where(self.patients.c.id == id)).first()
+            if row is None:
+                return None
+            patient = dict(row._mapping)
+            self.cache.put(id, patient)
+        return patient
+
+
+def create_registry(url=PATIENT_REGISTRY_URL):
+    if url == "memory://":
+        return MemoryPatientRegistry()
+    return SQLPatientRegistry(database.shared_engine(url))
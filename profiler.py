@@ -0,0 +1,97 @@
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    # a daemon thread that snapshots every other thread's stack with sys._current_frames() at a fixed
+    # interval; nothing is traced in between, so running it under live load costs one walk per interval
+    def __init__(self, interval_ms=PROFILER_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._done = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy()
+            self.samples = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            return True
+
+    def collapsed(self):
+        # one "thread;outermost;...;innermost count" line per distinct stack, the input flamegraph.pl and
+        # speedscope take
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    async def profile(self, seconds):
+        # samples for the given time, or until cancel(), without holding up the event loop
+        self.start()
+        self._done = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._done.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._done = None
+            self.stop()
+        return self.collapsed()
+
+    def cancel(self):
+        if self._done is None:
+            return False
+        self._done.set()
+        return True
+
+
+profiler = SamplingProfiler()
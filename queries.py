@@ -0,0 +1,189 @@
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import metrics
+import slow_queries
+
+# raw SQL the handlers in main.py run against northwind.db, declared once with the row mapper that turns its
+# tuples into response dicts. sqlite3 caches prepared statements per connection keyed by the SQL text, so
+# handing out the same strings means every pooled reader prepares each statement only once.
+NamedQuery = namedtuple("NamedQuery", ["sql", "row"])
+
+# the list endpoints build one statement per (fields=, filters) combination the first time it is asked for
+LIST_QUERY_VARIANTS = int(os.getenv("LIST_QUERY_VARIANTS", "256"))
+
+
+def row_mapper(*names):
+    # the cursor's row_factory, built once per query
+    def row(cursor, values):
+        return dict(zip(names, values))
+    return row
+
+
+def cursor_for(connection, query, parameters):
+    cursor = connection.cursor()
+    cursor.row_factory = query.row
+    return cursor.execute(query.sql, parameters)
+
+
+def execute(connection, query, parameters=()):
+    start = time.perf_counter()
+    cursor = cursor_for(connection, query, parameters)
+    slow_queries.check_sqlite(connection, query.sql, parameters, start)
+    return cursor
+
+
+# the slow query check covers the fetch as well, for a SELECT that is where sqlite does most of the work
+def fetchall(connection, query, parameters=()):
+    start = time.perf_counter()
+    rows = cursor_for(connection, query, parameters).fetchall()
+    slow_queries.check_sqlite(connection, query.sql, parameters, start)
+    metrics.record_rows(len(rows))
+    return rows
+
+
+def fetchone(connection, query, parameters=()):
+    start = time.perf_counter()
+    row = cursor_for(connection, query, parameters).fetchone()
+    slow_queries.check_sqlite(connection, query.sql, parameters, start)
+    metrics.record_rows(row is not None)
+    return row
+
+
+CATEGORIES = NamedQuery("SELECT CategoryID, CategoryName FROM Categories", row_mapper("id", "name"))
+
+# fields= and filter whitelists of the list endpoints: response name -> column expression, filter name ->
+# condition on a parameter of the same name. Only these fragments are ever formatted into SQL, request values are
+# always bound, and a name outside them is a KeyError before any statement exists.
+CUSTOMER_FIELDS = {"id": "CustomerID",
+                   "name": "CompanyName",
+                   "full_address": """IFNULL(Address, '') || ' ' || IFNULL(PostalCode, '') || ' ' || IFNULL(City, '')
+                                      || ' ' || IFNULL(Country, '')""",
+                   "city": "City",
+                   "country": "Country"}
+CUSTOMER_DEFAULT_FIELDS = ("id", "name", "full_address")
+CUSTOMER_FILTERS = {"city": "City = :city", "country": "Country = :country"}
+
+
+def columns(fields, names):
+    return ", ".join(fields[name] for name in names)
+
+
+def where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+
+@lru_cache(maxsize=LIST_QUERY_VARIANTS)
+def customers(fields, filters):
+    return NamedQuery(f'''SELECT {columns(CUSTOMER_FIELDS, fields)}
+                          FROM Customers
+                          {where([CUSTOMER_FILTERS[name] for name in filters])}''', row_mapper(*fields))
+
+
+CUSTOMERS = customers(CUSTOMER_DEFAULT_FIELDS, ())
+
+PRODUCT = NamedQuery("SELECT ProductID, ProductName FROM Products WHERE ProductID = :id", row_mapper("id", "name"))
+
+# the raw columns, so the ORDER BY and the keyset condition can both walk an index on (column, EmployeeID)
+EMPLOYEES_ORDER_BY = {'first_name': "FirstName",
+                      'last_name': "LastName",
+                      'city': "City"}
+EMPLOYEES_SORT_COLUMNS = {'id': "EmployeeID", **EMPLOYEES_ORDER_BY}
+# which keyset condition a page after a cursor needs: NULLs sort first, and a NULL in a row value comparison
+# matches nothing, so a cursor on a NULL sort value still has the rest of the NULLs and then every value ahead
+AFTER_VALUE, AFTER_NULL = "value", "null"
+AFTER_CONDITIONS = {AFTER_VALUE: "({column}, EmployeeID) > (:after_value, :after_id)",
+                    AFTER_NULL: "(({column} IS NULL AND EmployeeID > :after_id) OR {column} IS NOT NULL)"}
+EMPLOYEE_FIELDS = {"id": "EmployeeID", "last_name": "LastName", "first_name": "FirstName", "city": "City",
+                   "country": "Country"}
+EMPLOYEE_DEFAULT_FIELDS = ("id", "last_name", "first_name", "city")
+EMPLOYEE_FILTERS = {"city": "City = :city", "country": "Country = :country"}
+
+
+def employees_sql(sort_column, after, fields, filters):
+    # after is False on the first page, AFTER_VALUE or AFTER_NULL after a cursor
+    conditions = [EMPLOYEE_FILTERS[name] for name in filters]
+    if after:
+        conditions.insert(0, AFTER_CONDITIONS[after].format(column=sort_column))
+    return f"""SELECT {columns(EMPLOYEE_FIELDS, fields)}
+               FROM Employees e
+               {where(conditions)}
+               ORDER BY {sort_column} NULLS FIRST, EmployeeID
+               LIMIT :limit
+               OFFSET :offset"""
+
+
+@lru_cache(maxsize=LIST_QUERY_VARIANTS)
+def employees(sort_key, after, fields, filters):
+    return NamedQuery(employees_sql(EMPLOYEES_SORT_COLUMNS[sort_key], after, fields, filters), row_mapper(*fields))
+
+
+# the (sort key, keyset page) variants of the default field set, what the index advisor checks
+EMPLOYEES = {(key, after): employees(key, after, EMPLOYEE_DEFAULT_FIELDS, ())
+             for key in EMPLOYEES_SORT_COLUMNS for after in (False, AFTER_VALUE, AFTER_NULL)
+             if key in EMPLOYEES_ORDER_BY or after != AFTER_NULL}
+
+PRODUCT_EXTENDED_FIELDS = {"id": "p.ProductID", "name": "p.ProductName", "category": "c.CategoryName",
+                           "supplier": "s.CompanyName", "price": "p.UnitPrice"}
+PRODUCT_EXTENDED_DEFAULT_FIELDS = ("id", "name", "category", "supplier")
+# Discontinued is stored as the text '0' / '1'
+PRODUCT_EXTENDED_FILTERS = {"category_id": "p.CategoryID = :category_id",
+                            "supplier_id": "p.SupplierID = :supplier_id",
+                            "discontinued": "p.Discontinued = :discontinued",
+                            "min_price": "p.UnitPrice >= :min_price",
+                            "max_price": "p.UnitPrice <= :max_price"}
+
+
+@lru_cache(maxsize=LIST_QUERY_VARIANTS)
+def products_extended(fields, filters):
+    # both joins stay whatever is selected, they drop products without a category or supplier
+    return NamedQuery(f'''SELECT {columns(PRODUCT_EXTENDED_FIELDS, fields)}
+                          FROM Products p
+                          JOIN Categories c ON p.CategoryID = c.CategoryID
+                          JOIN Suppliers s ON p.SupplierID = s.SupplierID
+                          {where([PRODUCT_EXTENDED_FILTERS[name] for name in filters])}''', row_mapper(*fields))
+
+
+PRODUCTS_EXTENDED = products_extended(PRODUCT_EXTENDED_DEFAULT_FIELDS, ())
+
+PRODUCT_REVENUE_TOTALS = NamedQuery(
+    '''SELECT ProductID, orders, quantity, revenue
+       FROM ProductRevenueTotals
+       WHERE ProductID = :id''', row_mapper("id", "orders", "quantity", "revenue"))
+
+PRODUCT_ORDERS = NamedQuery(
+    '''SELECT OrderID, customer, quantity, total_price
+       FROM ProductOrderRevenue
+       WHERE ProductID = :id
+       ORDER BY OrderID''', row_mapper("id", "customer", "quantity", "total_price"))
+
+INSERT_CATEGORY = NamedQuery("INSERT INTO Categories (CategoryName) VALUES (:name)", None)
+
+UPDATE_CATEGORY = NamedQuery("UPDATE Categories SET CategoryName = :name WHERE CategoryID = :id", None)
+
+CATEGORY = NamedQuery(
+    '''SELECT c.CategoryID, c.CategoryName
+       FROM Categories c
+       WHERE c.CategoryID = :id''', row_mapper("id", "name"))
+
+DELETE_CATEGORY = NamedQuery("DELETE FROM Categories WHERE CategoryID = :id", None)
+
+
+def search_sql(table, columns, weights):
+    # best bm25 first over every match, the name column weighs most: FTS5 answers ORDER BY rank LIMIT keeping
+    # only the best :limit rows while it scans the matches, rather than sorting all of them
+    return f'''SELECT {columns}, ROUND(-rank, 4)
+               FROM {table}
+               WHERE {table} MATCH :match AND rank MATCH 'bm25({weights})'
+               ORDER BY rank
+               LIMIT :limit'''
+
+
+# search.py's FTS5 tables
+SEARCH_PRODUCTS = NamedQuery(search_sql("ProductSearch", "rowid, name, category, supplier", "10.0, 2.0, 2.0"),
+                             row_mapper("id", "name", "category", "supplier", "score"))
+
+SEARCH_CUSTOMERS = NamedQuery(search_sql("CustomerSearch", "id, name, city, country", "0.0, 10.0, 2.0, 2.0"),
+                              row_mapper("id", "name", "city", "country", "score"))
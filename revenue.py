@@ -0,0 +1,107 @@
+import os
+
+# ProductOrderRevenue holds one priced line per (product, order) exactly as /products/{id}/orders reports it,
+# ProductRevenueTotals one aggregate row per product. Triggers on the source tables keep both current.
+REVENUE_REBUILD = os.getenv("REVENUE_REBUILD", "0") == "1"
+
+LINES = '''SELECT od.ProductID, o.OrderID, c.CompanyName, od.Quantity,
+                  ROUND((od.UnitPrice * od.Quantity) - od.Discount * (od.UnitPrice * od.Quantity),2)
+           FROM Orders o
+                  JOIN Customers c ON o.CustomerID = c.CustomerID
+                  JOIN "Order Details" od ON o.OrderID = od.OrderID'''
+
+TABLES = [
+    '''CREATE TABLE IF NOT EXISTS ProductOrderRevenue (
+           ProductID INTEGER NOT NULL,
+           OrderID INTEGER NOT NULL,
+           customer TEXT,
+           quantity INTEGER NOT NULL,
+           total_price REAL NOT NULL,
+           PRIMARY KEY (ProductID, OrderID)
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS ProductRevenueTotals (
+           ProductID INTEGER PRIMARY KEY,
+           orders INTEGER NOT NULL,
+           quantity INTEGER NOT NULL,
+           revenue REAL NOT NULL
+       )''',
+]
+
+
+def insert_lines(where):
+    return f"INSERT OR REPLACE INTO ProductOrderRevenue {LINES} WHERE {where};"
+
+
+def refresh_totals(products):
+    return f'''DELETE FROM ProductRevenueTotals WHERE ProductID IN ({products});
+               INSERT INTO ProductRevenueTotals
+               SELECT ProductID, COUNT(*), SUM(quantity), ROUND(SUM(total_price),2)
+               FROM ProductOrderRevenue WHERE ProductID IN ({products}) GROUP BY ProductID;'''
+
+
+ORDER_PRODUCTS = '''SELECT ProductID FROM "Order Details" WHERE OrderID = {order}'''
+CUSTOMER_PRODUCTS = '''SELECT ProductID FROM "Order Details"
+                       WHERE OrderID IN (SELECT OrderID FROM Orders WHERE CustomerID = {customer})'''
+CUSTOMER_ORDERS = '''SELECT OrderID FROM Orders WHERE CustomerID = {customer}'''
+
+TRIGGERS = {
+    'revenue_order_details_insert': ('AFTER INSERT ON "Order Details"',
+                                     insert_lines("od.OrderID = NEW.OrderID AND od.ProductID = NEW.ProductID")
+                                     + refresh_totals("NEW.ProductID")),
+    'revenue_order_details_update': ('AFTER UPDATE ON "Order Details"',
+                                     "DELETE FROM ProductOrderRevenue "
+                                     "WHERE ProductID = OLD.ProductID AND OrderID = OLD.OrderID;"
+                                     + insert_lines("od.OrderID = NEW.OrderID AND od.ProductID = NEW.ProductID")
+                                     + refresh_totals("OLD.ProductID, NEW.ProductID")),
+    'revenue_order_details_delete': ('AFTER DELETE ON "Order Details"',
+                                     "DELETE FROM ProductOrderRevenue "
+                                     "WHERE ProductID = OLD.ProductID AND OrderID = OLD.OrderID;"
+                                     + refresh_totals("OLD.ProductID")),
+    'revenue_orders_insert': ('AFTER INSERT ON Orders',
+                              insert_lines("o.OrderID = NEW.OrderID")
+                              + refresh_totals(ORDER_PRODUCTS.format(order="NEW.OrderID"))),
+    'revenue_orders_update': ('AFTER UPDATE OF OrderID, CustomerID ON Orders',
+                              "DELETE FROM ProductOrderRevenue WHERE OrderID = OLD.OrderID;"
+                              + insert_lines("o.OrderID = NEW.OrderID")
+                              + refresh_totals(ORDER_PRODUCTS.format(order="OLD.OrderID") + " UNION "
+                                               + ORDER_PRODUCTS.format(order="NEW.OrderID"))),
+    'revenue_orders_delete': ('AFTER DELETE ON Orders',
+                              "DELETE FROM ProductOrderRevenue WHERE OrderID = OLD.OrderID;"
+                              + refresh_totals(ORDER_PRODUCTS.format(order="OLD.OrderID"))),
+    'revenue_customers_insert': ('AFTER INSERT ON Customers',
+                                 insert_lines("o.CustomerID = NEW.CustomerID")
+                                 + refresh_totals(CUSTOMER_PRODUCTS.format(customer="NEW.CustomerID"))),
+    'revenue_customers_update': ('AFTER UPDATE OF CustomerID, CompanyName ON Customers',
+                                 "DELETE FROM ProductOrderRevenue WHERE OrderID IN ("
+                                 + CUSTOMER_ORDERS.format(customer="OLD.CustomerID") + ");"
+                                 + insert_lines("o.CustomerID = NEW.CustomerID")
+                                 + refresh_totals(CUSTOMER_PRODUCTS.format(customer="OLD.CustomerID") + " UNION "
+                                                  + CUSTOMER_PRODUCTS.format(customer="NEW.CustomerID"))),
+    'revenue_customers_delete': ('AFTER DELETE ON Customers',
+                                 "DELETE FROM ProductOrderRevenue WHERE OrderID IN ("
+                                 + CUSTOMER_ORDERS.format(customer="OLD.CustomerID") + ");"
+                                 + refresh_totals(CUSTOMER_PRODUCTS.format(customer="OLD.CustomerID"))),
+}
+
+
+def rebuild(connection):
+    connection.execute("DELETE FROM ProductOrderRevenue")
+    connection.execute(f"INSERT INTO ProductOrderRevenue {LINES}")
+    connection.execute("DELETE FROM ProductRevenueTotals")
+    connection.execute('''INSERT INTO ProductRevenueTotals
+                          SELECT ProductID, COUNT(*), SUM(quantity), ROUND(SUM(total_price),2)
+                          FROM ProductOrderRevenue GROUP BY ProductID''')
+
+
+def materialize(connection, force=REVENUE_REBUILD):
+    # runs on the pool's writer at startup; the full build only happens when the tables are new
+    existing = connection.execute("SELECT COUNT(*) FROM sqlite_master "
+                                  "WHERE type = 'table' AND name = 'ProductOrderRevenue'").fetchone()[0]
+    for statement in TABLES:
+        connection.execute(statement)
+    for name, (event, body) in TRIGGERS.items():
+        if force:
+            connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+        connection.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} FOR EACH ROW BEGIN {body} END")
+    if force or not existing:
+        rebuild(connection)
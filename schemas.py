@@ -54,6 +54,11 @@ class NewSupplier(BaseModel):
         orm_mode = True
 
 
+class NewBulkSupplier(NewSupplier):
+    # required here, so a batch missing one is refused with the item's index instead of failing on insert
+    CompanyName: constr(max_length=40)
+
+
 class SupplierUpdate(BaseModel):
     CompanyName: Optional[constr(max_length=40)]
     ContactName: Optional[constr(max_length=30)]
@@ -70,6 +75,15 @@ class SupplierUpdate(BaseModel):
         orm_mode = True
 
 
+class SupplierBulkUpdate(SupplierUpdate):
+    SupplierID: PositiveInt
+
+
+class BulkResult(BaseModel):
+    SupplierID: int
+    status: str
+
+
 class Category(BaseModel):
     CategoryID: PositiveInt
     CategoryName: constr(max_length=15)
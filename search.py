@@ -0,0 +1,338 @@
+import bisect
+import heapq
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import select, text
+
+import boot
+import queries
+import versions
+
+models = boot.LazyModule("models")
+
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "50"))
+SEARCH_QUERY_MAX = int(os.getenv("SEARCH_QUERY_MAX", "200"))
+# auto: FTS5 on northwind.db and pg_trgm/tsvector on Postgres, the in-memory index wherever those are missing;
+# memory: the in-memory index everywhere
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+SEARCH_REBUILD = os.getenv("SEARCH_REBUILD", "0") == "1"
+# shorter words only match whole words: a one letter prefix matches most of the catalog, and ranking all of
+# that is what would push a query past a few milliseconds
+SEARCH_PREFIX_MIN = int(os.getenv("SEARCH_PREFIX_MIN", "2"))
+# the in-memory index re-reads everything this often, for writes made by other workers
+SEARCH_MEMORY_TTL = float(os.getenv("SEARCH_MEMORY_TTL", "300"))
+
+KINDS = ("products", "customers", "suppliers")
+
+logger = logging.getLogger(__name__)
+
+# products live in northwind.db with rowid = ProductID, customers with rowid = Customers.rowid (CustomerID is
+# text); triggers on the source tables keep them current, the same way revenue.py keeps its tables
+FTS_OPTIONS = "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'"
+TABLES = {
+    "ProductSearch": f"CREATE VIRTUAL TABLE IF NOT EXISTS ProductSearch "
+                     f"USING fts5(name, category, supplier, {FTS_OPTIONS})",
+    "CustomerSearch": f"CREATE VIRTUAL TABLE IF NOT EXISTS CustomerSearch "
+                      f"USING fts5(id UNINDEXED, name, city, country, {FTS_OPTIONS})",
+}
+
+PRODUCT_DOCUMENTS = '''SELECT p.ProductID, p.ProductName, IFNULL(c.CategoryName, ''), IFNULL(s.CompanyName, '')
+                       FROM Products p
+                              LEFT JOIN Categories c ON c.CategoryID = p.CategoryID
+                              LEFT JOIN Suppliers s ON s.SupplierID = p.SupplierID'''
+CUSTOMER_DOCUMENTS = '''SELECT rowid, CustomerID, IFNULL(CompanyName, ''), IFNULL(City, ''), IFNULL(Country, '')
+                        FROM Customers'''
+
+
+def index_products(where):
+    return f'''DELETE FROM ProductSearch WHERE rowid IN (SELECT p.ProductID FROM Products p WHERE {where});
+               INSERT INTO ProductSearch (rowid, name, category, supplier) {PRODUCT_DOCUMENTS} WHERE {where};'''
+
+
+TRIGGERS = {
+    'search_products_insert': ('AFTER INSERT ON Products', index_products("p.ProductID = NEW.ProductID")),
+    'search_products_update': ('AFTER UPDATE OF ProductID, ProductName, CategoryID, SupplierID ON Products',
+                               "DELETE FROM ProductSearch WHERE rowid = OLD.ProductID;"
+                               + index_products("p.ProductID = NEW.ProductID")),
+    'search_products_delete': ('AFTER DELETE ON Products', "DELETE FROM ProductSearch WHERE rowid = OLD.ProductID;"),
+    'search_categories_insert': ('AFTER INSERT ON Categories', index_products("p.CategoryID = NEW.CategoryID")),
+    'search_categories_update': ('AFTER UPDATE OF CategoryID, CategoryName ON Categories',
+                                 index_products("p.CategoryID IN (OLD.CategoryID, NEW.CategoryID)")),
+    'search_categories_delete': ('AFTER DELETE ON Categories', index_products("p.CategoryID = OLD.CategoryID")),
+    'search_suppliers_insert': ('AFTER INSERT ON Suppliers', index_products("p.SupplierID = NEW.SupplierID")),
+    'search_suppliers_update': ('AFTER UPDATE OF SupplierID, CompanyName ON Suppliers',
+                                index_products("p.SupplierID IN (OLD.SupplierID, NEW.SupplierID)")),
+    'search_suppliers_delete': ('AFTER DELETE ON Suppliers', index_products("p.SupplierID = OLD.SupplierID")),
+    'search_customers_insert': ('AFTER INSERT ON Customers',
+                                f"INSERT INTO CustomerSearch (rowid, id, name, city, country) "
+                                f"{CUSTOMER_DOCUMENTS} WHERE rowid = NEW.rowid;"),
+    'search_customers_update': ('AFTER UPDATE ON Customers',
+                                "DELETE FROM CustomerSearch WHERE rowid = OLD.rowid;"
+                                f"INSERT INTO CustomerSearch (rowid, id, name, city, country) "
+                                f"{CUSTOMER_DOCUMENTS} WHERE rowid = NEW.rowid;"),
+    'search_customers_delete': ('AFTER DELETE ON Customers', "DELETE FROM CustomerSearch WHERE rowid = OLD.rowid;"),
+}
+
+# the same text in the expression indexes and in the query, or Postgres will not use the indexes
+SUPPLIER_TEXT = '''lower(coalesce("CompanyName", '') || ' ' || coalesce("City", '') || ' '
+                      || coalesce("Country", ''))'''
+SUPPLIER_VECTOR = '''(setweight(to_tsvector('simple', coalesce("CompanyName", '')), 'A')
+                      || setweight(to_tsvector('simple', coalesce("City", '') || ' ' || coalesce("Country", '')),
+                                   'B'))'''
+POSTGRES_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS suppliers_search_trgm ON suppliers USING gin (({SUPPLIER_TEXT}) gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS suppliers_search_tsv ON suppliers USING gin ({SUPPLIER_VECTOR})",
+]
+# prefix matches through the tsvector, typos and infixes through trigram similarity
+POSTGRES_SUPPLIERS = text(f'''
+    SELECT "SupplierID" id, "CompanyName" name, coalesce("City", '') city, coalesce("Country", '') country,
+           round((ts_rank({SUPPLIER_VECTOR}, query) + similarity({SUPPLIER_TEXT}, :text))::numeric, 4)::float score
+    FROM suppliers, to_tsquery('simple', :tsquery) query
+    WHERE {SUPPLIER_VECTOR} @@ query OR {SUPPLIER_TEXT} % :text
+    ORDER BY score DESC, "SupplierID"
+    LIMIT :limit''')
+
+
+def tokens(value):
+    # lowercased words without diacritics, like FTS5's unicode61 tokenizer with remove_diacritics
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return re.findall(r"[^\W_]+", "".join(c for c in decomposed if not unicodedata.combining(c)).lower())
+
+
+def prefix(token):
+    return len(token) >= SEARCH_PREFIX_MIN
+
+
+def fts_query(value):
+    # every word quoted, so user input can never be read as FTS5 query syntax
+    return " ".join(f'"{token}"*' if prefix(token) else f'"{token}"' for token in tokens(value))
+
+
+def tsquery(value):
+    return " & ".join(f"{token}:*" if prefix(token) else token for token in tokens(value))
+
+
+class InvertedIndex:
+    # token -> {key: field weight}. The sorted vocabulary turns a prefix into one bisect range, which is what
+    # walking a trie would give without a node object per character.
+    def __init__(self, weights):
+        self.weights = weights
+        self.documents = {}
+        self.postings = {}
+        self.vocabulary = []
+        self._terms = {}
+
+    def add(self, key, document):
+        self.remove(key)
+        terms = {}
+        for field, weight in self.weights.items():
+            for token in tokens(document[field]):
+                terms[token] = max(terms.get(token, 0), weight)
+        for token, weight in terms.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.vocabulary, token)
+            posting[key] = weight
+        self.documents[key] = document
+        self._terms[key] = tuple(terms)
+
+    def remove(self, key):
+        for token in self._terms.pop(key, ()):
+            posting = self.postings[token]
+            del posting[key]
+            if not posting:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+        self.documents.pop(key, None)
+
+    def matching(self, term):
+        if not prefix(term):
+            return [term] if term in self.postings else []
+        end = term[:-1] + chr(ord(term[-1]) + 1)
+        return self.vocabulary[bisect.bisect_left(self.vocabulary, term):bisect.bisect_left(self.vocabulary, end)]
+
+    def search(self, value, limit):
+        # every word has to match some token by prefix; exact and rarer tokens and heavier fields score higher
+        terms = [(term, self.matching(term)) for term in dict.fromkeys(tokens(value))]
+        if not terms:
+            return []
+        # the most selective word first, so the later ones only look up keys that are still candidates
+        terms.sort(key=lambda item: sum(len(self.postings[token]) for token in item[1]))
+        total = len(self.documents)
+        scores = None
+        for term, matched in terms:
+            best = {}
+            for token in matched:
+                posting = self.postings[token]
+                boost = (1.0 if token == term else 0.5) * math.log(1 + total / len(posting))
+                for key, weight in posting.items():
+                    if scores is not None and key not in scores:
+                        continue
+                    if weight * boost > best.get(key, 0):
+                        best[key] = weight * boost
+            scores = best if scores is None else {key: scores[key] + score for key, score in best.items()}
+            if not scores:
+                return []
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [{**self.documents[key], "score": round(score, 4)} for key, score in ranked]
+
+
+class MemoryIndex:
+    # an InvertedIndex over rows returned by load(source, ids=None, after=None) -> {key: document}.
+    # A bump of one of reload_tags rebuilds it; for kind="suppliers", a bump of "suppliers:<id>" re-reads that
+    # row and a bare "suppliers" bump reads the rows above the highest indexed id, which is how crud.py numbers
+    # new suppliers.
+    def __init__(self, weights, load, kind=None, reload_tags=(), ttl=SEARCH_MEMORY_TTL):
+        self.weights = weights
+        self.load = load
+        self.kind = kind
+        self.reload_tags = set(reload_tags)
+        self.ttl = ttl
+        self.index = InvertedIndex(weights)
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = set()
+        self._new_rows = False
+        self._reload = True
+        self._loaded = 0.0
+        versions.table_versions.subscribe(self.on_bump)
+
+    def on_bump(self, *tags):
+        with self._pending_lock:
+            for tag in tags:
+                if tag in self.reload_tags:
+                    self._reload = True
+                elif tag == self.kind:
+                    self._new_rows = True
+                elif self.kind is not None and tag.startswith(f"{self.kind}:"):
+                    self._pending.add(int(tag[len(self.kind) + 1:]))
+
+    def refresh(self, source):
+        with self._pending_lock:
+            reload = self._reload or time.monotonic() - self._loaded > self.ttl
+            pending, new_rows = self._pending, self._new_rows
+            self._pending, self._new_rows, self._reload = set(), False, False
+        if reload:
+            self._loaded = time.monotonic()
+            self.index = InvertedIndex(self.weights)
+            for key, document in self.load(source).items():
+                self.index.add(key, document)
+            return
+        if pending:
+            documents = self.load(source, ids=pending)
+            for key in pending:
+                if key in documents:
+                    self.index.add(key, documents[key])
+                else:
+                    self.index.remove(key)
+        if new_rows:
+            for key, document in self.load(source, after=max(self.index.documents, default=0)).items():
+                self.index.add(key, document)
+
+    def search(self, source, value, limit):
+        with self._lock:
+            self.refresh(source)
+            return self.index.search(value, limit)
+
+
+def load_products(connection, ids=None, after=None):
+    return {row[0]: {"id": row[0], "name": row[1], "category": row[2], "supplier": row[3]}
+            for row in connection.execute(PRODUCT_DOCUMENTS)}
+
+
+def load_customers(connection, ids=None, after=None):
+    return {row[1]: {"id": row[1], "name": row[2], "city": row[3], "country": row[4]}
+            for row in connection.execute(CUSTOMER_DOCUMENTS)}
+
+
+def load_suppliers(db, ids=None, after=None):
+    query = select(models.Supplier.SupplierID, models.Supplier.CompanyName, models.Supplier.City,
+                   models.Supplier.Country)
+    if ids is not None:
+        query = query.where(models.Supplier.SupplierID.in_(ids))
+    if after is not None:
+        query = query.where(models.Supplier.SupplierID > after)
+    return {row[0]: {"id": row[0], "name": row[1] or "", "city": row[2] or "", "country": row[3] or ""}
+            for row in db.execute(query)}
+
+
+class CatalogSearch:
+    def __init__(self, backend=SEARCH_BACKEND):
+        self.backend = backend
+        self.fts = False
+        self.postgres = False
+        self.memory = {
+            "products": MemoryIndex({"name": 3.0, "category": 1.0, "supplier": 1.0}, load_products,
+                                    reload_tags=("categories",)),
+            "customers": MemoryIndex({"name": 3.0, "city": 1.0, "country": 1.0}, load_customers),
+            "suppliers": MemoryIndex({"name": 3.0, "city": 1.0, "country": 1.0}, load_suppliers, kind="suppliers"),
+        }
+
+    def prepare_northwind(self, connection, force=SEARCH_REBUILD):
+        # runs on the pool's writer at startup; the full build only happens when the tables are new
+        if self.backend == "memory":
+            return
+        existing = connection.execute("SELECT COUNT(*) FROM sqlite_master "
+                                      "WHERE type = 'table' AND name = 'ProductSearch'").fetchone()[0]
+        try:
+            for statement in TABLES.values():
+                connection.execute(statement)
+        except sqlite3.OperationalError:
+            logger.warning("sqlite3 was built without FTS5, searching northwind.db through the in-memory index")
+            return
+        for name, (event, body) in TRIGGERS.items():
+            if force:
+                connection.execute(f"DROP TRIGGER IF EXISTS {name}")
+            connection.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} FOR EACH ROW BEGIN {body} END")
+        if force or not existing:
+            connection.execute("DELETE FROM ProductSearch")
+            connection.execute(f"INSERT INTO ProductSearch (rowid, name, category, supplier) {PRODUCT_DOCUMENTS}")
+            connection.execute("DELETE FROM CustomerSearch")
+            connection.execute(f"INSERT INTO CustomerSearch (rowid, id, name, city, country) {CUSTOMER_DOCUMENTS}")
+            for table in TABLES:
+                connection.execute(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        self.fts = True
+
+    def prepare_database(self, engine):
+        if self.backend == "memory" or engine.dialect.name != "postgresql":
+            return
+        try:
+            with engine.begin() as connection:
+                for statement in POSTGRES_INDEXES:
+                    connection.execute(text(statement))
+        except Exception:
+            logger.warning("could not set up pg_trgm search indexes, searching suppliers through the in-memory index",
+                           exc_info=True)
+            return
+        self.postgres = True
+
+    def northwind(self, connection, kind, value, limit):
+        # products or customers, on a pooled northwind.db reader
+        if not self.fts:
+            return self.memory[kind].search(connection, value, limit)
+        query = queries.SEARCH_PRODUCTS if kind == "products" else queries.SEARCH_CUSTOMERS
+        return queries.fetchall(connection, query, {"match": fts_query(value), "limit": limit})
+
+    def suppliers(self, db, value, limit):
+        if not self.postgres:
+            return self.memory["suppliers"].search(db, value, limit)
+        return [dict(row._mapping) for row in db.execute(POSTGRES_SUPPLIERS,
+                                                         {"text": value.lower(), "tsquery": tsquery(value),
+                                                          "limit": limit})]
+
+    def backends(self):
+        return {"products": "fts5" if self.fts else "memory",
+                "customers": "fts5" if self.fts else "memory",
+                "suppliers": "postgres" if self.postgres else "memory"}
+
+
+catalog = CatalogSearch()
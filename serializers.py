@@ -0,0 +1,85 @@
+import json
+import os
+from functools import lru_cache
+from operator import attrgetter
+
+from pydantic import BaseModel, create_model
+from pydantic.fields import SHAPE_SINGLETON
+
+import cache
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 1: routes that opt in render trusted ORM rows with a serializer compiled per schema instead of
+# from_orm + response_model validation + jsonable_encoder. The bytes are the same either way.
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "0") == "1"
+
+# the same coercions validation would apply to values a database driver hands back, bool before its subclass int
+COERCIONS = (bool, int, float, str)
+
+
+def dumps(content):
+    # content has to be plain JSON types already; same bytes as JSONResponse.render
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def field_serializer(model, field):
+    # -> function reading field from an ORM object or model instance and coercing it as validation would
+    if field.shape != SHAPE_SINGLETON:
+        raise TypeError(f"{model.__name__}.{field.name}: only single values and nested models are supported")
+    read = attrgetter(field.name)
+    if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+        nested = compile_serializer(field.type_)
+        return lambda obj: nested(read(obj))
+    coercion = next((type_ for type_ in COERCIONS if isinstance(field.type_, type) and issubclass(field.type_, type_)),
+                    None)
+    if coercion is None:
+        return read
+    if field.required:
+        return lambda obj: coercion(read(obj))
+
+    def optional(obj):
+        value = read(obj)
+        return None if value is None else coercion(value)
+    return optional
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(model):
+    # -> function turning an object into the dict of the model's fields in declaration order, keyed by alias
+    fields = [(field.alias, field_serializer(model, field)) for field in model.__fields__.values()]
+
+    def serialize(obj):
+        if obj is None:
+            return None
+        return {alias: value(obj) for alias, value in fields}
+    return serialize
+
+
+@lru_cache(maxsize=None)
+def sparse_model(model, fields):
+    # model cut down to fields (a tuple in declaration order), validating and serializing them the way model
+    # does; one class per distinct fields= so compile_serializer builds its function once
+    if fields == tuple(model.__fields__):
+        return model
+    return create_model(f"{model.__name__}Fields", __config__=model.__config__,
+                        **{name: (model.__fields__[name].outer_type_,
+                                  ... if model.__fields__[name].required else model.__fields__[name].default)
+                           for name in fields})
+
+
+def render(model, content, many=False):
+    # -> JSON body of content (an object or, with many, a list of them) as response_model=model would send it;
+    # the DBAPI cursors do not report how many rows a SELECT returned, so ORM rows are counted here
+    metrics.record_rows(len(content) if many else content is not None)
+    if FAST_SERIALIZATION:
+        serializer = compile_serializer(model)
+        with metrics.Stopwatch("serialization"):
+            return dumps([serializer(obj) for obj in content] if many else serializer(content))
+    return cache.render([model.from_orm(obj) for obj in content] if many else model.from_orm(content))
@@ -0,0 +1,71 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+import token_store
+
+# stored: random tokens looked up in token_store, signed: HMAC tokens any worker can verify on its own
+TOKEN_MODE = os.getenv("TOKEN_MODE", "stored")
+# every worker and node has to share this secret: with a secret of its own, a process would reject the tokens
+# the others signed and a restart would log everybody out
+TOKEN_SECRET = os.getenv("TOKEN_SECRET")
+if not TOKEN_SECRET:
+    if TOKEN_MODE == "signed":
+        raise RuntimeError("TOKEN_MODE=signed needs TOKEN_SECRET, shared by every worker")
+    # nothing is issued with it outside signed mode
+    TOKEN_SECRET = secrets.token_hex(32)
+# logout of a signed token records its id until it expires, logouts beyond this many live revocations are refused
+# (503) rather than letting an earlier revoked token through again; 0 turns logout into a no-op on the server
+TOKEN_REVOCATION_MAX = int(os.getenv("TOKEN_REVOCATION_MAX", "10000"))
+
+revocations = token_store.create_store(max_tokens=TOKEN_REVOCATION_MAX, evict=False) if TOKEN_REVOCATION_MAX else None
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _signature(payload):
+    return _b64encode(hmac.new(TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def issue(kind, subject, ttl=token_store.TOKEN_TTL):
+    claims = {"kind": kind, "sub": subject, "exp": int(time.time() + ttl), "jti": secrets.token_urlsafe(12)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify(kind, token):
+    if not token or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    # compared as bytes: compare_digest only takes ASCII str, and a token is whatever the client sent
+    if not hmac.compare_digest(signature.encode(), _signature(payload).encode()):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(claims, dict) or claims.get("kind") != kind or claims.get("exp", 0) <= time.time():
+        return None
+    if revocations is not None and revocations.contains("revoked", claims["jti"]):
+        return None
+    return claims
+
+
+def revoke(kind, token):
+    claims = verify(kind, token)
+    if claims is None:
+        return False
+    if revocations is not None:
+        revocations.add("revoked", claims["jti"], ttl=max(claims["exp"] - time.time(), 1))
+    return True
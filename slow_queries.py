@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# statements running at least this many milliseconds are logged with their parameters and plan, -1 turns the
+# check off. SLOW_QUERY_MS sets both sides; SLOW_QUERY_SQLITE_MS covers the pooled northwind.db queries of
+# main.py and SLOW_QUERY_ORM_MS the SQLAlchemy engine behind crud.py. Both can be changed at runtime.
+SLOW_QUERY_MS = os.getenv("SLOW_QUERY_MS", "-1")
+SLOW_QUERY_SQLITE_MS = float(os.getenv("SLOW_QUERY_SQLITE_MS", SLOW_QUERY_MS))
+SLOW_QUERY_ORM_MS = float(os.getenv("SLOW_QUERY_ORM_MS", SLOW_QUERY_MS))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+SLOW_QUERY_PARAMETERS_MAX = int(os.getenv("SLOW_QUERY_PARAMETERS_MAX", "1000"))
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+logger = logging.getLogger(__name__)
+
+
+def seconds(milliseconds):
+    return None if milliseconds is None or milliseconds < 0 else milliseconds / 1000
+
+
+class SlowQueryLog:
+    def __init__(self, sqlite_ms=SLOW_QUERY_SQLITE_MS, orm_ms=SLOW_QUERY_ORM_MS, size=SLOW_QUERY_LOG_SIZE):
+        self.thresholds = {"sqlite": seconds(sqlite_ms), "orm": seconds(orm_ms)}
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.logged = 0
+
+    def set_thresholds(self, sqlite_ms=None, orm_ms=None):
+        if sqlite_ms is not None:
+            self.thresholds["sqlite"] = seconds(sqlite_ms)
+        if orm_ms is not None:
+            self.thresholds["orm"] = seconds(orm_ms)
+
+    def record(self, source, duration, sql, parameters, plan):
+        entry = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "source": source,
+            "duration_ms": round(1000 * duration, 3),
+            "sql": " ".join(sql.split()),
+            "parameters": repr(parameters)[:SLOW_QUERY_PARAMETERS_MAX],
+            "plan": plan,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.logged += 1
+        logger.warning("slow %s query, %.1f ms: %s\nparameters: %s\nplan:\n  %s", source, entry["duration_ms"],
+                       entry["sql"], entry["parameters"], "\n  ".join(plan))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "thresholds_ms": {source: None if threshold is None else 1000 * threshold
+                                  for source, threshold in self.thresholds.items()},
+                "logged": self.logged,
+                "entries": list(reversed(self._entries)),
+            }
+
+
+slow_query_log = SlowQueryLog()
+
+
+def explainable(sql):
+    return sql.lstrip().split(None, 1)[0].upper() in EXPLAINABLE
+
+
+def sqlite_plan(connection, sql, parameters):
+    if not explainable(sql):
+        return []
+    try:
+        return [row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def check_sqlite(connection, sql, parameters, start):
+    # called by queries.py after a statement (and its fetch) that started at perf_counter() == start
+    threshold = slow_query_log.thresholds["sqlite"]
+    if threshold is None:
+        return
+    duration = time.perf_counter() - start
+    if duration >= threshold:
+        slow_query_log.record("sqlite", duration, sql, parameters, sqlite_plan(connection, sql, parameters))
+
+
+def orm_plan(conn, statement, parameters, executemany):
+    if not explainable(statement):
+        return []
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    # straight on the DBAPI connection, so explaining does not go through these hooks again
+    cursor = conn.connection.cursor()
+    try:
+        if conn.dialect.name == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [row[3] for row in cursor.fetchall()]
+        if conn.dialect.name != "postgresql":
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            return [str(row[0]) for row in cursor.fetchall()]
+        # a failed EXPLAIN must not abort the transaction the statement belongs to
+        cursor.execute("SAVEPOINT slow_query_plan")
+        try:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            return [row[0] for row in cursor.fetchall()]
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_plan")
+            raise
+        finally:
+            cursor.execute("RELEASE SAVEPOINT slow_query_plan")
+    except Exception as e:
+        return [f"EXPLAIN failed: {e}"]
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if slow_query_log.thresholds["orm"] is not None:
+        conn.info["slow_query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def check_statement(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("slow_query_start", None)
+    threshold = slow_query_log.thresholds["orm"]
+    if start is None or threshold is None:
+        return
+    duration = time.perf_counter() - start
+    if duration >= threshold:
+        slow_query_log.record("orm", duration, statement, parameters,
+                              orm_plan(conn, statement, parameters, executemany))
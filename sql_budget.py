@@ -0,0 +1,52 @@
+import contextvars
+import logging
+import os
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# off: nothing is counted, warn: log routes over budget, fail: replace their response with a 500
+SQL_BUDGET_MODE = os.getenv("SQL_BUDGET_MODE", "off")
+
+logger = logging.getLogger(__name__)
+
+
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+        self.budget = None
+        self.statements = []
+
+
+_counter = contextvars.ContextVar("sql_statement_counter", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _counter.get()
+    if counter is not None:
+        counter.count += 1
+        counter.statements.append(statement)
+
+
+def limit(budget: int):
+    async def set_budget():
+        counter = _counter.get()
+        if counter is not None:
+            counter.budget = budget
+    return set_budget
+
+
+async def middleware(request, call_next):
+    counter = StatementCounter()
+    _counter.set(counter)
+    response = await call_next(request)
+    response.headers["X-SQL-Statements"] = str(counter.count)
+    if counter.budget is not None and counter.count > counter.budget:
+        message = f"SQL statement budget exceeded on {request.method} {request.url.path}: " \
+                  f"{counter.count} > {counter.budget}"
+        logger.warning("%s\n%s", message, "\n".join(counter.statements))
+        if SQL_BUDGET_MODE == "fail":
+            return JSONResponse(status_code=500, content={"detail": message, "statements": counter.statements})
+    return response
@@ -0,0 +1,164 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+NORTHWIND_DB_PATH = os.getenv("NORTHWIND_DB_PATH", "northwind.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+SQLITE_POOL_TIMEOUT = float(os.getenv("SQLITE_POOL_TIMEOUT", "5"))
+# prepared statements kept per connection, keyed by SQL text; has to hold every query in queries.py
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+
+def decode_text(b):
+    return b.decode(errors="ignore")
+
+
+class CheckoutStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.waits += waited
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait, 3),
+            }
+
+
+class SQLitePool:
+    def __init__(self, path=NORTHWIND_DB_PATH, size=SQLITE_POOL_SIZE, timeout=SQLITE_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._readers = queue.LifoQueue(maxsize=size)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.read_stats = CheckoutStats()
+        self.write_stats = CheckoutStats()
+
+    def _connect(self, read_only):
+        if read_only:
+            uri = f"file:{quote(os.path.abspath(self.path))}?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                         cached_statements=SQLITE_CACHED_STATEMENTS)
+        else:
+            connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS)
+        connection.text_factory = decode_text
+        if metrics.METRICS:
+            connection.set_trace_callback(metrics.count_sqlite_statement)
+        return connection
+
+    def open(self):
+        # WAL has to be switched on by a writable connection before the readers attach
+        self._writer = self._connect(read_only=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        for _ in range(self.size):
+            self._readers.put(self._connect(read_only=True))
+
+    def close(self):
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    @contextmanager
+    def reader(self, rotate=False):
+        # rotate puts the connection back at the far end of the queue instead of on top, for the warm-up to
+        # reach every reader one after the other
+        start = time.perf_counter()
+        waited = False
+        try:
+            connection = self._readers.get_nowait()
+        except queue.Empty:
+            waited = True
+            try:
+                connection = self._readers.get(timeout=self.timeout)
+            except queue.Empty:
+                self.read_stats.record_timeout()
+                raise HTTPException(status_code=503, detail="Database pool exhausted")
+        self.read_stats.record(time.perf_counter() - start, waited)
+        try:
+            yield connection
+        finally:
+            if rotate:
+                self._put_last(connection)
+            else:
+                self._readers.put(connection)
+
+    def _put_last(self, connection):
+        # LifoQueue only puts on top; its items are a list guarded by its mutex, bottom first
+        with self._readers.mutex:
+            self._readers.queue.insert(0, connection)
+            self._readers.unfinished_tasks += 1
+            self._readers.not_empty.notify()
+
+    @contextmanager
+    def writer(self):
+        start = time.perf_counter()
+        waited = not self._writer_lock.acquire(blocking=False)
+        if waited and not self._writer_lock.acquire(timeout=self.timeout):
+            self.write_stats.record_timeout()
+            raise HTTPException(status_code=503, detail="Database writer busy")
+        try:
+            self.write_stats.record(time.perf_counter() - start, waited)
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+        finally:
+            self._writer_lock.release()
+
+    def _run_read(self, fn, *args):
+        with self.reader() as connection, metrics.Stopwatch("db"):
+            return fn(connection, *args)
+
+    def _run_write(self, fn, *args):
+        with self.writer() as connection, metrics.Stopwatch("db"):
+            return fn(connection, *args)
+
+    async def read(self, fn, *args):
+        return await run_in_threadpool(self._run_read, fn, *args)
+
+    async def write(self, fn, *args):
+        return await run_in_threadpool(self._run_write, fn, *args)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "available": self._readers.qsize(),
+            "timeout": self.timeout,
+            "read": self.read_stats.as_dict(),
+            "write": self.write_stats.as_dict(),
+        }
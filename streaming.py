@@ -0,0 +1,53 @@
+import json
+import os
+from contextlib import ExitStack
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request, stream):
+    return stream == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def encode_rows(rows):
+    return "".join(json.dumps(dict(row), ensure_ascii=False, separators=(",", ":")) + "\n"
+                   for row in rows).encode("utf-8")
+
+
+async def ndjson_response(pool, query, not_found=False, batch_size=STREAM_BATCH_SIZE):
+    # query(connection) returns an executed cursor; the pooled reader stays checked out
+    # until the last batch has been sent
+    stack = ExitStack()
+
+    def start():
+        try:
+            cursor = query(stack.enter_context(pool.reader()))
+            with metrics.Stopwatch("db"):
+                return cursor, cursor.fetchmany(batch_size)
+        except BaseException:
+            stack.close()
+            raise
+
+    cursor, batch = await run_in_threadpool(start)
+    if not batch and not_found:
+        stack.close()
+        raise HTTPException(status_code=404)
+
+    def lines(batch):
+        with stack:
+            while batch:
+                metrics.record_rows(len(batch))
+                with metrics.Stopwatch("serialization"):
+                    body = encode_rows(batch)
+                yield body
+                with metrics.Stopwatch("db"):
+                    batch = cursor.fetchmany(batch_size)
+
+    return StreamingResponse(lines(batch), media_type=NDJSON_MEDIA_TYPE)
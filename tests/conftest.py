@@ -0,0 +1,58 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+
+def utf8_copy(source, target):
+    # northwind.db keeps some names as latin-1 bytes, which the raw pool decodes leniently; the copy standing in
+    # for Postgres gets them as text, as the Postgres database has them
+    shutil.copyfile(source, target)
+    connection = sqlite3.connect(target)
+    tables = {table: [row[1] for row in connection.execute(f'PRAGMA table_info("{table}")')]
+              for table, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                               "AND sql NOT LIKE '%WITHOUT ROWID%' AND sql NOT LIKE 'CREATE VIRTUAL%' "
+                                               "AND name NOT LIKE '%Search%'").fetchall()}
+    connection.text_factory = bytes
+    for table, columns in tables.items():
+        for column in columns:
+            rows = connection.execute(f'SELECT rowid, "{column}" FROM "{table}" '
+                                      f'WHERE typeof("{column}") = \'text\'').fetchall()
+            for rowid, value in rows:
+                try:
+                    value.decode()
+                except UnicodeDecodeError:
+                    connection.execute(f'UPDATE "{table}" SET "{column}" = ? WHERE rowid = ?',
+                                       (value.decode("latin-1"), rowid))
+    connection.commit()
+    connection.close()
+
+
+# the modules read their settings on import: the app gets its own copies of northwind.db, one for the raw
+# sqlite pool and one standing in for the SQLAlchemy database
+DATA = tempfile.mkdtemp(prefix="northwind-tests-")
+shutil.copyfile(os.path.join(ROOT, "northwind.db"), os.path.join(DATA, "northwind.db"))
+utf8_copy(os.path.join(ROOT, "northwind.db"), os.path.join(DATA, "orm.db"))
+os.environ["NORTHWIND_DB_PATH"] = os.path.join(DATA, "northwind.db")
+os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(DATA, 'orm.db')}"
+os.environ["WARMUP"] = "off"
+# a route running more statements than its sql_budget.limit() answers 500
+os.environ["SQL_BUDGET_MODE"] = "fail"
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+    shutil.rmtree(DATA, ignore_errors=True)
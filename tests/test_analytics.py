@@ -0,0 +1,35 @@
+import sqlite3
+
+from conftest import DATA
+
+
+def test_reports(client):
+    revenue = client.get("/analytics/revenue?by=category").json()["revenue"]
+    assert revenue == sorted(revenue, key=lambda row: -row["revenue"])
+    assert len(client.get("/analytics/top_products?limit=5&metric=quantity").json()["products"]) == 5
+    customer = client.get("/analytics/customers?limit=1").json()["customers"][0]
+    assert customer["average_order"] == round(customer["revenue"] / customer["orders"], 2)
+    assert client.get("/analytics/revenue?by=nothing").status_code == 400
+
+
+def test_write_behind_the_apps_back_moves_the_etag(client):
+    path = "/analytics/top_products?limit=1&metric=quantity"
+    first = client.get(path)
+    etag = first.headers["ETag"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    product = first.json()["products"][0]
+    connection = sqlite3.connect(f"{DATA}/northwind.db")
+    connection.execute('INSERT INTO "Order Details" (OrderID, ProductID, UnitPrice, Quantity, Discount) '
+                       "VALUES (10248, ?, 1, 1000, 0)", (product["id"],))
+    connection.commit()
+    try:
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.json()["products"][0]["quantity"] == product["quantity"] + 1000
+        assert client.get(path).json()["products"][0]["quantity"] == product["quantity"] + 1000
+    finally:
+        connection.execute('DELETE FROM "Order Details" WHERE OrderID = 10248 AND ProductID = ?', (product["id"],))
+        connection.commit()
+        connection.close()
+    assert client.get(path).json()["products"][0] == product
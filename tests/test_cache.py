@@ -0,0 +1,78 @@
+from starlette.requests import Request
+
+import cache
+
+
+def request(path, query=b""):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query, "headers": []})
+
+
+def fill(response_cache, path, tags=()):
+    # store() only keeps what the same request missed on
+    miss = request(path)
+    assert response_cache.get(miss) is None
+    response_cache.store(miss, {}, tags=tags)
+
+
+def test_key_ignores_query_order():
+    assert cache.cache_key(request("/suppliers", b"b=2&a=1")) == cache.cache_key(request("/suppliers", b"a=1&b=2"))
+
+
+def test_store_then_hit():
+    response_cache = cache.ResponseCache(maxsize=4, ttl=60)
+    first = request("/shippers")
+    assert response_cache.get(first) is None
+    response_cache.store(first, [{"ShipperID": 1}], tags=("shippers",), headers={"ETag": '"1"'})
+    hit = response_cache.get(request("/shippers"))
+    assert hit.body == b'[{"ShipperID":1}]'
+    assert hit.headers["ETag"] == '"1"'
+    assert (response_cache.hits, response_cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted():
+    response_cache = cache.ResponseCache(maxsize=2, ttl=60)
+    fill(response_cache, "/a")
+    fill(response_cache, "/b")
+    # keep /a recently used: storing /c pushes /b out
+    response_cache.get(request("/a"))
+    fill(response_cache, "/c")
+    assert response_cache.get(request("/a")) is not None
+    assert response_cache.get(request("/b")) is None
+    assert response_cache.evictions == 1
+
+
+def test_expired_entry_is_a_miss():
+    response_cache = cache.ResponseCache(maxsize=2, ttl=-1)
+    fill(response_cache, "/a")
+    assert response_cache.get(request("/a")) is None
+    assert response_cache.expirations == 1
+
+
+def test_invalidate_drops_the_tagged_entries_only():
+    response_cache = cache.ResponseCache(maxsize=4, ttl=60)
+    fill(response_cache, "/shippers", ("shippers",))
+    fill(response_cache, "/suppliers", ("suppliers",))
+    response_cache.invalidate("suppliers")
+    assert response_cache.get(request("/suppliers")) is None
+    assert response_cache.get(request("/shippers")) is not None
+
+
+def test_write_during_the_query_keeps_the_result_out():
+    response_cache = cache.ResponseCache(maxsize=4, ttl=60)
+    miss = request("/suppliers")
+    response_cache.get(miss)
+    response_cache.invalidate("suppliers")
+    response = response_cache.store(miss, {"stale": True}, tags=("suppliers",))
+    assert response.body == b'{"stale":true}'
+    assert response_cache.get(request("/suppliers")) is None
+
+
+def test_supplier_write_invalidates_its_cached_reads(client):
+    id = client.post("/suppliers", json={"CompanyName": "Cached"}).json()["SupplierID"]
+    assert client.get(f"/suppliers/{id}").json()["CompanyName"] == "Cached"
+    hits = client.get("/stats/cache").json()["hits"]
+    assert client.get(f"/suppliers/{id}").json()["CompanyName"] == "Cached"
+    assert client.get("/stats/cache").json()["hits"] == hits + 1
+    assert client.put(f"/suppliers/{id}", json={"CompanyName": "Recached"}).status_code == 200
+    assert client.get(f"/suppliers/{id}").json()["CompanyName"] == "Recached"
+    client.delete(f"/suppliers/{id}")
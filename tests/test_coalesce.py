@@ -0,0 +1,147 @@
+import asyncio
+import json
+
+import pytest
+
+import coalesce
+import database
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def counting(result=None, error=None):
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        if error is not None:
+            raise error
+        return result
+    return calls, compute
+
+
+def test_routes_are_opt_in():
+    assert not coalesce.SingleFlight(routes=frozenset()).enabled("suppliers")
+    assert coalesce.SingleFlight(routes=frozenset({"suppliers"})).enabled("suppliers")
+    assert coalesce.SingleFlight(routes=frozenset({"*"})).enabled("suppliers")
+
+
+def test_identical_reads_share_one_compute():
+    flights = coalesce.SingleFlight(routes=frozenset({"suppliers"}), buckets=(1, 2, 5))
+    calls, compute = counting(result=[1])
+
+    async def requests():
+        return await asyncio.gather(*(flights.run("suppliers", "key", compute) for _ in range(3)))
+    assert run(requests()) == [[1]] * 3
+    assert len(calls) == 1
+    assert flights.stats()["flights"] == {"suppliers": {"flights": 1, "requests": 3, "shared": 2, "largest": 3}}
+    assert 'single_flight_requests_bucket{route="suppliers",le="2"} 0' in flights.render()
+    assert 'single_flight_requests_bucket{route="suppliers",le="5"} 1' in flights.render()
+
+
+def test_disabled_route_and_different_keys_compute_each_time():
+    flights = coalesce.SingleFlight(routes=frozenset({"suppliers"}))
+    calls, compute = counting()
+
+    async def requests():
+        await asyncio.gather(flights.run("shippers", "key", compute), flights.run("shippers", "key", compute),
+                             flights.run("suppliers", "a", compute), flights.run("suppliers", "b", compute))
+    run(requests())
+    assert len(calls) == 4
+
+
+def test_every_request_of_the_flight_gets_the_exception():
+    flights = coalesce.SingleFlight(routes=frozenset({"*"}))
+    calls, compute = counting(error=LookupError())
+
+    async def requests():
+        return await asyncio.gather(*(flights.run("supplier", "key", compute) for _ in range(2)),
+                                    return_exceptions=True)
+    assert [type(result) for result in run(requests())] == [LookupError, LookupError]
+    assert len(calls) == 1
+
+
+def test_cancelled_request_leaves_the_flight_to_the_others():
+    flights = coalesce.SingleFlight(routes=frozenset({"*"}))
+    calls, compute = counting(result="rows")
+
+    async def requests():
+        first = asyncio.ensure_future(flights.run("suppliers", "key", compute))
+        second = asyncio.ensure_future(flights.run("suppliers", "key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+    assert run(requests()) == "rows"
+    assert len(calls) == 1
+
+
+def test_read_closes_its_own_session():
+    closed = []
+
+    class FakeSession:
+        def close(self):
+            closed.append(self)
+    assert run(database.read(FakeSession, lambda db, value: (db, value), 1))[1] == 1
+    assert len(closed) == 1
+
+
+async def get(app, path):
+    scope = {"type": "http", "http_version": "1.1", "method": "GET", "scheme": "http", "path": path,
+             "raw_path": path.encode(), "query_string": b"", "root_path": "", "headers": [(b"host", b"testserver")],
+             "client": ("testclient", 50000), "server": ("testserver", 80)}
+    messages = []
+    requested, done = [], asyncio.Event()
+
+    async def receive():
+        if requested:
+            await done.wait()
+            return {"type": "http.disconnect"}
+        requested.append(None)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            done.set()
+    await app(scope, receive, send)
+    status = next(message["status"] for message in messages if message["type"] == "http.response.start")
+    return status, b"".join(message.get("body", b"") for message in messages
+                            if message["type"] == "http.response.body")
+
+
+def test_concurrent_requests_are_coalesced(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(coalesce.flights, "routes", frozenset({"*"}))
+    before = coalesce.flights.stats()["flights"].get("supplier_products", {"requests": 0, "flights": 0})
+
+    async def requests():
+        return await asyncio.gather(*(get(main.app, "/suppliers/2/products") for _ in range(4)))
+    responses = run(requests())
+    assert {status for status, _ in responses} == {200}
+    assert len({body for _, body in responses}) == 1
+    assert json.loads(responses[0][1])
+    after = coalesce.flights.stats()["flights"]["supplier_products"]
+    assert after["requests"] - before["requests"] == 4
+    assert after["flights"] - before["flights"] < 4
+
+
+def test_404_reaches_every_request_of_the_flight(client, monkeypatch):
+    import main
+
+    monkeypatch.setattr(coalesce.flights, "routes", frozenset({"*"}))
+
+    async def requests():
+        return await asyncio.gather(*(get(main.app, "/products/100000/orders") for _ in range(2)))
+    assert [status for status, _ in run(requests())] == [404, 404]
+
+
+@pytest.mark.parametrize("summary", ["", "?summary=true"])
+def test_product_orders_is_plain_json(client, summary):
+    response = client.get(f"/products/1/orders{summary}")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert set(response.json()) == {"summary" if summary else "orders"}
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+import counters
+
+
+def test_shared_counter_is_abstract():
+    with pytest.raises(TypeError):
+        counters.SharedCounter()
+
+
+def test_memory_counter():
+    counter = counters.MemoryCounter()
+    assert [counter.increment() for _ in range(3)] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("exact", [True, False])
+def test_mmap_counter_is_shared_through_the_file(tmp_path, exact):
+    path = str(tmp_path / "counter.bin")
+    first = counters.MmapCounter(path, exact=exact, flush_interval=0)
+    second = counters.MmapCounter(path, exact=exact, flush_interval=0)
+    try:
+        assert first.increment() == 1
+        assert second.increment() == 2
+        assert first.increment() == 3
+    finally:
+        first.close()
+        second.close()
+
+
+def test_batched_counter_flushes_on_close(tmp_path):
+    path = str(tmp_path / "counter.bin")
+    counter = counters.MmapCounter(path, exact=False, flush_interval=3600)
+    counter.increment()
+    counter.increment()
+    counter.close()
+    reader = counters.MmapCounter(path, exact=True)
+    try:
+        assert reader.increment() == 3
+    finally:
+        reader.close()
+
+
+def test_sql_counter(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'counter.db'}")
+    counter = counters.SQLCounter(engine, exact=False, flush_interval=0)
+    assert [counter.increment() for _ in range(3)] == [1, 2, 3]
+
+
+def test_counter_route(client):
+    first = int(client.get("/counter").json())
+    assert int(client.get("/counter").json()) == first + 1
+
+
+def test_idle_process_flushes_its_batch(tmp_path):
+    path = str(tmp_path / "counter.bin")
+    batching = counters.MmapCounter(path, exact=False, flush_interval=0.05)
+    reader = counters.MmapCounter(path, exact=False, flush_interval=0.05)
+    try:
+        batching.increment()
+        batching.increment()
+        deadline = time.monotonic() + 2
+        while reader._add(0, 0) != 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reader._add(0, 0) == 2
+    finally:
+        batching.close()
+        reader.close()
@@ -0,0 +1,48 @@
+import json
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import index_advisor
+from conftest import ROOT
+
+
+def test_advisor_is_abstract():
+    with pytest.raises(TypeError):
+        index_advisor.Advisor([])
+
+
+def test_findings():
+    plan = ["SCAN e", "SCAN CONSTANT ROW", "SEARCH p USING INDEX ix (x=?)", "USE TEMP B-TREE FOR ORDER BY"]
+    assert index_advisor.findings(plan, set()) == ["SCAN e", "USE TEMP B-TREE FOR ORDER BY"]
+    assert index_advisor.findings(plan, {"e", "sort"}) == []
+    assert index_advisor.findings(plan, {"*"}) == ["USE TEMP B-TREE FOR ORDER BY"]
+
+
+@pytest.fixture
+def northwind(tmp_path):
+    path = str(tmp_path / "northwind.db")
+    shutil.copyfile(os.path.join(ROOT, "northwind.db"), path)
+    return path
+
+
+def test_report_leaves_the_database_alone(northwind, tmp_path):
+    before = open(northwind, "rb").read()
+    output = tmp_path / "report.json"
+    index_advisor.main(["--database", northwind, "--skip-orm", "--output", str(output)])
+    report = json.loads(output.read_text())
+    assert open(northwind, "rb").read() == before
+    missing = [entry["index"] for entry in report["northwind"]["missing_indexes"]]
+    assert "CREATE INDEX ix_employees_city ON Employees (City, EmployeeID)" in missing
+
+
+def test_create_fixes_the_flagged_queries(northwind, tmp_path):
+    output = tmp_path / "report.json"
+    assert index_advisor.main(["--database", northwind, "--skip-orm", "--create", "--output", str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert report["northwind"]["flagged"] == []
+    connection = sqlite3.connect(northwind)
+    names = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert "ix_employees_city" in names
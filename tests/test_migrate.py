@@ -0,0 +1,50 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+
+import migrate
+from conftest import DATA, ROOT
+
+
+def digest(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def test_shipped_database_is_already_migrated(tmp_path):
+    path = str(tmp_path / "northwind.db")
+    shutil.copyfile(os.path.join(ROOT, "northwind.db"), path)
+    before = digest(path)
+    assert migrate.main(["--database", path]) == 0
+    assert digest(path) == before
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_rebuild_matches_the_materialized_tables(tmp_path):
+    path = str(tmp_path / "northwind.db")
+    shutil.copyfile(os.path.join(ROOT, "northwind.db"), path)
+    connection = sqlite3.connect(path)
+    shipped = connection.execute("SELECT * FROM ProductRevenueTotals ORDER BY ProductID").fetchall()
+    migrate.migrate(connection, rebuild=True)
+    assert connection.execute("SELECT * FROM ProductRevenueTotals ORDER BY ProductID").fetchall() == shipped
+
+
+def test_triggers_keep_the_revenue_current(client):
+    before = client.get("/products/1/orders?summary=true").json()["summary"]
+    connection = sqlite3.connect(f"{DATA}/northwind.db")
+    connection.execute('INSERT INTO "Order Details" (OrderID, ProductID, UnitPrice, Quantity, Discount) '
+                       "VALUES (10248, 1, 10, 3, 0)")
+    connection.commit()
+    try:
+        after = client.get("/products/1/orders?summary=true").json()["summary"]
+        assert (after["orders"], after["quantity"]) == (before["orders"] + 1, before["quantity"] + 3)
+        assert round(after["revenue"] - before["revenue"], 2) == 30
+        orders = client.get("/products/1/orders").json()["orders"]
+        assert {"id": 10248, "customer": "Vins et alcools Chevalier", "quantity": 3, "total_price": 30.0} in orders
+    finally:
+        connection.execute('DELETE FROM "Order Details" WHERE OrderID = 10248 AND ProductID = 1')
+        connection.commit()
+        connection.close()
+    assert client.get("/products/1/orders?summary=true").json()["summary"] == before
@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+import pagination
+from conftest import DATA
+
+
+def test_split_page_with_more_rows():
+    assert pagination.split_page([1, 2, 3], 2) == ([1, 2], True)
+    assert pagination.split_page([1, 2], 2) == ([1, 2], False)
+
+
+def test_split_page_empty_page_has_no_next():
+    assert pagination.split_page([1], 0) == ([], False)
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor("city", "London", 5)
+    assert pagination.decode_cursor(cursor, "city", 2) == ["London", 5]
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", pagination.encode_cursor("id", 1)])
+def test_cursor_for_another_key_is_rejected(cursor):
+    with pytest.raises(Exception) as error:
+        pagination.decode_cursor(cursor, "city", 2)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", [pagination.encode_cursor("city", {"a": 1}, 1),
+                                    pagination.encode_cursor("city", "London", [1]),
+                                    pagination.encode_cursor("city", "London", "1"),
+                                    pagination.encode_cursor("city", "London", True)])
+def test_tampered_cursor_values_are_rejected(cursor):
+    with pytest.raises(Exception) as error:
+        pagination.decode_cursor(cursor, "city", 2)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/employees?cursor=" + pagination.encode_cursor("id", {"a": 1}, 1),
+                                  "/suppliers?cursor=" + pagination.encode_cursor("SupplierID", {"x": 1}),
+                                  "/suppliers/1/products?cursor=" + pagination.encode_cursor("ProductID", [1])])
+def test_tampered_cursor_is_a_bad_request(client, path):
+    assert client.get(path).status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/employees?limit=0", "/suppliers?limit=0", "/suppliers/1/products?limit=0"])
+def test_empty_page(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.parametrize("order", [None, "first_name", "last_name", "city"])
+def test_employee_cursor_walks_every_row_once(client, order):
+    query = f"&order={order}" if order else ""
+    everyone = client.get(f"/employees?limit=100{query}").json()["employees"]
+    seen, cursor = [], None
+    while True:
+        page = client.get(f"/employees?limit=2{query}" + (f"&cursor={cursor}" if cursor else "")).json()
+        seen.extend(page["employees"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == everyone
+
+
+def test_supplier_cursor_walks_every_row_once(client):
+    everyone = client.get("/suppliers?limit=100").json()
+    seen, cursor = [], None
+    while True:
+        response = client.get("/suppliers?limit=7" + (f"&cursor={cursor}" if cursor else ""))
+        seen.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == everyone
+
+
+def test_employee_cursor_through_null_sort_values(client):
+    connection = sqlite3.connect(f"{DATA}/northwind.db")
+    connection.executemany("INSERT INTO Employees (LastName, FirstName, City) VALUES (?, ?, NULL)",
+                           [("Null", "One"), ("Null", "Two"), ("Null", "Three")])
+    connection.commit()
+    try:
+        everyone = client.get("/employees?limit=100&order=city").json()["employees"]
+        assert [employee["city"] for employee in everyone[:3]] == [None, None, None]
+        seen, cursor = [], None
+        while True:
+            page = client.get("/employees?limit=2&order=city" + (f"&cursor={cursor}" if cursor else "")).json()
+            seen.extend(page["employees"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert seen == everyone
+    finally:
+        connection.execute("DELETE FROM Employees WHERE LastName = 'Null'")
+        connection.commit()
+        connection.close()
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from sqlalchemy import create_engine
+
+import main
+import patients
+
+
+def registration(name):
+    return {"name": name, "surname": "Batch", "register_date": date.today().isoformat(),
+            "vaccination_date": date.today().isoformat()}
+
+
+def test_batch_registers_every_patient_with_a_unique_id(client):
+    response = client.post("/register/batch", json=[{"name": "Ann", "surname": "Lee"}, {"name": "Bo", "surname": "Li"}])
+    assert response.status_code == 201
+    registered = response.json()
+    assert len({patient["id"] for patient in registered}) == 2
+    assert [patient["name"] for patient in registered] == ["Ann", "Bo"]
+    for patient in registered:
+        assert client.get(f"/patient/{patient['id']}").json() == patient
+    single = client.post("/register", json={"name": "Cy", "surname": "Lo"}).json()
+    assert single["id"] not in {patient["id"] for patient in registered}
+
+
+def test_empty_batch(client):
+    response = client.post("/register/batch", json=[])
+    assert (response.status_code, response.json()) == (201, [])
+
+
+def test_batch_size_is_capped(client, monkeypatch):
+    monkeypatch.setattr(main, "PATIENTS_BATCH_MAX", 2)
+    response = client.post("/register/batch", json=[{"name": "A", "surname": "B"}] * 3)
+    assert response.status_code == 413
+
+
+def test_sql_registry_allocates_ids_atomically(tmp_path):
+    registry = patients.SQLPatientRegistry(create_engine(f"sqlite:///{tmp_path / 'patients.db'}",
+                                                         connect_args={"check_same_thread": False}))
+    with ThreadPoolExecutor(4) as executor:
+        batches = list(executor.map(lambda worker: registry.register([registration(f"P{worker}")] * 5), range(8)))
+    ids = [patient["id"] for batch in batches for patient in batch]
+    assert len(set(ids)) == len(ids) == 40
+    fresh = patients.SQLPatientRegistry(registry.engine)
+    assert all(fresh.get(patient["id"]) == patient for batch in batches for patient in batch)
+
+
+def test_sql_registry_reads_through_its_lru_cache(tmp_path):
+    registry = patients.SQLPatientRegistry(create_engine(f"sqlite:///{tmp_path / 'patients.db'}"), cache_size=2)
+    first, second, third = registry.register([registration("A"), registration("B"), registration("C")])
+    # the oldest of the three fell out of the cache, the two newest are served without a query
+    assert registry.cache.get(first["id"]) is None
+    assert registry.cache.get(third["id"]) == third
+    with registry.engine.begin() as connection:
+        connection.execute(registry.patients.update().values(name="changed"))
+    assert registry.get(second["id"])["name"] == "B"
+    assert registry.get(first["id"])["name"] == "changed"
+    assert registry.get(999) is None
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = patients.LRUCache(maxsize=2)
+    cache.put(1, "one")
+    cache.put(2, "two")
+    cache.get(1)
+    cache.put(3, "three")
+    assert (cache.get(1), cache.get(2), cache.get(3)) == ("one", None, "three")
@@ -0,0 +1,22 @@
+import sqlite3
+
+import queries
+
+
+def test_row_mapper():
+    row = queries.row_mapper("id", "name")
+    assert row(None, (1, "Chai")) == {"id": 1, "name": "Chai"}
+
+
+def test_named_query_rows():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE Products (ProductID INTEGER PRIMARY KEY, ProductName TEXT)")
+    connection.execute("INSERT INTO Products VALUES (1, 'Chai'), (2, 'Chang')")
+    assert queries.fetchone(connection, queries.PRODUCT, {"id": 2}) == {"id": 2, "name": "Chang"}
+    assert queries.fetchone(connection, queries.PRODUCT, {"id": 3}) is None
+
+
+def test_sparse_variants_select_only_their_fields(client):
+    customers = client.get("/customers?fields=name,id&country=UK").json()["customers"]
+    assert customers and all(list(customer) == ["id", "name"] for customer in customers)
+    assert client.get("/customers?fields=nope").status_code == 400
@@ -0,0 +1,97 @@
+import shutil
+import time
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import database
+import versions
+from conftest import DATA
+
+
+def request(cookie=None):
+    headers = [] if cookie is None else [(b"cookie", f"{database.PRIMARY_COOKIE}={cookie}".encode())]
+    return Request({"type": "http", "method": "GET", "path": "/suppliers", "query_string": b"", "headers": headers})
+
+
+@pytest.fixture
+def replicas(tmp_path):
+    # a copy of the ORM database standing in for a streaming replica
+    shutil.copyfile(f"{DATA}/orm.db", tmp_path / "replica.db")
+    replicas = database.ReplicaSet([f"sqlite:///{tmp_path / 'replica.db'}"], interval=3600)
+    replicas.start()
+    yield replicas
+    replicas.stop()
+
+
+def test_reads_go_to_a_caught_up_replica(replicas):
+    replica = replicas.replicas[0]
+    assert (replica.healthy, replica.lag, replica.usable) == (True, 0, True)
+    assert replicas.route(request(), ("replicas-idle",)) == ("replica", replica)
+    assert replicas.sessions(request(), ("replicas-idle",)) is replica.sessions
+    assert replicas.stats()["routed"] == {"replica": 1}
+
+
+def test_lagging_or_failing_replica_falls_back_to_the_primary(replicas, monkeypatch):
+    replica = replicas.replicas[0]
+    monkeypatch.setattr(database, "REPLICA_LAG_QUERY", f"SELECT {database.REPLICA_MAX_LAG + 1}")
+    replicas.check()
+    assert replica.healthy and not replica.usable
+    assert replicas.route(request(), ("replicas-idle",)) == ("primary_fallback", None)
+    monkeypatch.setattr(database, "REPLICA_LAG_QUERY", "SELECT * FROM no_such_table")
+    replicas.check()
+    assert (replica.healthy, replica.error) == (False, "OperationalError")
+    monkeypatch.setattr(database, "REPLICA_LAG_QUERY", None)
+    replicas.check()
+    assert replica.usable
+
+
+def test_recent_writes_read_from_the_primary(replicas):
+    assert replicas.route(request(cookie=time.time() + 60), ("replicas-idle",)) == ("primary_after_write", None)
+    assert replicas.route(request(cookie=time.time() - 60), ("replicas-idle",))[0] == "replica"
+    assert replicas.route(request(cookie="garbage"), ("replicas-idle",))[0] == "replica"
+    versions.table_versions.bump("replicas-written")
+    assert replicas.route(request(), ("replicas-written",)) == ("primary_after_write", None)
+
+
+def test_replica_must_match_the_primary_driver():
+    with pytest.raises(ValueError):
+        database.Replica("sqlite+aiosqlite:///replica.db")
+
+
+def test_writes_set_the_primary_cookie():
+    # main adds the middleware only when replicas are configured
+    app = FastAPI()
+    app.add_middleware(database.ReadYourWritesMiddleware)
+
+    @app.post("/write")
+    def write(db=Depends(database.get_db)):
+        return {}
+
+    @app.post("/fail")
+    def fail(db=Depends(database.get_db)):
+        raise HTTPException(status_code=400)
+
+    @app.post("/compute")
+    def compute():
+        return {}
+
+    @app.get("/read")
+    def read(db=Depends(database.get_db)):
+        return {}
+
+    client = TestClient(app)
+    response = client.post("/write")
+    assert float(response.cookies[database.PRIMARY_COOKIE]) > time.time()
+    for method, path in (("post", "/fail"), ("post", "/compute"), ("get", "/read")):
+        assert "set-cookie" not in getattr(client, method)(path).headers
+
+
+def test_supplier_reads_are_routed(client, replicas, monkeypatch):
+    monkeypatch.setattr(database, "replicas", replicas)
+    versions.table_versions.bump("suppliers")
+    assert client.get("/suppliers/1").status_code == 200
+    assert client.get("/shippers/1").status_code == 200
+    assert replicas.stats()["routed"] == {"primary_after_write": 1, "replica": 1}
@@ -0,0 +1,52 @@
+import sqlite3
+
+import search
+from conftest import DATA
+
+
+def test_fts_query_quotes_every_word():
+    assert search.fts_query('Chai" OR x*') == '"chai"* "or"* "x"'
+
+
+def test_search_products_and_customers(client):
+    results = client.get("/search?q=chai&kind=products").json()
+    assert results["products"][0]["name"] == "Chai"
+    customers = client.get("/search?q=alfreds").json()["customers"]
+    assert customers[0]["id"] == "ALFKI"
+
+
+def test_search_suppliers(client):
+    assert client.get("/search?q=exotic&kind=suppliers").json()["suppliers"][0]["id"] == 1
+
+
+def test_search_rejects_unknown_kinds(client):
+    assert client.get("/search?q=chai&kind=nothing").status_code == 400
+
+
+def test_triggers_keep_the_fts_index_current(client):
+    connection = sqlite3.connect(f"{DATA}/northwind.db")
+    connection.execute("UPDATE Products SET ProductName = 'Chai Zebrawood' WHERE ProductID = 1")
+    connection.commit()
+    try:
+        assert search.catalog.fts
+        assert [product["id"] for product in client.get("/search?q=zebrawood&kind=products").json()["products"]] == [1]
+    finally:
+        connection.execute("UPDATE Products SET ProductName = 'Chai' WHERE ProductID = 1")
+        connection.commit()
+        connection.close()
+    assert client.get("/search?q=zebrawood&kind=products").json()["products"] == []
+
+
+def test_best_match_is_ranked_over_every_match(client):
+    # one strong match far down the rowid order, behind many weak ones
+    connection = sqlite3.connect(f"{DATA}/northwind.db")
+    connection.executemany("INSERT INTO CustomerSearch (rowid, id, name, city, country) VALUES (?, ?, ?, '', '')",
+                           [(100000 + i, f"W{i}", f"Weak shop {i} with a very long name and one quasar mention")
+                            for i in range(1500)] + [(200000, "BEST", "Quasar Quasar")])
+    connection.commit()
+    try:
+        assert client.get("/search?q=quasar&kind=customers&limit=1").json()["customers"][0]["id"] == "BEST"
+    finally:
+        connection.execute("DELETE FROM CustomerSearch WHERE rowid >= 100000")
+        connection.commit()
+        connection.close()
@@ -0,0 +1,55 @@
+from typing import List, Optional
+
+import pytest
+from pydantic import BaseModel
+
+import cache
+import schemas
+import serializers
+
+
+class Row:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+
+class Inner(BaseModel):
+    id: int
+
+
+class Outer(BaseModel):
+    flag: bool
+    count: int
+    price: Optional[float]
+    name: Optional[str]
+    inner: Optional[Inner]
+
+
+def test_compiled_serializer_coerces_like_validation():
+    serialize = serializers.compile_serializer(Outer)
+    row = Row(flag=1, count="3", price=None, name="x", inner=Row(id="7"))
+    assert serialize(row) == {"flag": True, "count": 3, "price": None, "name": "x", "inner": {"id": 7}}
+    assert serialize(Row(flag=0, count=1, price="2.5", name=None, inner=None))["price"] == 2.5
+    assert serialize(None) is None
+
+
+def test_lists_are_not_supported():
+    class Many(BaseModel):
+        ids: List[int]
+
+    with pytest.raises(TypeError):
+        serializers.compile_serializer(Many)
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_render_matches_response_model(monkeypatch, fast):
+    monkeypatch.setattr(serializers, "FAST_SERIALIZATION", fast)
+    shipper = Row(ShipperID=1, CompanyName="Speedy Express", Phone="(503) 555-9831")
+    assert serializers.render(schemas.Shipper, [shipper], many=True) == \
+        cache.render([schemas.Shipper.from_orm(shipper)])
+
+
+def test_fast_serialization_sends_the_same_bytes(client, monkeypatch):
+    slow = client.get("/suppliers/2/products?limit=3").content
+    monkeypatch.setattr(serializers, "FAST_SERIALIZATION", True)
+    assert client.get("/suppliers/2/products?limit=3").content == slow
@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+
+import signed_tokens
+import token_store
+from conftest import ROOT
+
+# correctly signed, but the claims are not an object
+NOT_AN_OBJECT = f"{signed_tokens._b64encode(b'1')}.{signed_tokens._signature(signed_tokens._b64encode(b'1'))}"
+
+
+def test_issue_and_verify():
+    claims = signed_tokens.verify("token", signed_tokens.issue("token", "4dm1n"))
+    assert claims["kind"] == "token" and claims["sub"] == "4dm1n"
+
+
+def test_kind_is_checked():
+    assert signed_tokens.verify("session", signed_tokens.issue("token", "4dm1n")) is None
+
+
+def test_expired_token_is_rejected():
+    assert signed_tokens.verify("token", signed_tokens.issue("token", "4dm1n", ttl=-1)) is None
+
+
+def test_tampered_payload_is_rejected():
+    payload, signature = signed_tokens.issue("token", "4dm1n").split(".")
+    forged = signed_tokens._b64encode(b'{"kind":"token","sub":"4dm1n","exp":9999999999,"jti":"x"}')
+    assert signed_tokens.verify("token", f"{forged}.{signature}") is None
+
+
+@pytest.mark.parametrize("token", [None, "", "no-dot", "a.b.c", "abc.ééé", "é.abc", NOT_AN_OBJECT])
+def test_malformed_tokens_are_invalid(token):
+    assert signed_tokens.verify("token", token) is None
+
+
+def test_revoked_token_is_rejected():
+    token = signed_tokens.issue("token", "4dm1n")
+    assert signed_tokens.revoke("token", token)
+    assert signed_tokens.verify("token", token) is None
+    assert not signed_tokens.revoke("token", token)
+
+
+def test_non_ascii_token_is_a_401(client, monkeypatch):
+    monkeypatch.setattr(signed_tokens, "TOKEN_MODE", "signed")
+    assert client.get("/welcome_token", params={"token": "abc.ééé"}).status_code == 401
+    token = client.post("/login_token", auth=("4dm1n", "NotSoSecurePa$$")).json()["token"]
+    assert client.get("/welcome_token", params={"token": token}).status_code == 200
+
+
+@pytest.mark.parametrize("store", [lambda: token_store.MemoryTokenStore(max_tokens=2, evict=False),
+                                   lambda: token_store.SQLTokenStore(create_engine("sqlite://"), max_tokens=2,
+                                                                     evict=False)])
+def test_full_revocation_store_refuses_instead_of_forgetting(monkeypatch, store):
+    monkeypatch.setattr(signed_tokens, "revocations", store())
+    tokens = [signed_tokens.issue("token", "4dm1n") for _ in range(3)]
+    assert signed_tokens.revoke("token", tokens[0]) and signed_tokens.revoke("token", tokens[1])
+    with pytest.raises(HTTPException) as error:
+        signed_tokens.revoke("token", tokens[2])
+    assert error.value.status_code == 503
+    assert [signed_tokens.verify("token", token) is None for token in tokens] == [True, True, False]
+
+
+def test_expired_revocations_make_room(monkeypatch):
+    monkeypatch.setattr(signed_tokens, "revocations", token_store.MemoryTokenStore(max_tokens=1, evict=False))
+    signed_tokens.revocations.add("revoked", "gone", ttl=-1)
+    assert signed_tokens.revoke("token", signed_tokens.issue("token", "4dm1n"))
+
+
+def test_signed_mode_needs_a_shared_secret():
+    env = {**os.environ, "TOKEN_MODE": "signed"}
+    env.pop("TOKEN_SECRET", None)
+    missing = subprocess.run([sys.executable, "-c", "import signed_tokens"], cwd=ROOT, env=env,
+                             stderr=subprocess.PIPE)
+    assert missing.returncode != 0 and b"TOKEN_SECRET" in missing.stderr
+    shared = subprocess.run([sys.executable, "-c", "import signed_tokens"], cwd=ROOT,
+                            env={**env, "TOKEN_SECRET": "shared"})
+    assert shared.returncode == 0
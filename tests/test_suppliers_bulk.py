@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import crud
+import database
+import schemas
+import views
+
+
+def create(client, *names):
+    response = client.post("/suppliers/bulk", json=[{"CompanyName": name, "City": "Bulkton"} for name in names])
+    assert response.status_code == 201
+    return [supplier["SupplierID"] for supplier in response.json()]
+
+
+def test_bulk_create(client):
+    first, second = create(client, "Bulk One", "Bulk Two")
+    assert second == first + 1
+    assert client.get(f"/suppliers/{first}").json()["CompanyName"] == "Bulk One"
+
+
+def test_bulk_update_mixed_columns_in_one_statement(client):
+    first, second = create(client, "Update One", "Update Two")
+    response = client.patch("/suppliers/bulk", json=[{"SupplierID": first, "CompanyName": "Renamed"},
+                                                     {"SupplierID": second, "City": "Moved", "Phone": "123"},
+                                                     {"SupplierID": 999999, "City": "Nowhere"}])
+    assert response.status_code == 200
+    assert response.headers["X-SQL-Statements"] == "2"
+    assert response.json() == [{"SupplierID": first, "status": "updated"},
+                               {"SupplierID": second, "status": "updated"},
+                               {"SupplierID": 999999, "status": "not_found"}]
+    renamed = client.get(f"/suppliers/{first}").json()
+    assert (renamed["CompanyName"], renamed["City"]) == ("Renamed", "Bulkton")
+    moved = client.get(f"/suppliers/{second}").json()
+    assert (moved["CompanyName"], moved["City"], moved["Phone"]) == ("Update Two", "Moved", "123")
+
+
+def test_bulk_delete(client):
+    first, second = create(client, "Delete One", "Delete Two")
+    response = client.delete(f"/suppliers/bulk?ids={first}&ids={second}&ids=999999")
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == ["deleted", "deleted", "not_found"]
+    assert client.get(f"/suppliers/{first}").status_code == 404
+
+
+def test_bulk_size_is_capped(client):
+    response = client.post("/suppliers/bulk", json=[{"CompanyName": "x"}] * (views.SUPPLIERS_BULK_MAX + 1))
+    assert response.status_code == 413
+
+
+def test_item_without_company_name_is_refused_by_index(client):
+    response = client.post("/suppliers/bulk", json=[{"CompanyName": "Valid"}, {"ContactName": "x"}])
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", 1, "CompanyName"]
+
+
+@pytest.mark.parametrize("method, path, body", [
+    ("patch", "/suppliers/bulk", [{"SupplierID": 1, "City": "A"}, {"SupplierID": 1, "City": "B"}]),
+    ("delete", "/suppliers/bulk?ids=999998&ids=999998", None),
+])
+def test_repeated_ids_are_refused(client, method, path, body):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == 422
+    assert "index 1" in response.json()["detail"]
+
+
+def test_concurrent_creates_get_distinct_ids(client):
+    def create(worker):
+        db = database.SessionLocal()
+        try:
+            ids = [crud.create_supplier(db, schemas.NewSupplier(CompanyName=f"Racer {worker}")).SupplierID]
+            ids += [supplier.SupplierID for supplier in crud.create_suppliers(
+                db, [schemas.NewSupplier(CompanyName=f"Racer {worker}")] * 3)]
+            return ids
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(4) as executor:
+        ids = [id for worker_ids in executor.map(create, range(8)) for id in worker_ids]
+    assert len(set(ids)) == len(ids) == 32
+    client.delete("/suppliers/bulk?" + "&".join(f"ids={id}" for id in ids))
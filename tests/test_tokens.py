@@ -0,0 +1,42 @@
+import re
+
+ADMIN = ("4dm1n", "NotSoSecurePa$$")
+
+
+def login_token(client):
+    response = client.post("/login_token", auth=ADMIN)
+    assert response.status_code == 201
+    return response.json()["token"]
+
+
+def test_login_requires_credentials(client):
+    assert client.post("/login_token", auth=("4dm1n", "wrong")).status_code == 401
+
+
+def test_tokens_are_random_and_url_safe(client):
+    tokens = {login_token(client) for _ in range(3)}
+    assert len(tokens) == 3
+    assert all(re.fullmatch(r"[A-Za-z0-9_-]{43}", token) for token in tokens)
+
+
+def test_token_round_trip(client):
+    token = login_token(client)
+    assert client.get(f"/welcome_token?token={token}&format=json").json() == {"message": "Welcome!"}
+    logout = client.delete(f"/logout_token?token={token}&format=json", allow_redirects=False)
+    assert logout.status_code == 303
+    assert client.get(f"/welcome_token?token={token}").status_code == 401
+
+
+def test_session_round_trip(client):
+    response = client.post("/login_session", auth=ADMIN)
+    assert response.status_code == 201
+    session_token = response.cookies["session_token"]
+    cookies = {"session_token": session_token}
+    assert client.get("/welcome_session", cookies=cookies).text == "Welcome!"
+    assert client.delete("/logout_session", cookies=cookies, allow_redirects=False).status_code == 303
+    assert client.get("/welcome_session", cookies=cookies).status_code == 401
+    client.cookies.clear()
+
+
+def test_unknown_token_is_rejected(client):
+    assert client.get("/welcome_token?token=made-up").status_code == 401
@@ -0,0 +1,83 @@
+from email.utils import formatdate
+
+from starlette.requests import Request
+
+import versions
+
+
+def request(path, headers=(), query=b""):
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query,
+                    "headers": [(name.encode(), value.encode()) for name, value in headers]})
+
+
+def test_matching_etag_is_not_modified():
+    table_versions = versions.TableVersions()
+    not_modified, headers = table_versions.check(request("/shippers"), ("shippers",))
+    assert not_modified is None
+    for if_none_match in (headers["ETag"], f'"other", W/{headers["ETag"]}'):
+        response, _ = table_versions.check(request("/shippers", [("if-none-match", if_none_match)]), ("shippers",))
+        assert response.status_code == 304
+        assert response.headers["ETag"] == headers["ETag"]
+
+
+def test_bump_changes_the_etag_of_its_tags_only():
+    table_versions = versions.TableVersions()
+    _, shippers = table_versions.check(request("/shippers"), ("shippers",))
+    _, suppliers = table_versions.check(request("/suppliers"), ("suppliers",))
+    table_versions.bump("suppliers")
+    assert table_versions.check(request("/shippers"), ("shippers",))[1]["ETag"] == shippers["ETag"]
+    assert table_versions.check(request("/suppliers"), ("suppliers",))[1]["ETag"] != suppliers["ETag"]
+
+
+def test_etags_differ_across_processes():
+    _, first = versions.TableVersions().check(request("/shippers"), ("shippers",))
+    _, second = versions.TableVersions().check(request("/shippers"), ("shippers",))
+    assert first["ETag"] != second["ETag"]
+
+
+def test_if_modified_since():
+    table_versions = versions.TableVersions()
+    _, headers = table_versions.check(request("/shippers"), ("shippers",))
+    since = [("if-modified-since", headers["Last-Modified"])]
+    assert table_versions.check(request("/shippers", since), ("shippers",))[0].status_code == 304
+    before = [("if-modified-since", formatdate(table_versions.started - 60, usegmt=True))]
+    assert table_versions.check(request("/shippers", before), ("shippers",))[0] is None
+    assert table_versions.check(request("/shippers", [("if-modified-since", "yesterday")]), ("shippers",))[0] is None
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    table_versions = versions.TableVersions()
+    _, headers = table_versions.check(request("/shippers"), ("shippers",))
+    both = [("if-none-match", '"other"'), ("if-modified-since", headers["Last-Modified"])]
+    assert table_versions.check(request("/shippers", both), ("shippers",))[0] is None
+
+
+def test_conditional_get_after_a_write(client):
+    id = client.post("/suppliers", json={"CompanyName": "Conditional"}).json()["SupplierID"]
+    etag = client.get(f"/suppliers/{id}").headers["ETag"]
+    assert client.get(f"/suppliers/{id}", headers={"If-None-Match": etag}).status_code == 304
+    client.put(f"/suppliers/{id}", json={"City": "Elsewhere"})
+    response = client.get(f"/suppliers/{id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["City"] == "Elsewhere"
+    client.delete(f"/suppliers/{id}")
+
+
+def test_wildcard_is_not_answered_before_the_lookup(client):
+    assert client.get("/suppliers/999999", headers={"If-None-Match": "*"}).status_code == 404
+    assert client.get("/suppliers/1", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_equivalent_queries_share_the_etag():
+    table_versions = versions.TableVersions()
+    _, first = table_versions.check(request("/suppliers", query=b"limit=5&country=UK"), ("suppliers",))
+    _, second = table_versions.check(request("/suppliers", query=b"country=UK&limit=5"), ("suppliers",))
+    _, other = table_versions.check(request("/suppliers", query=b"country=US&limit=5"), ("suppliers",))
+    assert first["ETag"] == second["ETag"] != other["ETag"]
+
+
+def test_cached_body_revalidates_under_either_query_order(client):
+    etag = client.get("/suppliers?limit=5&country=UK").headers["ETag"]
+    cached = client.get("/suppliers?country=UK&limit=5")
+    assert cached.headers["ETag"] == etag
+    assert client.get("/suppliers?country=UK&limit=5", headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,49 @@
+import asyncio
+
+import boot
+import queries
+import sqlite_pool
+import warmup
+from conftest import DATA
+
+
+def test_readers_are_primed_one_at_a_time(monkeypatch):
+    pool = sqlite_pool.SQLitePool(f"{DATA}/northwind.db", size=3)
+    pool.open()
+    checked_out, primed = [], set()
+    fetchall = queries.fetchall
+
+    def counting(connection, query, parameters):
+        checked_out.append(pool.size - pool._readers.qsize())
+        primed.add(id(connection))
+        return fetchall(connection, query, parameters)
+    monkeypatch.setattr(queries, "fetchall", counting)
+    try:
+        warmup.prime_readers(pool)
+    finally:
+        pool.close()
+    assert len(primed) == 3
+    assert set(checked_out) == {1}
+
+
+def test_busy_readers_are_left_cold():
+    pool = sqlite_pool.SQLitePool(f"{DATA}/northwind.db", size=1, timeout=0.01)
+    pool.open()
+    try:
+        with pool.reader():
+            warmup.prime_readers(pool)
+        assert pool.stats()["read"]["timeouts"] == 1
+    finally:
+        pool.close()
+
+
+def test_failed_warm_up_still_ends_warm(monkeypatch):
+    monkeypatch.setattr(boot, "readiness", boot.Readiness())
+
+    class BrokenPool:
+        size = 0
+
+        async def read(self, fn, *args):
+            raise OSError("disk went away")
+    asyncio.get_event_loop().run_until_complete(warmup.run(BrokenPool()))
+    assert boot.readiness.state() == {"status": boot.WARM, "error": "OSError"}
@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import Column, Float, MetaData, String, Table, delete, func, select
+
+import database
+
+# memory:// keeps tokens in this process only; any SQLAlchemy URL (sqlite:///tokens.db for several
+# workers on one box, postgresql://... for several boxes) or "database" for the app's own engine is shared
+TOKEN_STORE_URL = os.getenv("TOKEN_STORE_URL", "memory://")
+TOKEN_TTL = float(os.getenv("TOKEN_TTL", "3600"))
+# the login endpoints used to remember only the last 3 tokens of each kind
+TOKEN_STORE_MAX_TOKENS = int(os.getenv("TOKEN_STORE_MAX_TOKENS", "3"))
+
+
+def refuse(kind):
+    raise HTTPException(status_code=503, detail=f"Too many {kind} tokens, try again later")
+
+
+class MemoryTokenStore:
+    # beyond max_tokens of a kind, evict drops the one expiring first, otherwise add() refuses the new one
+    def __init__(self, ttl=TOKEN_TTL, max_tokens=TOKEN_STORE_MAX_TOKENS, evict=True):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.evict = evict
+        self._tokens = {}
+        self._expiry = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _purge(self, kind, now):
+        # heap entries are dropped lazily: one whose token was removed or re-added since is just skipped
+        tokens = self._tokens.setdefault(kind, {})
+        heap = self._expiry.setdefault(kind, [])
+        while heap:
+            expires, sequence, token = heap[0]
+            stale = tokens.get(token) != (expires, sequence)
+            if not (stale or expires <= now or (self.evict and len(tokens) > self.max_tokens)):
+                break
+            heapq.heappop(heap)
+            if not stale:
+                del tokens[token]
+
+    def add(self, kind, token, ttl=None):
+        with self._lock:
+            now = time.time()
+            tokens = self._tokens.setdefault(kind, {})
+            if not self.evict:
+                self._purge(kind, now)
+                if token not in tokens and len(tokens) >= self.max_tokens:
+                    refuse(kind)
+            entry = (now + (ttl or self.ttl), next(self._sequence))
+            tokens[token] = entry
+            heapq.heappush(self._expiry.setdefault(kind, []), (*entry, token))
+            self._purge(kind, now)
+
+    def contains(self, kind, token):
+        entry = self._tokens.get(kind, {}).get(token)
+        return entry is not None and entry[0] > time.time()
+
+    def remove(self, kind, token):
+        with self._lock:
+            entry = self._tokens.get(kind, {}).pop(token, None)
+            return entry is not None and entry[0] > time.time()
+
+
+class SQLTokenStore:
+    def __init__(self, engine, ttl=TOKEN_TTL, max_tokens=TOKEN_STORE_MAX_TOKENS, evict=True):
+        self.engine = engine
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.evict = evict
+        self.metadata = MetaData()
+        self.tokens = Table(
+            "auth_tokens", self.metadata,
+            Column("kind", String(16), primary_key=True),
+            Column("token", String(128), primary_key=True),
+            Column("expires", Float, nullable=False, index=True),
+        )
+        self._created = False
+
+    def _ensure_table(self):
+        if not self._created:
+            self.metadata.create_all(self.engine)
+            self._created = True
+
+    def add(self, kind, token, ttl=None):
+        self._ensure_table()
+        now = time.time()
+        newest = select(self.tokens.c.token) \
+            .where(self.tokens.c.kind == kind) \
+            .order_by(self.tokens.c.expires.desc()) \
+            .limit(self.max_tokens)
+        with self.engine.begin() as connection:
+            connection.execute(delete(self.tokens).where(self.tokens.c.kind == kind, self.tokens.c.expires <= now))
+            replaced = connection.execute(
+                delete(self.tokens).where(self.tokens.c.kind == kind, self.tokens.c.token == token)
+            ).rowcount
+            if not self.evict and not replaced and connection.execute(
+                    select(func.count()).select_from(self.tokens).where(self.tokens.c.kind == kind)
+            ).scalar() >= self.max_tokens:
+                refuse(kind)
+            connection.execute(self.tokens.insert().values(kind=kind, token=token, expires=now + (ttl or self.ttl)))
+            if self.evict:
+                connection.execute(delete(self.tokens).where(self.tokens.c.kind == kind,
+                                                             self.tokens.c.token.notin_(newest.scalar_subquery())))
+
+    def contains(self, kind, token):
+        if token is None:
+            return False
+        self._ensure_table()
+        with self.engine.connect() as connection:
+            return connection.execute(
+                select(self.tokens.c.token).where(self.tokens.c.kind == kind, self.tokens.c.token == token,
+                                                  self.tokens.c.expires > time.time())
+            ).first() is not None
+
+    def remove(self, kind, token):
+        if token is None:
+            return False
+        self._ensure_table()
+        with self.engine.begin() as connection:
+            return connection.execute(
+                delete(self.tokens).where(self.tokens.c.kind == kind, self.tokens.c.token == token,
+                                          self.tokens.c.expires > time.time())
+            ).rowcount > 0
+
+
+def create_store(url=TOKEN_STORE_URL, max_tokens=TOKEN_STORE_MAX_TOKENS, evict=True):
+    if url == "memory://":
+        return MemoryTokenStore(max_tokens=max_tokens, evict=evict)
+    return SQLTokenStore(database.shared_engine(url), max_tokens=max_tokens, evict=evict)
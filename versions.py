@@ -0,0 +1,79 @@
+import hashlib
+import secrets
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+
+def matches_etag(if_none_match, etag):
+    # "*" is left to the full response: check() runs before the route looks its rows up, so it cannot tell
+    # whether any exist. If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches.
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return any((candidate[2:] if candidate.startswith("W/") else candidate) == etag for candidate in candidates)
+
+
+def request_key(request):
+    # path and query with the parameters sorted: the response cache keys its entries on it and the ETag is
+    # derived from it, so equivalent URLs share both
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+class TableVersions:
+    def __init__(self):
+        # the boot id keeps ETags from a previous process (whose counters restarted at 0) from matching
+        self.boot_id = secrets.token_hex(8)
+        self.started = time.time()
+        self._versions = {}
+        self._modified = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def bump(self, *tags):
+        now = time.time()
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+                self._modified[tag] = now
+        for listener in self._listeners:
+            listener(*tags)
+
+    def version(self, tag):
+        return self._versions.get(tag, 0)
+
+    def modified(self, tags):
+        # -> time.time() of the latest bump of any of tags, 0 if none was bumped since boot
+        return max([self._modified.get(tag, 0) for tag in tags], default=0)
+
+    def _validators(self, request, tags):
+        with self._lock:
+            versions = ",".join(f"{tag}={self._versions.get(tag, 0)}" for tag in tags)
+            modified = max([self._modified.get(tag, self.started) for tag in tags], default=self.started)
+        digest = hashlib.sha1(f"{self.boot_id}|{request_key(request)}|{versions}".encode())
+        return {"ETag": f'"{digest.hexdigest()}"', "Last-Modified": formatdate(modified, usegmt=True)}, modified
+
+    def check(self, request, tags):
+        # -> (304 response or None, validator headers for the full response)
+        headers, modified = self._validators(request, tags)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if matches_etag(if_none_match, headers["ETag"]):
+                return Response(status_code=304, headers=headers), headers
+            return None, headers
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return None, headers
+            if int(modified) <= since:
+                return Response(status_code=304, headers=headers), headers
+        return None, headers
+
+
+table_versions = TableVersions()
@@ -1,67 +1,188 @@
-from typing import List
+import os
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import PositiveInt
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
 
 # from . import crud, schemas
 # from .database import get_db
+import cache
+import coalesce
 import crud
 import database
+import fieldsets
+import pagination
 import schemas
+import serializers
+import sql_budget
+import versions
+
+SUPPLIERS_BULK_MAX = int(os.getenv("SUPPLIERS_BULK_MAX", "1000"))
 
 router = APIRouter()
 
 
-@router.get("/shippers/{shipper_id}", response_model=schemas.Shipper)
-async def get_shipper(shipper_id: PositiveInt, db: Session = Depends(database.get_db)):
-    db_shipper = crud.get_shipper(db, shipper_id)
+@router.get("/shippers/{shipper_id}", response_model=schemas.Shipper, dependencies=[Depends(sql_budget.limit(1))])
+async def get_shipper(request: Request, shipper_id: PositiveInt,
+                      db: Session = Depends(database.read_db("shippers"))):
+    not_modified, validators = versions.table_versions.check(request, ("shippers",))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+    db_shipper = await database.run(db, crud.get_shipper, shipper_id)
     if db_shipper is None:
         raise HTTPException(status_code=404, detail="Shipper not found")
-    return db_shipper
+    return cache.response_cache.store(request, serializers.render(schemas.Shipper, db_shipper), tags=("shippers",),
+                                      headers=validators)
 
 
-@router.get("/shippers", response_model=List[schemas.Shipper])
-async def get_shippers(db: Session = Depends(database.get_db)):
-    return crud.get_shippers(db)
+@router.get("/shippers", response_model=List[schemas.Shipper], dependencies=[Depends(sql_budget.limit(1))])
+async def get_shippers(request: Request, db: Session = Depends(database.read_db("shippers"))):
+    not_modified, validators = versions.table_versions.check(request, ("shippers",))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+    db_shippers = await database.run(db, crud.get_shippers)
+    return cache.response_cache.store(request, serializers.render(schemas.Shipper, db_shippers, many=True),
+                                      tags=("shippers",), headers=validators)
 
 
 # lecture 5
 
-@router.get("/suppliers", response_model=List[schemas.SupplierSimplified])
-async def get_suppliers(db: Session = Depends(database.get_db)):
-    return crud.get_suppliers(db)
-
-
-@router.get("/suppliers/{id}", response_model=schemas.Supplier)
-async def get_supplier(id: PositiveInt, db: Session = Depends(database.get_db)):
-    db_supplier = crud.get_supplier(db, id)
-    if db_supplier is None:
-        raise HTTPException(status_code=404, detail="Supplier not found")
-    return db_supplier
-
-
-@router.get("/suppliers/{id}/products", response_model=List[schemas.ProductFromSupplier])
-async def get_products_from_supplier(id: PositiveInt, db: Session = Depends(database.get_db)):
-    db_products_from_supplier = crud.get_products_from_supplier(db, id)
-    if not db_products_from_supplier:
-        raise HTTPException(status_code=404)
-    return db_products_from_supplier
-
-
-@router.post("/suppliers", response_model=schemas.Supplier, status_code=201)
+def next_cursor_headers(rows: list, limit: int, key: str):
+    rows, has_more = pagination.split_page(rows, limit)
+    if has_more:
+        return rows, {"X-Next-Cursor": pagination.encode_cursor(key, getattr(rows[-1], key))}
+    return rows, {}
+
+
+@router.get("/suppliers", response_model=List[schemas.SupplierSimplified], dependencies=[Depends(sql_budget.limit(1))])
+async def get_suppliers(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                        fields: Optional[str] = None, country: Optional[str] = None, city: Optional[str] = None,
+                        sessions: sessionmaker = Depends(database.read_sessions("suppliers"))):
+    # fields= picks from every schemas.Supplier field, SupplierID always comes back for the next cursor
+    fields = fieldsets.selected(fields, schemas.Supplier.__fields__, tuple(schemas.SupplierSimplified.__fields__),
+                                required=("SupplierID",))
+    filters = fieldsets.filters(country=country, city=city)
+    not_modified, validators = versions.table_versions.check(request, ("suppliers",))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+    limit = pagination.page_size(limit)
+    after_id = pagination.decode_cursor(cursor, "SupplierID", 1)[0] if cursor else None
+
+    async def load():
+        db_suppliers = await database.read(sessions, crud.get_suppliers, limit + 1, after_id, fields, filters)
+        db_suppliers, headers = next_cursor_headers(db_suppliers, limit, "SupplierID")
+        return serializers.render(serializers.sparse_model(schemas.Supplier, fields), db_suppliers, many=True), headers
+
+    body, headers = await coalesce.flights.run("suppliers", coalesce.key(request, ("suppliers",), sessions), load)
+    return cache.response_cache.store(request, body, tags=("suppliers",), headers={**validators, **headers})
+
+
+def check_bulk_size(items: list):
+    if len(items) > SUPPLIERS_BULK_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {SUPPLIERS_BULK_MAX} suppliers per request")
+
+
+def check_unique_ids(ids: List[int]):
+    # an id given twice would get two results for one row
+    seen = set()
+    for index, id in enumerate(ids):
+        if id in seen:
+            raise HTTPException(status_code=422, detail=f"SupplierID {id} repeated at index {index}")
+        seen.add(id)
+
+
+@router.post("/suppliers/bulk", response_model=List[schemas.Supplier], status_code=201,
+             dependencies=[Depends(sql_budget.limit(4))])
+async def create_suppliers(new_suppliers: List[schemas.NewBulkSupplier], db: Session = Depends(database.get_db)):
+    check_bulk_size(new_suppliers)
+    if not new_suppliers:
+        return []
+    created = await database.run(db, crud.create_suppliers, new_suppliers)
+    return Response(serializers.render(schemas.Supplier, created, many=True), status_code=201,
+                    media_type="application/json")
+
+
+@router.patch("/suppliers/bulk", response_model=List[schemas.BulkResult],
+              dependencies=[Depends(sql_budget.limit(2))])
+async def update_suppliers(supplier_updates: List[schemas.SupplierBulkUpdate], db: Session = Depends(database.get_db)):
+    check_bulk_size(supplier_updates)
+    check_unique_ids([supplier_update.SupplierID for supplier_update in supplier_updates])
+    return await database.run(db, crud.update_suppliers, supplier_updates)
+
+
+@router.delete("/suppliers/bulk", response_model=List[schemas.BulkResult],
+               dependencies=[Depends(sql_budget.limit(2))])
+async def delete_suppliers(ids: List[int] = Query(...), db: Session = Depends(database.get_db)):
+    check_bulk_size(ids)
+    check_unique_ids(ids)
+    return await database.run(db, crud.delete_suppliers, ids)
+
+
+@router.get("/suppliers/{id}", response_model=schemas.Supplier, dependencies=[Depends(sql_budget.limit(1))])
+async def get_supplier(request: Request, id: PositiveInt,
+                       sessions: sessionmaker = Depends(database.read_sessions("suppliers"))):
+    not_modified, validators = versions.table_versions.check(request, (f"suppliers:{id}",))
+    if not_modified is not None:
+        return not_modified
+    cached = cache.response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    async def load():
+        db_supplier = await database.read(sessions, crud.get_supplier, id)
+        if db_supplier is None:
+            raise HTTPException(status_code=404, detail="Supplier not found")
+        return serializers.render(schemas.Supplier, db_supplier)
+
+    body = await coalesce.flights.run("supplier", coalesce.key(request, (f"suppliers:{id}",), sessions), load)
+    return cache.response_cache.store(request, body, tags=(f"suppliers:{id}",), headers=validators)
+
+
+@router.get("/suppliers/{id}/products", response_model=List[schemas.ProductFromSupplier],
+            dependencies=[Depends(sql_budget.limit(2))])
+async def get_products_from_supplier(request: Request, id: PositiveInt, limit: Optional[int] = None,
+                                     cursor: Optional[str] = None,
+                                     sessions: sessionmaker = Depends(database.read_sessions("suppliers"))):
+    limit = pagination.page_size(limit)
+    before_id = pagination.decode_cursor(cursor, "ProductID", 1)[0] if cursor else None
+
+    async def load():
+        db_products_from_supplier = await database.read(sessions, crud.get_products_from_supplier, id, limit + 1,
+                                                        before_id)
+        if not db_products_from_supplier and cursor is None:
+            raise HTTPException(status_code=404)
+        db_products_from_supplier, headers = next_cursor_headers(db_products_from_supplier, limit, "ProductID")
+        return serializers.render(schemas.ProductFromSupplier, db_products_from_supplier, many=True), headers
+
+    body, headers = await coalesce.flights.run("supplier_products",
+                                               coalesce.key(request, ("suppliers",), sessions), load)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.post("/suppliers", response_model=schemas.Supplier, status_code=201,
+             dependencies=[Depends(sql_budget.limit(4))])
 async def create_supplier(new_supplier: schemas.NewSupplier, db: Session = Depends(database.get_db)):
-    return crud.create_supplier(db, new_supplier)
+    return await database.run(db, crud.create_supplier, new_supplier)
 
 
-@router.put("/suppliers/{id}", response_model=schemas.Supplier)
+@router.put("/suppliers/{id}", response_model=schemas.Supplier, dependencies=[Depends(sql_budget.limit(2))])
 async def update_supplier(id: int, supplier_update: schemas.SupplierUpdate, db: Session = Depends(database.get_db)):
-    updated_supplier = crud.update_supplier(db, id, supplier_update)
+    updated_supplier = await database.run(db, crud.update_supplier, id, supplier_update)
     if not updated_supplier:
         raise HTTPException(status_code=404)
     return updated_supplier
 
 
-@router.delete("/suppliers/{id}", status_code=204)
+@router.delete("/suppliers/{id}", status_code=204, dependencies=[Depends(sql_budget.limit(2))])
 async def delete_supplier(id: int, db: Session = Depends(database.get_db)):
-    crud.delete_supplier(db, id)
+    await database.run(db, crud.delete_supplier, id)
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+import analytics
+import boot
+import crud
+import database
+import pagination
+import queries
+import schemas
+import search
+
+# off: ready once the startup event is done. background: the server takes requests while the warm-up runs and
+# /ready answers 503 until it is through. blocking: the startup event runs it, so the port only opens warm.
+WARMUP = os.getenv("WARMUP", "background")
+# connections the ORM pool opens up front
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", str(database.DB_POOL_SIZE)))
+
+logger = logging.getLogger(__name__)
+
+# what the catalog list endpoints run with their default parameters
+CATALOG_QUERIES = [
+    (queries.CATEGORIES, {}),
+    (queries.CUSTOMERS, {}),
+    (queries.PRODUCTS_EXTENDED, {}),
+    (queries.EMPLOYEES["id", False], {"limit": pagination.MAX_PAGE_SIZE + 1, "offset": 0}),
+]
+
+
+def prime_readers(pool):
+    # each reader prepares the statements into its own cache, and the pages they touch end up in the OS cache.
+    # The server may already take requests: the readers are checked out one at a time, and one that does not
+    # come free in time is left to the requests to warm up.
+    for _ in range(pool.size):
+        try:
+            with pool.reader(rotate=True) as connection:
+                for query, parameters in CATALOG_QUERIES:
+                    queries.fetchall(connection, query, parameters)
+                for kind in ("products", "customers"):
+                    search.catalog.northwind(connection, kind, "warm", 1)
+        except HTTPException:
+            logger.warning("warm-up could not check out a reader, the busy ones stay cold")
+            return
+
+
+def prime_session(db, primary):
+    # importing models.py, configuring its mappers and compiling each statement otherwise happen on the first
+    # request that needs them
+    crud.get_shippers(db)
+    crud.get_suppliers(db, pagination.MAX_PAGE_SIZE + 1, None, tuple(schemas.SupplierSimplified.__fields__))
+    if primary:
+        # /search reads suppliers on the primary, its in-memory index must not be loaded from a replica
+        search.catalog.suppliers(db, "warm", 1)
+
+
+def open_connections(engine, count):
+    connections = [engine.connect() for _ in range(count)]
+    for connection in connections:
+        connection.close()
+
+
+async def prime_orm():
+    # the primary and every replica reads can go to, each engine has its own pool and compiled statement cache
+    databases = [(database.engine, database.SessionLocal, True),
+                 *((replica.engine, replica.sessions, False) for replica in database.replicas.replicas
+                   if replica.usable)]
+    for engine, sessions, primary in databases:
+        if database.ASYNC_ENGINE:
+            connections = [await engine.connect() for _ in range(WARMUP_CONNECTIONS)]
+            for connection in connections:
+                await connection.close()
+            async with sessions() as db:
+                await db.run_sync(prime_session, primary)
+            continue
+        await run_in_threadpool(open_connections, engine, WARMUP_CONNECTIONS)
+        db = sessions()
+        try:
+            await run_in_threadpool(prime_session, db, primary)
+        finally:
+            db.close()
+
+
+async def run(pool):
+    try:
+        with boot.readiness.phase("warmup"):
+            await run_in_threadpool(prime_readers, pool)
+            # imports numpy and loads the order lines every /analytics report starts from
+            await pool.read(analytics.order_lines.current)
+            await prime_orm()
+    except Exception as e:
+        # the app works cold, only slower: /ready reports it warm with the error rather than holding traffic back
+        # for the life of the process
+        logger.exception("warm-up failed, serving cold")
+        boot.readiness.warm(e)
+    else:
+        boot.readiness.warm()
+
+
+async def start(pool):
+    # -> the background task, if there is one
+    if WARMUP == "background":
+        return asyncio.ensure_future(run(pool))
+    if WARMUP == "blocking":
+        await run(pool)
+    else:
+        boot.readiness.warm()
+    return None